@@ -0,0 +1,310 @@
+# app/assets.py
+"""
+Статика TON Connect, собранная один раз при старте процесса.
+
+  - страница оплаты — неизменяемая оболочка: amount/memo/to читаются в
+    браузере из query-строки, сервер HTML не рендерит;
+  - manifest и иконка — готовые байты;
+  - у каждого ресурса заранее посчитаны gzip/brotli-варианты и strong ETag,
+    запрос с совпавшим If-None-Match получает 304 без тела.
+"""
+from __future__ import annotations
+
+import base64
+import gzip
+import hashlib
+import json
+from typing import Dict, Mapping, Optional, Tuple
+
+from starlette.responses import Response
+
+try:
+    import brotli
+except Exception:
+    brotli = None
+
+# не сжимаем то, что меньше одного TCP-пакета
+_MIN_COMPRESS = 256
+
+
+def _accepts(accept_encoding: str) -> Dict[str, float]:
+    """Accept-Encoding -> {кодировка: q}."""
+    result: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        result[token.strip().lower()] = q
+    return result
+
+
+def _etag_matches(if_none_match: str, etags) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag in etags:
+            return True
+    return False
+
+
+class StaticAsset:
+    """Тело + заранее сжатые варианты + ETag; отдаёт ответ с учётом conditional GET."""
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str, brotli_quality: int = 11):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        # encoding -> (body, etag); у каждого варианта свой strong ETag
+        self.variants: Dict[str, Tuple[bytes, str]] = {"identity": (body, f'"{digest}"')}
+        if len(body) >= _MIN_COMPRESS:
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body):
+                self.variants["gzip"] = (gz, f'"{digest}-gz"')
+            if brotli is not None:
+                br = brotli.compress(body, quality=brotli_quality)
+                if len(br) < len(body):
+                    self.variants["br"] = (br, f'"{digest}-br"')
+        self.etags = frozenset(etag for _, etag in self.variants.values())
+
+    def _pick(self, accept_encoding: str) -> str:
+        if len(self.variants) == 1 or not accept_encoding:
+            return "identity"
+        accepted = _accepts(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                return encoding
+        return "identity"
+
+    def response(self, headers: Mapping[str, str]) -> Response:
+        encoding = self._pick(headers.get("accept-encoding", ""))
+        body, etag = self.variants[encoding]
+        out = {"ETag": etag, "Cache-Control": self.cache_control}
+        if len(self.variants) > 1:
+            out["Vary"] = "Accept-Encoding"
+        inm = headers.get("if-none-match")
+        if inm and _etag_matches(inm, self.etags):
+            return Response(status_code=304, headers=out)
+        if encoding != "identity":
+            out["Content-Encoding"] = encoding
+        return Response(content=body, media_type=self.media_type, headers=out)
+
+
+# 1x1 PNG (прозрачная), чтобы не возиться со статикой
+ICON_B64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAAC0lEQVR4nGNgYAAAAAMAASsJTYQAAAAASUVORK5CYII="
+)
+
+# Оболочка страницы оплаты. Подставляются только константы процесса
+# (__MANIFEST_URL__, __DEFAULT_TO__) — один раз при сборке; всё, что зависит
+# от запроса, страница берёт из location.search.
+PAY_PAGE = """<!doctype html>
+<html lang="ru">
+<head>
+  <meta charset="utf-8" />
+  <meta name="viewport" content="width=device-width,initial-scale=1" />
+  <meta name="ton-connect-manifest" content="__MANIFEST_URL__" />
+  <title>Оплата через TON Connect</title>
+  <style>
+    body { font-family: system-ui,-apple-system,Segoe UI,Roboto,Ubuntu,'Helvetica Neue',Arial; padding: 24px; max-width: 680px; margin: 0 auto; }
+    .card { border: 1px solid #e5e7eb; border-radius: 16px; padding: 20px; }
+    .row { margin: 8px 0; }
+    button { padding: 12px 16px; border-radius: 12px; border: none; cursor: pointer; }
+    #connect { background: #111827; color: white; }
+    #paybtn { background: #2563eb; color: white; }
+    .muted { color: #6b7280; font-size: 14px; }
+    .addr { font-family: ui-monospace, Menlo, Monaco, Consolas, "Liberation Mono", monospace; }
+  </style>
+</head>
+<body>
+  <h1>Оплата через TON Connect</h1>
+  <div class="card">
+    <div class="row">Получатель: <span class="addr" id="to"></span></div>
+    <div class="row">Сумма: <b id="amt"></b> TON</div>
+    <div class="row">Комментарий: <span id="memo"></span></div>
+    <div class="row muted">Выберите кошелёк и подтвердите перевод.</div>
+    <div class="row" style="display:flex; gap:10px; margin-top:16px;">
+      <button id="connect">Подключить кошелёк</button>
+      <button id="paybtn">Оплатить</button>
+    </div>
+    <div class="row muted" id="status" style="margin-top:12px;"></div>
+  </div>
+
+  <script type="module">
+    import { TonConnectUI } from "https://unpkg.com/@tonconnect/ui@latest/dist/tonconnect-ui.min.js";
+
+    const manifestUrl = "__MANIFEST_URL__";
+    const tonConnectUI = new TonConnectUI({ manifestUrl });
+
+    // параметры платежа — из query-строки, HTML одинаковый для всех
+    const params = new URLSearchParams(location.search);
+    const toAddr = params.get("to") || "__DEFAULT_TO__";
+    const amountTON = (params.get("amount") || "").trim();
+    const memo = params.get("memo") || "";
+
+    document.getElementById("to").textContent = toAddr;
+    document.getElementById("amt").textContent = amountTON;
+    document.getElementById("memo").textContent = memo || "—";
+
+    // TON-строка -> нанотоны целочисленно, без float (0.1 * 1e9 и т.п.)
+    function tonToNano(s) {
+      const m = /^(\\d+)(?:\\.(\\d{1,9}))?$/.exec(s);
+      if (!m) return null;
+      return (BigInt(m[1]) * 1000000000n + BigInt((m[2] || "").padEnd(9, "0"))).toString();
+    }
+    const amountNano = tonToNano(amountTON);
+
+    const statusEl = document.getElementById("status");
+    const setStatus = (t) => statusEl.textContent = t;
+
+    document.getElementById("connect").onclick = async () => {
+      try {
+        await tonConnectUI.openModal();
+      } catch (e) {
+        setStatus("Не удалось открыть список кошельков: " + e);
+      }
+    };
+
+    // Текстовый комментарий (op 0 + UTF-8, хвост — цепочкой ячеек) как BoC
+    // base64: по нему вочер находит депозит, без него платёж не зачислится
+    function crc32c(bytes) {
+      let c = 0xffffffff;
+      for (const b of bytes) {
+        c ^= b;
+        for (let k = 0; k < 8; k++) c = (c >>> 1) ^ (0x82f63b78 & -(c & 1));
+      }
+      return (c ^ 0xffffffff) >>> 0;
+    }
+    function addCommentPayload(text) {
+      if (!text) return undefined;
+      const bytes = new TextEncoder().encode(text);
+      const first = new Uint8Array(4 + Math.min(bytes.length, 123));
+      first.set(bytes.subarray(0, 123), 4);
+      const chunks = [first];
+      for (let i = 123; i < bytes.length; i += 127) chunks.push(bytes.subarray(i, i + 127));
+      const cells = [];
+      chunks.forEach((data, i) => {
+        const last = i === chunks.length - 1;
+        cells.push(last ? 0 : 1, data.length * 2, ...data);
+        if (!last) cells.push(i + 1);
+      });
+      if (chunks.length > 255 || cells.length > 0xffff) return undefined;
+      const off = cells.length > 0xff ? 2 : 1;
+      const size = off === 2 ? [cells.length >> 8, cells.length & 0xff] : [cells.length];
+      // magic, has_crc32c + size_bytes=1, off_bytes, cells, roots=1, absent=0, tot_cells_size, root=0
+      const boc = [0xb5, 0xee, 0x9c, 0x72, 0x41, off, chunks.length, 1, 0, ...size, 0, ...cells];
+      const crc = crc32c(boc);
+      boc.push(crc & 0xff, (crc >>> 8) & 0xff, (crc >>> 16) & 0xff, crc >>> 24);
+      return btoa(String.fromCharCode(...boc));
+    }
+
+    function buildTx() {
+      return {
+        validUntil: Math.floor(Date.now()/1000) + 600,
+        messages: [{
+          address: toAddr,
+          amount: amountNano,
+          payload: addCommentPayload(memo)
+        }]
+      };
+    }
+
+    document.getElementById("paybtn").onclick = async () => {
+      try {
+        if (amountNano === null) {
+          setStatus("Некорректная сумма: " + amountTON);
+          return;
+        }
+        if (!tonConnectUI.account) {
+          await tonConnectUI.openModal();
+        }
+        const tx = buildTx();
+        await tonConnectUI.sendTransaction(tx);
+        setStatus("Запрос на транзакцию отправлен в кошелёк.");
+      } catch (e) {
+        setStatus("Ошибка: " + (e?.message || e));
+      }
+    };
+
+    // Статус оплаты: long-poll /pay/status, сервер отвечает при событии вочера
+    const STATUS_TEXT = {
+      seen: "Платёж найден в сети, ждём подтверждения…",
+      confirmed: "Платёж подтверждён, зачисляем…",
+      credited: "✅ Оплата зачислена. Можно вернуться в бота.",
+    };
+    async function watchStatus() {
+      if (!memo) return;
+      const after = Math.floor(Date.now() / 1000) - 60;  // запас на расхождение часов
+      let since = "pending";
+      while (since !== "credited") {
+        try {
+          const q = new URLSearchParams({ memo, since, after: String(after) });
+          const r = await fetch("/pay/status?" + q, { cache: "no-store" });
+          if (!r.ok) throw new Error(r.status);
+          const d = await r.json();
+          if (d.status !== since && STATUS_TEXT[d.status]) {
+            since = d.status;
+            setStatus(STATUS_TEXT[d.status]);
+          }
+        } catch (e) {
+          await new Promise((ok) => setTimeout(ok, 5000));
+        }
+      }
+    }
+    watchStatus();
+  </script>
+</body>
+</html>
+"""
+
+
+def _js_string(value: str) -> str:
+    """Значение для подстановки внутрь "..." в <script> (без закрытия тега)."""
+    return json.dumps(value)[1:-1].replace("</", "<\\/")
+
+
+class PayAssets:
+    """Страница оплаты, manifest и иконка для одного BASE_URL/TON_ADDRESS."""
+
+    def __init__(self, base_url: str, ton_address: str, name: str = "Bot Payments"):
+        base = base_url.rstrip("/")
+        manifest_url = f"{base}/tonconnect-manifest.json"
+        page = (
+            PAY_PAGE
+            .replace("__MANIFEST_URL__", _js_string(manifest_url))
+            .replace("__DEFAULT_TO__", _js_string(ton_address))
+        )
+        # оболочка меняется только с деплоем — час кэша + ревалидация по ETag
+        self.pay = StaticAsset(
+            page.encode("utf-8"), "text/html; charset=utf-8",
+            "public, max-age=3600, stale-while-revalidate=86400",
+        )
+        manifest = {"url": base, "name": name, "iconUrl": f"{base}/icon.png"}
+        self.manifest = StaticAsset(
+            json.dumps(manifest, ensure_ascii=False).encode("utf-8"), "application/json",
+            "public, max-age=86400",
+        )
+        self.icon = StaticAsset(base64.b64decode(ICON_B64), "image/png", "public, max-age=31536000, immutable")
+
+
+def build_pay_assets(settings) -> PayAssets:
+    return PayAssets(str(settings.base_url), settings.ton_address)
+
+
+_assets: Optional[PayAssets] = None
+
+
+def get_pay_assets(settings) -> PayAssets:
+    global _assets
+    if _assets is None:
+        _assets = build_pay_assets(settings)
+    return _assets
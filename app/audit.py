@@ -0,0 +1,220 @@
+# app/audit.py
+"""
+Аудит-лог (audit_logs) с пакетной записью в фоне.
+
+audit("payment_credited", user_id, amount=..., payment_id=...) не ходит в
+БД: событие кладётся в ограниченный буфер процесса, фоновая задача пишет
+его пачками — одним multi-row INSERT, когда набралось AUDIT_BATCH_SIZE
+событий или прошло AUDIT_FLUSH_INTERVAL секунд. Переполнение буфера
+(AUDIT_MAX_PENDING) — по AUDIT_OVERFLOW: drop_oldest (по умолчанию) или
+drop_new. При остановке остаток дописывается (close_audit в on_shutdown).
+
+Старые записи удаляет run_audit_retention (крутит лидер) порциями по id,
+таблица индексирована BRIN по created_at.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+try:
+    import structlog
+    log = structlog.get_logger()
+except Exception:
+    import logging
+    log = logging.getLogger("audit")
+
+from . import db as _db
+from .metrics import Counter, Gauge, Histogram
+from .models import AuditLog
+
+PENDING = Gauge("audit_log_pending", "Audit events buffered in memory")
+WRITTEN = Counter("audit_log_written_total", "Audit events written to the database")
+DROPPED = Counter("audit_log_dropped_total", "Audit events dropped because the buffer was full")
+FLUSH_TIME = Histogram("audit_log_flush_seconds", "Time to write one batch of audit events")
+PRUNED = Counter("audit_log_pruned_total", "Audit rows deleted by the retention job")
+
+# 4 колонки на строку, у Postgres лимит 65535 параметров на запрос
+MAX_BATCH = 10_000
+
+
+class AuditWriter:
+    def __init__(
+        self,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_pending: int = 50_000,
+        overflow: str = "drop_oldest",
+    ):
+        self.batch_size = max(1, min(batch_size, MAX_BATCH))
+        self.flush_interval = flush_interval
+        self.max_pending = max(self.batch_size, max_pending)
+        self.overflow = overflow
+        self._buf: Deque[Dict[str, Any]] = deque()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    # --- API ------------------------------------------------------------------
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def log(self, event: str, user_id: Optional[int] = None, **data: Any) -> bool:
+        """Ставит событие в буфер; False — если оно отброшено (drop_new при переполнении)."""
+        if len(self._buf) >= self.max_pending:
+            DROPPED.inc()
+            if self.overflow == "drop_new":
+                return False
+            self._buf.popleft()
+        self._buf.append({
+            "user_id": user_id,
+            "event": event[:64],
+            "data": json.dumps(data, ensure_ascii=False, default=str),
+            "created_at": datetime.now(timezone.utc),
+        })
+        PENDING.set(len(self._buf))
+        if len(self._buf) >= self.batch_size:
+            self._wake.set()
+        return True
+
+    async def flush(self) -> int:
+        """Пишет всё, что накопилось, пачками; возвращает число записанных событий."""
+        written = 0
+        while self._buf:
+            n = await self._write_batch()
+            if not n:
+                break
+            written += n
+        return written
+
+    async def close(self, timeout: float = 10.0) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except Exception as e:
+            try:
+                log.error("audit_log_lost_on_shutdown", left=len(self._buf), error=str(e))
+            except Exception:
+                pass
+
+    # --- internals ------------------------------------------------------------
+    async def _write_batch(self) -> int:
+        rows = [self._buf.popleft() for _ in range(min(self.batch_size, len(self._buf)))]
+        if not rows:
+            return 0
+        try:
+            with FLUSH_TIME.time():
+                async with _db.AsyncSessionLocal() as db:
+                    await db.execute(pg_insert(AuditLog).values(rows))
+                    await db.commit()
+        except Exception:
+            # возвращаем пачку в начало буфера, не превышая лимит
+            room = self.max_pending - len(self._buf)
+            if room < len(rows):
+                DROPPED.inc(len(rows) - max(0, room))
+                rows = rows[len(rows) - max(0, room):] if room > 0 else []
+            self._buf.extendleft(reversed(rows))
+            PENDING.set(len(self._buf))
+            raise
+        WRITTEN.inc(len(rows))
+        PENDING.set(len(self._buf))
+        return len(rows)
+
+    async def _run(self) -> None:
+        delay = self.flush_interval
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), delay)
+            self._wake.clear()
+            try:
+                while self._buf:
+                    await self._write_batch()
+                    if len(self._buf) < self.batch_size:
+                        break
+                delay = self.flush_interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # БД недоступна — буфер копится (с учётом лимита), пробуем реже
+                delay = min(30.0, max(delay, self.flush_interval) * 2)
+                try:
+                    log.error("audit_log_flush_error", pending=len(self._buf), error=str(e))
+                except Exception:
+                    pass
+
+
+# --- Общий writer процесса (создаётся в on_startup) --------------------------
+_writer: Optional[AuditWriter] = None
+
+
+def init_audit(settings) -> AuditWriter:
+    global _writer
+    _writer = AuditWriter(
+        batch_size=settings.audit_batch_size,
+        flush_interval=settings.audit_flush_interval,
+        max_pending=settings.audit_max_pending,
+        overflow=settings.audit_overflow,
+    )
+    _writer.start()
+    return _writer
+
+
+def audit(event: str, user_id: Optional[int] = None, **data: Any) -> None:
+    """Записать событие аудита (без ожидания БД); до init_audit — no-op."""
+    if _writer is not None:
+        _writer.log(event, user_id, **data)
+
+
+async def close_audit(timeout: float = 10.0) -> None:
+    global _writer
+    if _writer is not None:
+        await _writer.close(timeout)
+    _writer = None
+
+
+# --- Retention ---------------------------------------------------------------
+async def prune_audit(days: int, batch: int = 10_000) -> int:
+    """Удаляет записи старше days дней порциями по batch (короткие транзакции); возвращает число удалённых."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    removed = 0
+    while True:
+        async with _db.AsyncSessionLocal() as db:
+            old = select(AuditLog.id).where(AuditLog.created_at < cutoff).limit(batch).scalar_subquery()
+            n = (await db.execute(delete(AuditLog).where(AuditLog.id.in_(old)))).rowcount or 0
+            await db.commit()
+        removed += n
+        PRUNED.inc(n)
+        if n < batch:
+            return removed
+        await asyncio.sleep(0)
+
+
+async def run_audit_retention(settings) -> None:
+    while True:
+        if settings.audit_retention_days > 0:
+            try:
+                removed = await prune_audit(settings.audit_retention_days)
+                if removed:
+                    try:
+                        log.info("audit_log_pruned", removed=removed)
+                    except Exception:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                try:
+                    log.error("audit_log_prune_error", error=str(e))
+                except Exception:
+                    pass
+        await asyncio.sleep(settings.audit_retention_interval)
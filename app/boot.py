@@ -0,0 +1,55 @@
+# app/boot.py
+"""
+Отчёт о холодном старте: сколько заняли импорты и каждая фаза startup.
+
+    with boot.phase("tg_app"): ...
+    boot.report(settings.startup_budget_seconds)
+
+Отсчёт — от первого импорта этого модуля (он идёт первым в app.web).
+Итог пишется в лог (startup_report) и в метрику app_startup_seconds; при
+превышении бюджета — предупреждение. Детальная разбивка импортов —
+`python -X importtime -c "import app.web"`.
+"""
+from __future__ import annotations
+
+import contextlib
+import time
+from typing import Dict, Iterator, List, Tuple
+
+try:
+    import structlog
+    log = structlog.get_logger()
+except Exception:
+    import logging
+    log = logging.getLogger("boot")
+
+from .metrics import Gauge
+
+STARTUP = Gauge("app_startup_seconds", "Time from importing app.web to the end of startup")
+
+_t0 = time.perf_counter()
+_phases: List[Tuple[str, float]] = []
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.perf_counter() - t0))
+
+
+def report(budget: float = 0.0) -> Dict[str, float]:
+    """Фазы в мс + total; вызывать в конце startup."""
+    total = time.perf_counter() - _t0
+    STARTUP.set(total)
+    out = {name: round(sec * 1000, 1) for name, sec in _phases}
+    out["total"] = round(total * 1000, 1)
+    try:
+        log.info("startup_report", **{f"{k}_ms": v for k, v in out.items()})
+        if budget and total > budget:
+            log.warning("startup_over_budget", total_ms=out["total"], budget_ms=round(budget * 1000))
+    except Exception:
+        pass
+    return out
@@ -3,6 +3,7 @@ from __future__ import annotations
 
 import os
 from decimal import Decimal
+from functools import lru_cache
 from typing import List
 
 from pydantic import Field, SecretStr, AnyUrl, AliasChoices
@@ -25,22 +26,117 @@ class Settings(BaseSettings):
     port: int = Field(default=8080, validation_alias=AliasChoices("PORT", "port"))
     webhook_path: str = Field(default="/webhook/telegram", validation_alias=AliasChoices("WEBHOOK_PATH", "webhook_path"))
     telegram_webhook_secret: str = Field(validation_alias=AliasChoices("TELEGRAM_WEBHOOK_SECRET", "telegram_webhook_secret"))
+    update_workers: int = Field(default=8, validation_alias=AliasChoices("UPDATE_WORKERS", "update_workers"))
+    update_queue_size: int = Field(default=1000, validation_alias=AliasChoices("UPDATE_QUEUE_SIZE", "update_queue_size"))
+    update_drain_timeout: float = Field(default=10.0, validation_alias=AliasChoices("UPDATE_DRAIN_TIMEOUT", "update_drain_timeout"))
+    # дедупликация update_id: memory (только процесс) или postgres (общая для инстансов)
+    update_dedupe_backend: str = Field(default="memory", validation_alias=AliasChoices("UPDATE_DEDUPE_BACKEND", "update_dedupe_backend"))
+    update_dedupe_ttl: float = Field(default=3600.0, validation_alias=AliasChoices("UPDATE_DEDUPE_TTL", "update_dedupe_ttl"))
+    update_dedupe_size: int = Field(default=100_000, validation_alias=AliasChoices("UPDATE_DEDUPE_SIZE", "update_dedupe_size"))
+    # статус оплаты (/pay/status): memory — события только в процессе вочера, postgres — LISTEN/NOTIFY
+    pay_status_backend: str = Field(default="memory", validation_alias=AliasChoices("PAY_STATUS_BACKEND", "pay_status_backend"))
+    pay_status_max_wait: float = Field(default=25.0, validation_alias=AliasChoices("PAY_STATUS_MAX_WAIT", "pay_status_max_wait"))
+    pay_status_cache_size: int = Field(default=100_000, validation_alias=AliasChoices("PAY_STATUS_CACHE_SIZE", "pay_status_cache_size"))
+    # memory-бэкенд: как часто перечитывать из БД статус, который процесс не видит событиями (не лидер)
+    pay_status_db_ttl: float = Field(default=5.0, validation_alias=AliasChoices("PAY_STATUS_DB_TTL", "pay_status_db_ttl"))
+    # ссылки оплаты и QR: кэш ссылок по числу троек, отрисованных QR — по байтам
+    pay_link_cache_size: int = Field(default=10_000, validation_alias=AliasChoices("PAY_LINK_CACHE_SIZE", "pay_link_cache_size"))
+    qr_cache_bytes: int = Field(default=8 << 20, validation_alias=AliasChoices("QR_CACHE_BYTES", "qr_cache_bytes"))
+    # аудит-лог: пакетная запись в фоне и ретенция
+    audit_batch_size: int = Field(default=500, validation_alias=AliasChoices("AUDIT_BATCH_SIZE", "audit_batch_size"))
+    audit_flush_interval: float = Field(default=1.0, validation_alias=AliasChoices("AUDIT_FLUSH_INTERVAL", "audit_flush_interval"))
+    audit_max_pending: int = Field(default=50_000, validation_alias=AliasChoices("AUDIT_MAX_PENDING", "audit_max_pending"))
+    audit_overflow: str = Field(default="drop_oldest", validation_alias=AliasChoices("AUDIT_OVERFLOW", "audit_overflow"))
+    audit_retention_days: int = Field(default=90, validation_alias=AliasChoices("AUDIT_RETENTION_DAYS", "audit_retention_days"))
+    audit_retention_interval: float = Field(default=3600.0, validation_alias=AliasChoices("AUDIT_RETENTION_INTERVAL", "audit_retention_interval"))
+    # выводы: сервис highload-кошелька (пусто — воркер выводов выключен)
+    withdraw_api_url: str = Field(default="", validation_alias=AliasChoices("WITHDRAW_API_URL", "withdraw_api_url"))
+    withdraw_api_key: str = Field(default="", validation_alias=AliasChoices("WITHDRAW_API_KEY", "withdraw_api_key"))
+    withdraw_batch_size: int = Field(default=254, validation_alias=AliasChoices("WITHDRAW_BATCH_SIZE", "withdraw_batch_size"))
+    withdraw_interval: float = Field(default=2.0, validation_alias=AliasChoices("WITHDRAW_INTERVAL", "withdraw_interval"))
+    withdraw_workers: int = Field(default=1, validation_alias=AliasChoices("WITHDRAW_WORKERS", "withdraw_workers"))
+    withdraw_resend_after: float = Field(default=30.0, validation_alias=AliasChoices("WITHDRAW_RESEND_AFTER", "withdraw_resend_after"))
+    # исходящие сообщения: лимиты Telegram
+    tg_global_rate: float = Field(default=30.0, validation_alias=AliasChoices("TG_GLOBAL_RATE", "tg_global_rate"))
+    tg_per_chat_rate: float = Field(default=1.0, validation_alias=AliasChoices("TG_PER_CHAT_RATE", "tg_per_chat_rate"))
+    tg_outbound_queue_size: int = Field(default=10_000, validation_alias=AliasChoices("TG_OUTBOUND_QUEUE_SIZE", "tg_outbound_queue_size"))
+    # отдельная ёмкость для уведомлений о платежах (рассылка её не занимает)
+    tg_outbound_reserve: int = Field(default=1000, validation_alias=AliasChoices("TG_OUTBOUND_RESERVE", "tg_outbound_reserve"))
+    # бюджет холодного старта: больше — предупреждение в логе (0 — не проверять)
+    startup_budget_seconds: float = Field(default=3.0, validation_alias=AliasChoices("STARTUP_BUDGET_SECONDS", "startup_budget_seconds"))
+    # профилировщик медленных запросов (0 — выключен)
+    profile_slow_ms: float = Field(default=0.0, validation_alias=AliasChoices("PROFILE_SLOW_MS", "profile_slow_ms"))
+    profile_interval_ms: float = Field(default=5.0, validation_alias=AliasChoices("PROFILE_INTERVAL_MS", "profile_interval_ms"))
+    profile_dir: str = Field(default="/tmp/profiles", validation_alias=AliasChoices("PROFILE_DIR", "profile_dir"))
     admin_ids: List[int] = Field(default_factory=list, validation_alias=AliasChoices("ADMIN_IDS", "admin_ids"))
 
     # DB
     database_url: str = Field(validation_alias=AliasChoices("DATABASE_URL", "database_url"))
+    db_pool_size: int = Field(default=5, validation_alias=AliasChoices("DB_POOL_SIZE", "db_pool_size"))
+    db_max_overflow: int = Field(default=10, validation_alias=AliasChoices("DB_MAX_OVERFLOW", "db_max_overflow"))
+    db_pool_recycle: int = Field(default=1800, validation_alias=AliasChoices("DB_POOL_RECYCLE", "db_pool_recycle"))
+    db_pool_timeout: int = Field(default=30, validation_alias=AliasChoices("DB_POOL_TIMEOUT", "db_pool_timeout"))
+    # выбор лидера для фоновых задач (advisory lock)
+    leader_lease_seconds: float = Field(default=30.0, validation_alias=AliasChoices("LEADER_LEASE_SECONDS", "leader_lease_seconds"))
+    leader_retry_seconds: float = Field(default=5.0, validation_alias=AliasChoices("LEADER_RETRY_SECONDS", "leader_retry_seconds"))
 
     # TON watcher
-    ton_api_base: AnyUrl = Field(validation_alias=AliasChoices("TON_API_BASE", "ton_api_base"))
+    # TON_API_BASE может содержать несколько endpoint'ов через запятую (failover)
+    ton_api_base: str = Field(validation_alias=AliasChoices("TON_API_BASE", "ton_api_base"))
     ton_api_key: str = Field(validation_alias=AliasChoices("TON_API_KEY", "ton_api_key"))
+    ton_api_rps: float = Field(default=10.0, validation_alias=AliasChoices("TON_API_RPS", "ton_api_rps"))
+    ton_http_max_connections: int = Field(default=10, validation_alias=AliasChoices("TON_HTTP_MAX_CONNECTIONS", "ton_http_max_connections"))
     ton_address: str = Field(validation_alias=AliasChoices("TON_ADDRESS", "ton_address"))
+    # дополнительные кошельки для депозитов (шардирование), через запятую
+    ton_extra_addresses: str = Field(default="", validation_alias=AliasChoices("TON_ADDRESSES", "ton_extra_addresses"))
+    ton_watch_concurrency: int = Field(default=4, validation_alias=AliasChoices("TON_WATCH_CONCURRENCY", "ton_watch_concurrency"))
     ton_poll_interval: int = Field(default=5, validation_alias=AliasChoices("TON_POLL_INTERVAL", "ton_poll_interval"))
+    ton_poll_min_interval: float = Field(default=1.0, validation_alias=AliasChoices("TON_POLL_MIN_INTERVAL", "ton_poll_min_interval"))
+    ton_poll_max_interval: float = Field(default=30.0, validation_alias=AliasChoices("TON_POLL_MAX_INTERVAL", "ton_poll_max_interval"))
+    ton_poll_fast_window: int = Field(default=600, validation_alias=AliasChoices("TON_POLL_FAST_WINDOW", "ton_poll_fast_window"))
+    ton_page_limit: int = Field(default=100, validation_alias=AliasChoices("TON_PAGE_LIMIT", "ton_page_limit"))
     ton_min_deposit: Decimal = Field(default=Decimal("0"), validation_alias=AliasChoices("TON_MIN_DEPOSIT", "ton_min_deposit"))
     ton_require_depth: int = Field(default=1, validation_alias=AliasChoices("TON_REQUIRE_DEPTH", "ton_require_depth"))
     deposit_mode: str = Field(default="comment", validation_alias=AliasChoices("DEPOSIT_MODE", "deposit_mode"))
     deposit_tag_prefix: str = Field(default="P4V", validation_alias=AliasChoices("DEPOSIT_TAG_PREFIX", "deposit_tag_prefix"))
+    tag_pool_target: int = Field(default=1000, validation_alias=AliasChoices("TAG_POOL_TARGET", "tag_pool_target"))
+    tag_pool_batch: int = Field(default=500, validation_alias=AliasChoices("TAG_POOL_BATCH", "tag_pool_batch"))
+    tag_pool_refill_interval: float = Field(default=30.0, validation_alias=AliasChoices("TAG_POOL_REFILL_INTERVAL", "tag_pool_refill_interval"))
+    tag_cache_size: int = Field(default=100_000, validation_alias=AliasChoices("TAG_CACHE_SIZE", "tag_cache_size"))
+    # реестр пользователей: LRU tg_id -> user_id, смена языка пишется пачками в фоне
+    user_cache_size: int = Field(default=100_000, validation_alias=AliasChoices("USER_CACHE_SIZE", "user_cache_size"))
+    user_flush_interval: float = Field(default=2.0, validation_alias=AliasChoices("USER_FLUSH_INTERVAL", "user_flush_interval"))
+    user_flush_batch: int = Field(default=1000, validation_alias=AliasChoices("USER_FLUSH_BATCH", "user_flush_batch"))
     default_deposit_amount: str = Field(default="0", validation_alias=AliasChoices("DEFAULT_DEPOSIT_AMOUNT", "default_deposit_amount"))
 
+    @property
+    def ton_min_deposit_nano(self) -> int:
+        from .money import to_nano
+        return to_nano(self.ton_min_deposit)
+
+    @property
+    def ton_addresses(self) -> List[str]:
+        """Все адреса, которые слушает вочер: TON_ADDRESS + TON_ADDRESSES, без дублей."""
+        out = [self.ton_address]
+        for a in self.ton_extra_addresses.replace(";", ",").split(","):
+            a = a.strip()
+            if a and a not in out:
+                out.append(a)
+        return out
+
+    @property
+    def ton_api_bases(self) -> List[str]:
+        return [b.strip().rstrip("/") for b in self.ton_api_base.replace(";", ",").split(",") if b.strip()]
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Settings на весь процесс: .env, правка окружения и валидация pydantic —
+    один раз, все модули получают один и тот же объект.
+    """
+    return load_settings()
+
 
 def load_settings() -> Settings:
     # Разрешаем подтягивать .env локально
@@ -1,12 +1,38 @@
 # app/db.py
 from __future__ import annotations
+import time
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from .metrics import Gauge, Histogram
 
 engine = None
 SessionLocal = None
+async_engine = None
+AsyncSessionLocal = None
 Base = declarative_base()
 
+POOL_WAIT = Histogram(
+    "db_pool_checkout_seconds", "Time to get a connection from the async pool (incl. opening a new one)",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+POOL_IN_USE = Gauge("db_pool_checked_out", "Async pool connections currently checked out")
+
+
+class _TimedPool(AsyncAdaptedQueuePool):
+    """Пул async-движка, который меряет ожидание свободного соединения."""
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - t0)
+
+
 def _normalize_db_url(url: str) -> str:
     # Render иногда даёт postgres:// — нормализуем
     if url.startswith("postgres://"):
@@ -16,8 +42,41 @@ def _normalize_db_url(url: str) -> str:
         url = url.replace("postgresql://", "postgresql+psycopg://", 1)
     return url
 
-def init_db(database_url: str):
+def _pool_kwargs(settings) -> dict:
+    if settings is None:
+        return {}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_timeout": settings.db_pool_timeout,
+    }
+
+def init_db(database_url: str, settings=None):
+    """Синхронный движок — для CLI (reconcile) и миграций."""
     global engine, SessionLocal
     database_url = _normalize_db_url(database_url)
-    engine = create_engine(database_url, pool_pre_ping=True, future=True)
+    engine = create_engine(database_url, pool_pre_ping=True, future=True, **_pool_kwargs(settings))
     SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True)
+
+def init_async_db(database_url: str, settings=None):
+    """
+    Асинхронный движок (psycopg3 async) — для всего, что работает внутри
+    event loop (вочер, хендлеры), чтобы запросы не блокировали вебхук.
+    Размер пула/overflow/recycle берутся из Settings (DB_POOL_*).
+    """
+    global async_engine, AsyncSessionLocal
+    database_url = _normalize_db_url(database_url)
+    if "+psycopg2" in database_url:
+        # psycopg2 не умеет async — переключаемся на psycopg (v3)
+        database_url = database_url.replace("+psycopg2", "+psycopg", 1)
+    async_engine = create_async_engine(database_url, pool_pre_ping=True, poolclass=_TimedPool, **_pool_kwargs(settings))
+    POOL_IN_USE.set_function(lambda: async_engine.pool.checkedout() if async_engine is not None else 0)
+    AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
+
+async def dispose_async_db():
+    global async_engine, AsyncSessionLocal
+    if async_engine is not None:
+        await async_engine.dispose()
+    async_engine = None
+    AsyncSessionLocal = None
@@ -0,0 +1,129 @@
+# app/dedupe.py
+"""
+Дедупликация апдейтов Telegram по update_id.
+
+Быстрый путь — in-process TTL-множество (без обращений к БД). Для нескольких
+инстансов можно включить общий бэкенд (UPDATE_DEDUPE_BACKEND=postgres):
+таблица processed_updates с update_id в первичном ключе, «захват» —
+INSERT ... ON CONFLICT DO NOTHING RETURNING. Бэкенд подключаемый — любой
+объект с async claim()/release().
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Protocol
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from . import db as _db
+from .metrics import Counter
+from .models import ProcessedUpdate
+
+LOCAL_HITS = Counter("telegram_update_dedupe_local_hits_total", "Duplicate updates caught by the in-process cache")
+SHARED_HITS = Counter("telegram_update_dedupe_shared_hits_total", "Duplicate updates caught by the shared store")
+MISSES = Counter("telegram_update_dedupe_misses_total", "Updates seen for the first time")
+
+
+class TTLSet:
+    """Ограниченное множество ключей с TTL; самые старые вытесняются первыми."""
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = max(1, maxsize)
+        self._items: "OrderedDict[int, float]" = OrderedDict()
+
+    def _evict(self, now: float) -> None:
+        while self._items:
+            key, expires = next(iter(self._items.items()))
+            if expires > now and len(self._items) < self.maxsize:
+                break
+            self._items.popitem(last=False)
+
+    def add(self, key: int) -> bool:
+        """True, если ключа не было (и он добавлен)."""
+        now = time.monotonic()
+        expires = self._items.get(key)
+        if expires is not None and expires > now:
+            return False
+        self._evict(now)
+        self._items[key] = now + self.ttl
+        self._items.move_to_end(key)
+        return True
+
+    def discard(self, key: int) -> None:
+        self._items.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class SharedDedupe(Protocol):
+    async def claim(self, update_id: int) -> bool: ...
+    async def release(self, update_id: int) -> None: ...
+
+
+class PostgresDedupe:
+    """Общий для инстансов журнал обработанных update_id; старые строки чистятся раз в ttl/10."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._pruned_at = 0.0
+
+    async def claim(self, update_id: int) -> bool:
+        async with _db.AsyncSessionLocal() as db:
+            row = (await db.execute(
+                pg_insert(ProcessedUpdate)
+                .values(update_id=update_id)
+                .on_conflict_do_nothing(index_elements=[ProcessedUpdate.update_id])
+                .returning(ProcessedUpdate.update_id)
+            )).first()
+            now = time.monotonic()
+            if now - self._pruned_at >= self.ttl / 10:
+                self._pruned_at = now
+                cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+                await db.execute(delete(ProcessedUpdate).where(ProcessedUpdate.created_at < cutoff))
+            await db.commit()
+        return row is not None
+
+    async def release(self, update_id: int) -> None:
+        async with _db.AsyncSessionLocal() as db:
+            await db.execute(delete(ProcessedUpdate).where(ProcessedUpdate.update_id == update_id))
+            await db.commit()
+
+
+class UpdateDeduper:
+    def __init__(self, ttl: float = 3600, maxsize: int = 100_000, shared: Optional[SharedDedupe] = None):
+        self.local = TTLSet(ttl, maxsize)
+        self.shared = shared
+
+    async def first_seen(self, update_id: int) -> bool:
+        """True — апдейт новый и «захвачен» этим процессом; False — дубликат."""
+        if not self.local.add(update_id):
+            LOCAL_HITS.inc()
+            return False
+        if self.shared is not None:
+            try:
+                claimed = await self.shared.claim(update_id)
+            except BaseException:
+                # захват не состоялся — повторная доставка должна пройти
+                self.local.discard(update_id)
+                raise
+            if not claimed:
+                SHARED_HITS.inc()
+                return False
+        MISSES.inc()
+        return True
+
+    async def forget(self, update_id: int) -> None:
+        """Отпустить захват (апдейт не приняли — пусть повторная доставка пройдёт)."""
+        self.local.discard(update_id)
+        if self.shared is not None:
+            await self.shared.release(update_id)
+
+
+def build_deduper(settings) -> UpdateDeduper:
+    shared = PostgresDedupe(settings.update_dedupe_ttl) if settings.update_dedupe_backend == "postgres" else None
+    return UpdateDeduper(settings.update_dedupe_ttl, settings.update_dedupe_size, shared)
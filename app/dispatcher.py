@@ -0,0 +1,273 @@
+# app/dispatcher.py
+"""
+Исходящие сообщения бота с учётом лимитов Telegram.
+
+  - общий token bucket (TG_GLOBAL_RATE, ~30 msg/s) и bucket на чат
+    (TG_PER_CHAT_RATE, ~1 msg/s);
+  - приоритетная очередь: подтверждения платежей уходят раньше рассылок;
+    у них свой резерв ёмкости (TG_OUTBOUND_RESERVE), так что рассылка,
+    заполнившая TG_OUTBOUND_QUEUE_SIZE, их не задерживает, а send_nowait()
+    ставит их без ожидания (для вочера депозитов);
+  - сообщение в «занятый» чат откладывается, не блокируя остальные;
+  - RetryAfter ставит на паузу всю отправку на указанное время (без штормов 429),
+    сообщение возвращается в очередь, не тратя попытку (до MAX_THROTTLED раз);
+  - broadcast() читает получателей из users порциями (keyset по id), а
+    ограниченная ёмкость очереди даёт естественный backpressure.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from telegram.error import Forbidden, BadRequest, NetworkError, RetryAfter
+
+try:
+    import structlog
+    log = structlog.get_logger()
+except Exception:
+    import logging
+    log = logging.getLogger("dispatcher")
+
+from . import db as _db
+from .metrics import Counter, Gauge
+from .models import User
+from .ratelimit import TokenBucket
+
+PRIORITY_PAYMENT = 0
+PRIORITY_DEFAULT = 5
+PRIORITY_BROADCAST = 10
+
+MAX_ATTEMPTS = 5
+# RetryAfter — не ошибка доставки: Telegram просит подождать; считаем отдельно,
+# чтобы платёжные уведомления не терялись в шторме 429, но и не крутились вечно
+MAX_THROTTLED = 20
+
+QUEUE_DEPTH = Gauge("telegram_outbound_queue_depth", "Outbound messages waiting to be sent")
+SENT = Counter("telegram_outbound_sent_total", "Outbound messages delivered")
+FAILED = Counter("telegram_outbound_failed_total", "Outbound messages dropped after an error")
+THROTTLED = Counter("telegram_outbound_retry_after_total", "RetryAfter (429) responses from Telegram")
+REJECTED = Counter("telegram_outbound_rejected_total", "Priority messages not queued because the reserve was full")
+
+# (priority, seq, chat_id, text, kwargs, attempts, throttled, reserved)
+_Item = Tuple[int, int, int, str, Dict[str, Any], int, int, bool]
+
+
+class OutboundDispatcher:
+    def __init__(
+        self,
+        bot,
+        global_rate: float = 30.0,
+        per_chat_rate: float = 1.0,
+        max_pending: int = 10_000,
+        max_in_flight: int = 30,
+        max_chats: int = 100_000,
+        reserve: int = 1000,
+    ):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.max_chats = max_chats
+        self._global = TokenBucket(global_rate)
+        self._chats: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._delayed: List[Tuple[float, _Item]] = []  # (ready_at, item) — чат ещё «занят»
+        self._slots = asyncio.Semaphore(max_pending)
+        # ёмкость только для priority <= PRIORITY_PAYMENT
+        self.reserve = max(0, reserve)
+        self._reserved = 0
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._pending = 0
+        self._paused_until = 0.0
+        self._seq = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        self._deliveries: set = set()
+
+    # --- API ------------------------------------------------------------------
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def send(self, chat_id: int, text: str, priority: int = PRIORITY_DEFAULT, **kwargs: Any) -> None:
+        """Ставит сообщение в очередь; ждёт, только если очередь (и для срочных — резерв) заполнена."""
+        if self.send_nowait(chat_id, text, priority, **kwargs):
+            return
+        await self._slots.acquire()
+        self._put(priority, chat_id, text, kwargs, reserved=False)
+
+    def send_nowait(self, chat_id: int, text: str, priority: int = PRIORITY_PAYMENT, **kwargs: Any) -> bool:
+        """Срочное сообщение (priority <= PRIORITY_PAYMENT) в резерв без ожидания; False — резерв исчерпан."""
+        if priority > PRIORITY_PAYMENT:
+            return False
+        if self._reserved >= self.reserve:
+            REJECTED.inc()
+            return False
+        self._reserved += 1
+        self._put(priority, chat_id, text, kwargs, reserved=True)
+        return True
+
+    async def broadcast(self, text: str, chunk: int = 1000, priority: int = PRIORITY_BROADCAST, **kwargs: Any) -> int:
+        """Рассылка всем users порциями по chunk строк; возвращает число поставленных сообщений."""
+        last_id = 0
+        queued = 0
+        while True:
+            async with _db.AsyncSessionLocal() as db:
+                rows = (await db.execute(
+                    select(User.id, User.tg_id).where(User.id > last_id).order_by(User.id).limit(chunk)
+                )).all()
+            if not rows:
+                return queued
+            for user_id, tg_id in rows:
+                await self.send(tg_id, text, priority=priority, **kwargs)
+                queued += 1
+            last_id = rows[-1][0]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Даёт очереди дойти до конца (не дольше timeout) и останавливает отправку."""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        for task in list(self._deliveries):
+            task.cancel()
+        if self._pending:
+            try:
+                log.warning("telegram_outbound_dropped_on_shutdown", left=self._pending)
+            except Exception:
+                pass
+
+    # --- internals ------------------------------------------------------------
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate)
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _next(self) -> _Item:
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                self._queue.put_nowait(heapq.heappop(self._delayed)[1])
+            # ретраи кладутся в _delayed из задач доставки — просыпаемся хотя бы раз в 0.5с
+            timeout = min(0.5, self._delayed[0][0] - now) if self._delayed else 0.5
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                continue
+            bucket = self._chat_bucket(item[2])
+            wait = bucket.delay()
+            if wait > 0:
+                heapq.heappush(self._delayed, (now + wait, item))
+                continue
+            bucket.reserve()
+            return item
+
+    async def _run(self) -> None:
+        while True:
+            item = await self._next()
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self._global.acquire()
+            await self._in_flight.acquire()
+            task = asyncio.create_task(self._deliver(item))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    def _put(self, priority: int, chat_id: int, text: str, kwargs: Dict[str, Any], reserved: bool) -> None:
+        self._pending += 1
+        QUEUE_DEPTH.set(self._pending)
+        self._queue.put_nowait((priority, next(self._seq), chat_id, text, kwargs, 0, 0, reserved))
+
+    def _done(self, item: _Item) -> None:
+        self._pending -= 1
+        QUEUE_DEPTH.set(self._pending)
+        if item[7]:
+            self._reserved -= 1
+        else:
+            self._slots.release()
+
+    async def _deliver(self, item: _Item) -> None:
+        priority, seq, chat_id, text, kwargs, attempts, throttled, reserved = item
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        except RetryAfter as e:
+            THROTTLED.inc()
+            delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._retry(item, 0.0, throttled=True)
+        except (Forbidden, BadRequest) as e:
+            # пользователь заблокировал бота / чат не существует — не повторяем
+            FAILED.inc()
+            self._done(item)
+            try:
+                log.info("telegram_outbound_dropped", chat_id=chat_id, error=str(e))
+            except Exception:
+                pass
+        except NetworkError:
+            self._retry(item, min(30.0, 2.0 ** attempts))
+        except Exception as e:
+            FAILED.inc()
+            self._done(item)
+            try:
+                log.error("telegram_outbound_error", chat_id=chat_id, error=str(e))
+            except Exception:
+                pass
+        else:
+            SENT.inc()
+            self._done(item)
+        finally:
+            self._in_flight.release()
+
+    def _retry(self, item: _Item, delay: float, throttled: bool = False) -> None:
+        priority, seq, chat_id, text, kwargs, attempts, n_throttled, reserved = item
+        if throttled:
+            n_throttled += 1
+        else:
+            attempts += 1
+        if attempts >= MAX_ATTEMPTS or n_throttled >= MAX_THROTTLED:
+            FAILED.inc()
+            self._done(item)
+            return
+        retry = (priority, seq, chat_id, text, kwargs, attempts, n_throttled, reserved)
+        heapq.heappush(self._delayed, (time.monotonic() + delay, retry))
+
+
+# --- Общий диспетчер процесса (создаётся в on_startup) -----------------------
+_dispatcher: Optional[OutboundDispatcher] = None
+
+
+def init_dispatcher(bot, settings) -> OutboundDispatcher:
+    global _dispatcher
+    _dispatcher = OutboundDispatcher(
+        bot,
+        global_rate=settings.tg_global_rate,
+        per_chat_rate=settings.tg_per_chat_rate,
+        max_pending=settings.tg_outbound_queue_size,
+        reserve=settings.tg_outbound_reserve,
+    )
+    _dispatcher.start()
+    return _dispatcher
+
+
+def get_dispatcher() -> Optional[OutboundDispatcher]:
+    return _dispatcher
+
+
+async def close_dispatcher(timeout: float = 10.0) -> None:
+    global _dispatcher
+    if _dispatcher is not None:
+        await _dispatcher.stop(timeout)
+    _dispatcher = None
@@ -0,0 +1,110 @@
+# app/events.py
+"""
+Сигналы между частями приложения, чтобы сервисы не импортировали вочер (и
+наоборот).
+
+Вочер крутится только в процессе-лидере, а тег может запросить любой
+воркер/инстанс: wake_watcher() будит вочер своего процесса и, если есть
+async-движок, шлёт NOTIFY watcher_wake (не чаще раза в WAKE_NOTIFY_EVERY
+секунд на процесс). Лидер слушает канал (run_wake_listener) рядом с вочером.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Callable, Set
+
+from sqlalchemy import text
+
+try:
+    import structlog
+    log = structlog.get_logger()
+except Exception:
+    import logging
+    log = logging.getLogger("events")
+
+from . import db as _db
+
+WAKE_CHANNEL = "watcher_wake"
+# быстрый режим вочера длится TON_POLL_FAST_WINDOW — чаще будить его незачем
+WAKE_NOTIFY_EVERY = 1.0
+
+# Пользователь запросил тег для депозита — вочеру стоит опрашивать чаще
+_watcher_wake = asyncio.Event()
+_last_notify = 0.0
+_notify_tasks: Set[asyncio.Task] = set()
+
+
+async def _notify_wake() -> None:
+    try:
+        async with _db.async_engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text("SELECT pg_notify(:channel, '')"), {"channel": WAKE_CHANNEL})
+    except Exception as e:
+        try:
+            log.warning("watcher_wake_notify_error", error=str(e))
+        except Exception:
+            pass
+
+
+def wake_watcher() -> None:
+    global _last_notify
+    _watcher_wake.set()
+    now = time.monotonic()
+    if _db.async_engine is None or now - _last_notify < WAKE_NOTIFY_EVERY:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    _last_notify = now
+    task = loop.create_task(_notify_wake())
+    _notify_tasks.add(task)
+    task.add_done_callback(_notify_tasks.discard)
+
+
+async def wait_watcher_wake(timeout: float) -> bool:
+    """Ждёт сигнала не дольше timeout; True — если разбудили."""
+    try:
+        await asyncio.wait_for(_watcher_wake.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        return False
+    _watcher_wake.clear()
+    return True
+
+
+async def listen(database_url: str, channel: str, on_payload: Callable[[str], None], retry: float = 5.0) -> None:
+    """LISTEN channel на отдельном соединении; переподключается при обрыве."""
+    import psycopg
+    from sqlalchemy.engine import make_url
+
+    conninfo = make_url(_db._normalize_db_url(database_url)).set(drivername="postgresql").render_as_string(hide_password=False)
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as conn:
+                await conn.execute(f"LISTEN {channel}")
+                try:
+                    log.info("pg_listening", channel=channel)
+                except Exception:
+                    pass
+                async for notify in conn.notifies():
+                    try:
+                        on_payload(notify.payload)
+                    except Exception as e:
+                        try:
+                            log.error("pg_notify_bad_payload", channel=channel, error=str(e))
+                        except Exception:
+                            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            try:
+                log.error("pg_listener_error", channel=channel, error=str(e))
+            except Exception:
+                pass
+        await asyncio.sleep(retry)
+
+
+async def run_wake_listener(database_url: str) -> None:
+    """NOTIFY watcher_wake от других процессов -> wake_watcher этого (крутит лидер)."""
+    await listen(database_url, WAKE_CHANNEL, lambda _: _watcher_wake.set())
@@ -0,0 +1,21 @@
+# app/fastjson.py
+"""JSON-декодер для горячего пути: orjson, если установлен, иначе stdlib json."""
+from __future__ import annotations
+
+from typing import Any, Union
+
+try:
+    import orjson
+
+    BACKEND = "orjson"
+
+    def loads(raw: Union[bytes, str]) -> Any:
+        return orjson.loads(raw)
+
+except ImportError:  # pragma: no cover - зависит от окружения
+    import json
+
+    BACKEND = "json"
+
+    def loads(raw: Union[bytes, str]) -> Any:
+        return json.loads(raw)
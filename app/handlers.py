@@ -1,36 +1,98 @@
 from __future__ import annotations
 
-from urllib.parse import quote
+from typing import FrozenSet, Optional
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, ContextTypes, CommandHandler, CallbackQueryHandler
+from telegram.ext import (
+    Application,
+    CallbackContext,
+    CallbackQueryHandler,
+    ChatMemberHandler,
+    CommandHandler,
+    InlineQueryHandler,
+    MessageHandler,
+    PreCheckoutQueryHandler,
+    TypeHandler,
+)
 
-from .config import load_settings
+try:
+    import structlog
+    log = structlog.get_logger()
+except Exception:
+    import logging
+    log = logging.getLogger("handlers")
 
-settings = load_settings()
+from . import audit, paylinks, tagpool, users
+from .config import get_settings
+from .money import fmt_ton, to_nano
 
+settings = get_settings()
 
-def build_tonconnect_pay_kb(amount_ton: float, memo: str = "") -> InlineKeyboardMarkup:
-    base = str(settings.base_url).rstrip("/")
-    # Добавляем &to=..., чтобы явно передать адрес получателя
-    pay_url = f"{base}/pay?amount={amount_ton}&memo={quote(memo)}&to={settings.ton_address}"
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton(f"Оплатить {amount_ton} TON (TON Connect)", url=pay_url)]]
-    )
+
+class BotContext(CallbackContext):
+    """
+    Контекст хендлеров: user_id — внутренний id пользователя (users.id),
+    его проставляет resolve_user до остальных групп; None — апдейт не от
+    пользователя или БД недоступна.
+    """
+
+    user_id: Optional[int] = None
 
 
-async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def resolve_user(update: Update, context: BotContext):
+    """Пре-хендлер (группа -1): tg_id -> user_id через реестр, без запроса к БД для известных."""
+    tg_user = update.effective_user
+    if tg_user is None:
+        return
+    referrer_id = None
+    message = update.message
+    if message is not None and message.text and message.text.startswith("/start "):
+        referrer_id = users.parse_referrer(message.text.split(maxsplit=1)[1])
+    try:
+        context.user_id = await users.get_registry().resolve(tg_user.id, tg_user.language_code, referrer_id)
+    except Exception as e:
+        try:
+            log.error("user_resolve_error", tg_id=tg_user.id, error=str(e))
+        except Exception:
+            pass
+
+
+def build_tonconnect_pay_kb(amount: int, memo: str = "") -> InlineKeyboardMarkup:
+    """
+    amount — в нанотонах. Ссылки берутся из кэша paylinks; в кнопках только
+    https-варианты (ton:// и tonkeeper:// Telegram в кнопках не принимает —
+    они в QR и в тексте сообщения).
+    """
+    links = paylinks.get_service(settings).links(settings.ton_address, amount, memo)
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"Оплатить {fmt_ton(amount)} TON (TON Connect)", url=links.tonconnect)],
+        [InlineKeyboardButton("Tonkeeper", url=links.tonkeeper_web)],
+        [InlineKeyboardButton("QR-код для оплаты с компьютера", url=links.qr_png)],
+    ])
+
+
+async def cmd_start(update: Update, context: BotContext):
     """
     Простейший стартовый хендлер с кнопкой оплаты.
-    Подставь свою бизнес-логику расчёта суммы/комментария.
+    Комментарий — персональный тег депозита пользователя (из пула, с кэшем).
+    Подставь свою бизнес-логику расчёта суммы.
     """
-    amount_ton = 2.5
-    memo = "demo-order-123"
-    kb = build_tonconnect_pay_kb(amount_ton, memo)
+    amount = to_nano("2.5")
+    tg_user = update.effective_user
+    user_id = context.user_id
+    if user_id is None:
+        # пре-хендлер не достучался до БД — пробуем ещё раз здесь
+        referrer_id = users.parse_referrer(context.args[0] if context.args else None)
+        user_id = await users.get_registry().resolve(tg_user.id, tg_user.language_code, referrer_id)
+    memo = await tagpool.get_deposit_tag(user_id, prefix=settings.deposit_tag_prefix)
+    audit.audit("start", user_id, tg_id=tg_user.id, memo=memo)
+    kb = build_tonconnect_pay_kb(amount, memo)
+    links = paylinks.get_service(settings).links(settings.ton_address, amount, memo)
     text = (
         "👋 Привет! Это демо.\n\n"
-        f"Сумма к оплате: <b>{amount_ton} TON</b>\n"
-        f"Комментарий: <code>{memo}</code>\n\n"
+        f"Сумма к оплате: <b>{fmt_ton(amount)} TON</b>\n"
+        f"Комментарий: <code>{memo}</code>\n"
+        f"Ссылка для кошелька: <code>{links.ton}</code>\n\n"
         "Нажми кнопку, чтобы оплатить через TON Connect."
     )
     await update.effective_chat.send_message(text, reply_markup=kb, parse_mode="HTML")
@@ -38,7 +100,7 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # Если у тебя есть существующие callback-кнопки — добавь сюда нужные обработчики.
 # Оставим пример для будущих расширений:
-async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def on_cb(update: Update, context: BotContext):
     q = update.callback_query
     await q.answer("Окей!")
 
@@ -47,6 +109,45 @@ def register(app: Application):
     """
     Регистрируем хендлеры в PTB Application.
     Если у тебя есть свои — добавляй их тут.
+    В группе -1 — resolve_user: к остальным хендлерам апдейт приходит с
+    context.user_id.
     """
+    app.add_handler(TypeHandler(Update, resolve_user), group=-1)
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CallbackQueryHandler(on_cb))
+
+
+# Какие поля апдейта (типы из allowed_updates) может поймать хендлер каждого класса
+_MESSAGE_TYPES = frozenset({
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "business_message", "edited_business_message",
+})
+_UPDATE_TYPES = (
+    (CommandHandler, frozenset({"message", "edited_message"})),
+    (MessageHandler, _MESSAGE_TYPES),
+    (CallbackQueryHandler, frozenset({"callback_query"})),
+    (InlineQueryHandler, frozenset({"inline_query"})),
+    (PreCheckoutQueryHandler, frozenset({"pre_checkout_query"})),
+    (ChatMemberHandler, frozenset({"my_chat_member", "chat_member"})),
+)
+
+
+def handled_update_types(app: Application) -> Optional[FrozenSet[str]]:
+    """
+    Типы апдейтов, которые хоть кто-то из зарегистрированных хендлеров
+    может обработать. None — есть хендлер неизвестного класса (например,
+    TypeHandler), фильтровать нельзя. Отрицательные группы — пре-хендлеры
+    (resolve_user): сами апдейт не обрабатывают и в расчёт не идут.
+    """
+    types: set = set()
+    for group_id, group in app.handlers.items():
+        if group_id < 0:
+            continue
+        for handler in group:
+            for cls, handled in _UPDATE_TYPES:
+                if isinstance(handler, cls):
+                    types |= handled
+                    break
+            else:
+                return None
+    return frozenset(types)
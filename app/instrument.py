@@ -0,0 +1,201 @@
+# app/instrument.py
+"""
+Инструментирование запросов поверх app.metrics.
+
+  - InstrumentMiddleware — ASGI-middleware: латентность и счётчик ответов
+    по шаблону маршрута (не по URL — кардинальность ограничена);
+  - instrument_handlers() — оборачивает колбэки PTB-хендлеров: время и
+    ошибки по имени колбэка;
+  - SlowRequestProfiler — опциональный (PROFILE_SLOW_MS > 0) сэмплирующий
+    профилировщик: фоновый поток снимает стек потока event loop, пока есть
+    запросы в работе; для запроса дольше порога сэмплы его окна пишутся в
+    PROFILE_DIR в collapsed-формате (flamegraph.pl / speedscope / inferno).
+
+Метрики Toncenter, пула БД и вочера объявлены рядом с кодом, который их
+обновляет (toncenter.py, db.py, ton_watch.py).
+"""
+from __future__ import annotations
+
+import functools
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from collections import Counter as _Tally, deque
+from typing import Deque, List, Optional, Tuple
+
+try:
+    import structlog
+    log = structlog.get_logger()
+except Exception:
+    import logging
+    log = logging.getLogger("instrument")
+
+from .metrics import Counter, Histogram
+
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP responses by route and status", ("method", "route", "status"))
+HANDLER_LATENCY = Histogram("telegram_handler_duration_seconds", "PTB handler callback latency", ("handler",))
+HANDLER_ERRORS = Counter("telegram_handler_errors_total", "PTB handler callbacks that raised", ("handler",))
+SLOW_PROFILES = Counter("slow_request_profiles_total", "Stack profiles dumped for slow requests")
+
+
+# --- HTTP ---------------------------------------------------------------------
+class InstrumentMiddleware:
+    def __init__(self, app, profiler: Optional["SlowRequestProfiler"] = None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        profiler = self.profiler
+        started = profiler.enter() if profiler is not None else 0.0
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            elapsed = time.perf_counter() - t0
+            # роутер кладёт найденный маршрут в scope — берём его шаблон
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_LATENCY.labels(method, route).observe(elapsed)
+            HTTP_REQUESTS.labels(method, route, status).inc()
+            if profiler is not None:
+                profiler.exit(started, f"{method} {route}", elapsed)
+
+
+# --- PTB handlers ---------------------------------------------------------------
+def _wrap_callback(callback, name: str):
+    latency = HANDLER_LATENCY.labels(name)
+    errors = HANDLER_ERRORS.labels(name)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        t0 = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - t0)
+
+    wrapper._instrumented = True
+    return wrapper
+
+
+def instrument_handlers(application) -> None:
+    """Оборачивает колбэки всех уже зарегистрированных хендлеров (повторный вызов безопасен)."""
+    for group in application.handlers.values():
+        for handler in group:
+            callback = getattr(handler, "callback", None)
+            if callback is None or getattr(callback, "_instrumented", False):
+                continue
+            handler.callback = _wrap_callback(callback, getattr(callback, "__name__", type(handler).__name__))
+
+
+# --- Sampling profiler ----------------------------------------------------------
+def _collapse(frame) -> str:
+    """Стек от корня к листу: 'func (file:line);func (file:line)'."""
+    parts: List[str] = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    parts.reverse()
+    return ";".join(parts)
+
+
+class SlowRequestProfiler:
+    """
+    Сэмплы хранятся в кольцевом буфере (keep секунд); пишутся на диск только
+    для медленных запросов и только из фонового потока. Пока запросов в
+    работе нет, поток спит, не снимая стеков. Все запросы крутятся в одном
+    event loop, поэтому в профиль попадает всё, что loop делал в окне запроса.
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.005, out_dir: str = "/tmp/profiles", keep: float = 30.0):
+        self.threshold = threshold
+        self.interval = max(0.001, interval)
+        self.out_dir = out_dir
+        self._samples: Deque[Tuple[float, str]] = deque(maxlen=max(1, int(keep / self.interval)))
+        self._dumps: "queue.SimpleQueue[Tuple[str, float, float]]" = queue.SimpleQueue()
+        self._active = 0
+        self._target: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Вызывать из потока event loop — его стек и сэмплируется."""
+        if self._thread is not None:
+            return
+        self._target = threading.get_ident()
+        os.makedirs(self.out_dir, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def enter(self) -> float:
+        self._active += 1
+        return time.monotonic()
+
+    def exit(self, started: float, label: str, elapsed: float) -> None:
+        self._active -= 1
+        if elapsed >= self.threshold:
+            self._dumps.put((label, started, time.monotonic()))
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            if self._active > 0 and self._target is not None:
+                frame = sys._current_frames().get(self._target)
+                if frame is not None:
+                    self._samples.append((time.monotonic(), _collapse(frame)))
+            while not self._dumps.empty():
+                self._dump(*self._dumps.get_nowait())
+
+    def _dump(self, label: str, started: float, finished: float) -> None:
+        stacks = _Tally(stack for ts, stack in list(self._samples) if started <= ts <= finished)
+        if not stacks:
+            return
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_") or "request"
+        path = os.path.join(self.out_dir, f"{int(time.time() * 1000)}-{name}.folded")
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, n in stacks.most_common():
+                    f.write(f"{stack} {n}\n")
+            SLOW_PROFILES.inc()
+            log.info("slow_request_profile", request=label, ms=round((finished - started) * 1000), path=path)
+        except Exception as e:
+            try:
+                log.error("slow_request_profile_error", error=str(e))
+            except Exception:
+                pass
+
+
+def build_profiler(settings) -> Optional[SlowRequestProfiler]:
+    if settings.profile_slow_ms <= 0:
+        return None
+    return SlowRequestProfiler(
+        settings.profile_slow_ms / 1000,
+        interval=settings.profile_interval_ms / 1000,
+        out_dir=settings.profile_dir,
+    )
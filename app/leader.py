@@ -0,0 +1,104 @@
+# app/leader.py
+"""
+Выбор лидера среди воркеров/инстансов через Postgres advisory lock.
+
+Все процессы обслуживают вебхук, но фоновую задачу (вочер) выполняет только
+тот, кто держит pg_try_advisory_lock(key) на выделенном соединении.
+
+Лиз: соединение лидера стоит в открытой транзакции с
+idle_in_transaction_session_timeout = lease; каждые lease/3 секунд лидер
+делает SELECT 1 и тем самым продлевает его. Если процесс завис или пропала
+сеть, Postgres сам обрывает сессию через lease секунд, лок освобождается, и
+следующий кандидат забирает его в пределах retry секунд. При обычном
+падении процесса сокет закрывается и лок отпускается сразу.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import zlib
+from typing import Awaitable, Callable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+try:
+    import structlog
+    log = structlog.get_logger()
+except Exception:
+    import logging
+    log = logging.getLogger("leader")
+
+from . import db as _db
+from .metrics import Gauge
+
+Job = Callable[[], Awaitable[None]]
+
+
+def lock_key(name: str) -> int:
+    """Стабильный ключ advisory lock по имени задачи."""
+    return zlib.crc32(name.encode("utf-8"))
+
+
+async def _lead(conn: AsyncConnection, job: Job, key: int, lease: float) -> None:
+    renew = max(0.5, lease / 3)
+    task = asyncio.create_task(job())
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=renew)
+            if done:
+                task.result()  # пробрасываем исключение задачи
+                return
+            # продлеваем лиз; если соединение умерло — лок уже не наш
+            await asyncio.wait_for(conn.execute(text("SELECT 1")), timeout=renew)
+    finally:
+        if not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await task
+        try:
+            await asyncio.wait_for(
+                conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": key}), timeout=renew
+            )
+        except BaseException:
+            # не смогли отпустить — закрываем соединение, лок уйдёт вместе с сессией
+            with contextlib.suppress(Exception):
+                await conn.invalidate()
+            raise
+
+
+async def run_as_leader(job: Job, name: str, lease: float = 30.0, retry: float = 5.0) -> None:
+    """
+    Бесконечно пытается стать лидером для задачи name и, став им, выполняет job.
+    Потеря соединения с БД = потеря лидерства: job отменяется, цикл выборов
+    начинается заново.
+    """
+    key = lock_key(name)
+    is_leader = Gauge(f"{name}_is_leader", f"1 if this process runs {name}")
+    while True:
+        try:
+            if _db.async_engine is None:
+                raise RuntimeError("async DB engine is not initialized")
+            async with _db.async_engine.connect() as conn:
+                # SET LOCAL: таймаут живёт только в транзакции лидера и не утекает в пул
+                await conn.execute(
+                    text("SELECT set_config('idle_in_transaction_session_timeout', :ms, true)"),
+                    {"ms": str(int(lease * 1000))},
+                )
+                got = (await conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": key})).scalar()
+                if got:
+                    is_leader.set(1)
+                    try:
+                        log.info("leader_acquired", job=name)
+                    except Exception:
+                        pass
+                    await _lead(conn, job, key, lease)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            try:
+                log.warning("leader_lost", job=name, error=str(e))
+            except Exception:
+                pass
+        is_leader.set(0)
+        await asyncio.sleep(retry)
@@ -0,0 +1,169 @@
+# app/metrics.py
+"""
+Минимальный in-process реестр метрик с выводом в текстовом формате Prometheus.
+Без внешних зависимостей: значения — обычные float, обновление — O(1)
+(гистограмма — O(log buckets)).
+
+Метки: Counter("x_total", "...", ("method", "status")).labels("get", 200).inc().
+Серия на каждый набор значений создаётся при первом обращении, поэтому
+значения меток должны быть из небольшого множества (шаблон маршрута, а не URL).
+"""
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# секунды: от 5 мс до 10 с — вебхук, хендлеры, Toncenter, БД
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str = "", labelnames: Iterable[str] = (), _register: bool = True):
+        self.name = name
+        self.help = help
+        self.labelnames: _Labels = tuple(labelnames)
+        self._children: Dict[_Labels, "_Metric"] = {}
+        self._reset()
+        if _register:
+            _registry[name] = self
+
+    def _reset(self) -> None:
+        self.value = 0.0
+
+    def _child(self) -> "_Metric":
+        return type(self)(self.name, self.help, _register=False)
+
+    def labels(self, *values) -> "_Metric":
+        """Серия с данными значениями меток (в порядке labelnames)."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {key}")
+            child = self._children[key] = self._child()
+        return child
+
+    def _series(self) -> List[Tuple[str, str]]:
+        """[(суффикс+метки, значение)] для одной серии без меток."""
+        return [("", f"{self.value:.15g}")]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        if not self.labelnames:
+            for suffix, value in self._series():
+                lines.append(f"{self.name}{suffix} {value}")
+            return lines
+        for key, child in list(self._children.items()):
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key))
+            for suffix, value in child._series():
+                # суффикс гистограммы может нести свою метку le="..."
+                name, _, own = suffix.partition("{")
+                labels = base + ("," + own.rstrip("}") if own else "")
+                lines.append(f"{self.name}{name}{{{labels}}} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def _reset(self) -> None:
+        self.value = 0.0
+        self._fn: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        self.value = float(value)
+
+    def set_function(self, fn: Callable[[], float]) -> None:
+        """Значение считается в момент выдачи /metrics (размер пула, глубина очереди)."""
+        self._fn = fn
+
+    def _series(self) -> List[Tuple[str, str]]:
+        if self._fn is not None:
+            try:
+                self.value = float(self._fn())
+            except Exception:
+                pass
+        return super()._series()
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class _Timer:
+    __slots__ = ("_hist", "_t0")
+
+    def __init__(self, hist: "Histogram"):
+        self._hist = hist
+
+    def __enter__(self) -> "_Timer":
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._hist.observe(time.perf_counter() - self._t0)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str = "",
+        labelnames: Iterable[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        _register: bool = True,
+    ):
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, _register)
+
+    def _reset(self) -> None:
+        self.counts = [0] * (len(self.buckets) + 1)  # последний — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def _child(self) -> "Histogram":
+        return Histogram(self.name, self.help, buckets=self.buckets, _register=False)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> _Timer:
+        """with HIST.time(): ... — наблюдает длительность блока в секундах."""
+        return _Timer(self)
+
+    def _series(self) -> List[Tuple[str, str]]:
+        out: List[Tuple[str, str]] = []
+        acc = 0
+        for bound, n in zip(self.buckets, self.counts):
+            acc += n
+            out.append((f'_bucket{{le="{bound:.15g}"}}', str(acc)))
+        out.append(('_bucket{le="+Inf"}', str(self.count)))
+        out.append(("_sum", f"{self.sum:.15g}"))
+        out.append(("_count", str(self.count)))
+        return out
+
+
+_registry: Dict[str, _Metric] = {}
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in list(_registry.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
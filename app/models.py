@@ -2,7 +2,6 @@
 from __future__ import annotations
 
 from datetime import datetime
-from decimal import Decimal
 from typing import Optional
 
 from sqlalchemy import (
@@ -10,9 +9,11 @@ from sqlalchemy import (
     String,
     Integer,
     DateTime,
-    Numeric,
     Boolean,
     Text,
+    Index,
+    text,
+    UniqueConstraint,
     func,
 )
 from sqlalchemy.orm import Mapped, mapped_column
@@ -31,14 +32,17 @@ class User(Base):
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (Index("ix_payments_status_created_at", "status", "created_at"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(Integer, index=True, nullable=False)
     provider: Mapped[str] = mapped_column(String(32), nullable=False)  # "ton" и т.п.
-    amount: Mapped[Decimal] = mapped_column(Numeric(18, 8), nullable=False)
+    amount: Mapped[int] = mapped_column(BigInteger, nullable=False)  # нанотоны
     currency: Mapped[str] = mapped_column(String(12), nullable=False)
-    external_id: Mapped[str] = mapped_column(String(128), unique=True, index=True, nullable=False)  # tx hash / lt:hash
-    status: Mapped[str] = mapped_column(String(24), default="pending")
+    external_id: Mapped[str] = mapped_column(String(128), unique=True, nullable=False)  # tx hash / lt:hash
+    status: Mapped[str] = mapped_column(String(24), default="pending")  # seen -> confirmed -> credited
+    mc_seqno: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)  # мастерчейн, когда увидели
+    raw: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
 
@@ -46,24 +50,59 @@ class Balance(Base):
     __tablename__ = "balances"
 
     user_id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    amount: Mapped[Decimal] = mapped_column(Numeric(18, 8), default=0)
+    amount: Mapped[int] = mapped_column(BigInteger, default=0)  # нанотоны
+
+
+class LedgerEntry(Base):
+    """Журнал движений баланса (append-only). balances — материализованная сумма по нему."""
+    __tablename__ = "ledger_entries"
+    __table_args__ = (UniqueConstraint("kind", "ref_id", name="uq_ledger_entries_kind_ref"),)
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(Integer, index=True, nullable=False)
+    amount: Mapped[int] = mapped_column(BigInteger, nullable=False)  # нанотоны: >0 кредит, <0 дебет
+    kind: Mapped[str] = mapped_column(String(16), nullable=False)  # payment / withdrawal / refund / opening / adjust
+    ref_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)  # id платежа/вывода
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
 
 class Withdrawal(Base):
     __tablename__ = "withdrawals"
+    # выборка pending-заявок воркером выводов
+    __table_args__ = (Index("ix_withdrawals_status_created_at", "status", "created_at"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(Integer, index=True, nullable=False)
-    amount: Mapped[Decimal] = mapped_column(Numeric(18, 8), nullable=False)
+    amount: Mapped[int] = mapped_column(BigInteger, nullable=False)  # нанотоны
     address: Mapped[str] = mapped_column(String(256), nullable=False)
     comment: Mapped[Optional[str]] = mapped_column(String(256))
-    status: Mapped[str] = mapped_column(String(24), default="pending")
+    status: Mapped[str] = mapped_column(String(24), default="pending")  # pending -> processing -> done / failed; rejected
+    batch_id: Mapped[Optional[int]] = mapped_column(Integer, index=True, nullable=True)  # withdrawal_batches.id
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     processed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
 
 
+class WithdrawalBatch(Base):
+    """Один multi-message перевод с highload-кошелька; id — его query_id."""
+    __tablename__ = "withdrawal_batches"
+    __table_args__ = (Index("ix_withdrawal_batches_status_id", "status", "id"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    status: Mapped[str] = mapped_column(String(16), default="new")  # new -> submitted -> confirmed / failed
+    count: Mapped[int] = mapped_column(Integer, nullable=False)
+    total: Mapped[int] = mapped_column(BigInteger, nullable=False)  # нанотоны
+    msg_hash: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    error: Mapped[Optional[str]] = mapped_column(String(256), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    submitted_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    confirmed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"
+    # BRIN: строки пишутся по времени, индекс крошечный и годится для диапазонов/ретенции
+    __table_args__ = (Index("ix_audit_logs_created_at_brin", "created_at", postgresql_using="brin"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
@@ -75,12 +114,21 @@ class AuditLog(Base):
 # --- Для TON-депозитов по комментарию ---
 class DepositTag(Base):
     __tablename__ = "deposit_tags"
+    __table_args__ = (
+        # свободные теги пула — для выдачи через SKIP LOCKED
+        Index("ix_deposit_tags_unassigned", "id", postgresql_where=text("user_id IS NULL")),
+        # активный тег пользователя при выдаче
+        Index("ix_deposit_tags_user_id_is_active", "user_id", "is_active"),
+        # не больше одного активного тега на пользователя (гонка параллельных /start)
+        Index("ux_deposit_tags_user_id_active", "user_id", unique=True, postgresql_where=text("is_active")),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    user_id: Mapped[int] = mapped_column(Integer, index=True, nullable=False)
+    user_id: Mapped[Optional[int]] = mapped_column(Integer, index=True, nullable=True)  # NULL — тег в пуле
     tag: Mapped[str] = mapped_column(String(32), unique=True, index=True, nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    assigned_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
 
 
 # --- Курсор для вочера (например, сохраняем to_lt) ---
@@ -88,5 +136,13 @@ class State(Base):
     __tablename__ = "state"
 
     key: Mapped[str] = mapped_column(String(64), primary_key=True)
-    value: Mapped[str] = mapped_column(String(256), nullable=False)
+    value: Mapped[str] = mapped_column(String(512), nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+# --- Дедупликация апдейтов Telegram между инстансами ---
+class ProcessedUpdate(Base):
+    __tablename__ = "processed_updates"
+
+    update_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), index=True)
@@ -0,0 +1,40 @@
+# app/money.py
+"""
+Деньги — целые нанотоны (1 TON = 10**9), как их отдаёт цепочка.
+
+В БД — BigInteger, в коде — int: суммирование, сравнение и журнал без
+Decimal и без потери 9-го знака. TON-строки появляются только на краях:
+ENV (TON_MIN_DEPOSIT), суммы в ссылках оплаты и тексты для пользователя.
+"""
+from __future__ import annotations
+
+from decimal import Decimal, InvalidOperation
+from typing import Union
+
+NANO = 10 ** 9
+
+Nano = int
+
+
+def to_nano(ton: Union[str, int, Decimal]) -> Nano:
+    """TON -> нанотоны. Дробь мельче нанотона — ValueError, молча не округляем."""
+    try:
+        value = ton if isinstance(ton, Decimal) else Decimal(str(ton).strip())
+    except InvalidOperation:
+        raise ValueError(f"invalid TON amount: {ton!r}") from None
+    nano = value * NANO
+    if not nano.is_finite() or nano != nano.to_integral_value():
+        raise ValueError(f"invalid TON amount: {ton!r}")
+    return int(nano)
+
+
+def from_nano(nano: Nano) -> Decimal:
+    """Нанотоны -> Decimal TON (точно)."""
+    return Decimal(nano).scaleb(-9)
+
+
+def fmt_ton(nano: Nano) -> str:
+    """Нанотоны -> «2.5» без хвостовых нулей и экспоненты — для текста и URL."""
+    sign = "-" if nano < 0 else ""
+    whole, frac = divmod(abs(int(nano)), NANO)
+    return f"{sign}{whole}" + (f".{frac:09d}".rstrip("0") if frac else "")
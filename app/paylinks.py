@@ -0,0 +1,205 @@
+# app/paylinks.py
+"""
+Ссылки оплаты и QR-коды для тройки (адрес, сумма в нанотонах, тег).
+
+  - ton://transfer/...            — стандартная TON-ссылка (её же кодирует QR);
+  - tonkeeper://transfer/...      — прямо в приложение Tonkeeper;
+  - https://app.tonkeeper.com/... — то же универсальной ссылкой;
+  - /pay?...                      — наша страница TON Connect;
+  - /qr?...                       — PNG/SVG QR для оплаты с десктопа.
+
+Кнопки Telegram принимают только http(s):// и tg://, поэтому в клавиатуре —
+https-варианты, а ton:// и tonkeeper:// — в QR и в тексте.
+
+Ссылки кэшируются LRU по числу троек, отрисованные QR — LRU, ограниченным
+по байтам (QR_CACHE_BYTES); QR отдаётся как StaticAsset с ETag, повторный
+/start или «оплатить ещё раз» не кодирует и не рисует QR заново.
+
+/qr без авторизации, поэтому ссылка на QR подписана (sig — HMAC тройки на
+ключе из BOT_TOKEN): рисуем только то, что выдал сам бот, а не любые
+amount/tag из запроса. Рендер на промахе — в пуле потоков, не в event loop.
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import io
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from .assets import StaticAsset
+from .metrics import Counter, Gauge
+from .money import Nano, fmt_ton
+
+QR_RENDERS = Counter("pay_qr_renders_total", "QR images rendered (cache misses)", ("format",))
+QR_HITS = Counter("pay_qr_cache_hits_total", "QR images served from the in-process cache")
+QR_BYTES = Gauge("pay_qr_cache_bytes", "Bytes held by the rendered QR cache")
+
+QR_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+Key = Tuple[str, Nano, str]
+
+
+class PayLinks(NamedTuple):
+    ton: str
+    tonkeeper: str
+    tonkeeper_web: str
+    tonconnect: str
+    qr_png: str
+    qr_svg: str
+
+
+def transfer_query(amount: Nano, tag: str) -> str:
+    params = {"amount": str(amount)}
+    if tag:
+        params["text"] = tag
+    return urlencode(params, quote_via=quote)
+
+
+class _BytesLRU:
+    """LRU ключ -> StaticAsset, ограниченный суммарным размером вариантов."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(0, max_bytes)
+        self.size = 0
+        self._items: "OrderedDict[Tuple, Tuple[StaticAsset, int]]" = OrderedDict()
+
+    def get(self, key) -> Optional[StaticAsset]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, asset: StaticAsset) -> None:
+        nbytes = sum(len(body) for body, _ in asset.variants.values())
+        if nbytes > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        self._items[key] = (asset, nbytes)
+        self.size += nbytes
+        while self.size > self.max_bytes:
+            _, (_, n) = self._items.popitem(last=False)
+            self.size -= n
+        QR_BYTES.set(self.size)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class PayLinkService:
+    def __init__(
+        self,
+        base_url: str,
+        link_cache_size: int = 10_000,
+        qr_cache_bytes: int = 8 << 20,
+        qr_scale: int = 6,
+        secret: bytes = b"",
+    ):
+        self.base = base_url.rstrip("/")
+        self.link_cache_size = max(1, link_cache_size)
+        self.qr_scale = qr_scale
+        self.secret = secret
+        self._links: "OrderedDict[Key, PayLinks]" = OrderedDict()
+        self._qr = _BytesLRU(qr_cache_bytes)
+        self._rendering: Dict[Tuple, asyncio.Future] = {}
+
+    def sign(self, address: str, amount: Nano, tag: str) -> str:
+        mac = hmac.new(self.secret, f"{address}\n{amount}\n{tag}".encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(mac[:16]).rstrip(b"=").decode()
+
+    def verify(self, address: str, amount: Nano, tag: str, sig: str) -> bool:
+        return hmac.compare_digest(self.sign(address, amount, tag), sig)
+
+    def links(self, address: str, amount: Nano, tag: str = "") -> PayLinks:
+        key = (address, amount, tag)
+        cached = self._links.get(key)
+        if cached is not None:
+            self._links.move_to_end(key)
+            return cached
+        transfer = transfer_query(amount, tag)
+        page = urlencode({"amount": fmt_ton(amount), "memo": tag, "to": address}, quote_via=quote)
+        qr = urlencode(
+            {"to": address, "amount": fmt_ton(amount), "tag": tag, "sig": self.sign(address, amount, tag)},
+            quote_via=quote,
+        )
+        links = PayLinks(
+            ton=f"ton://transfer/{address}?{transfer}",
+            tonkeeper=f"tonkeeper://transfer/{address}?{transfer}",
+            tonkeeper_web=f"https://app.tonkeeper.com/transfer/{address}?{transfer}",
+            tonconnect=f"{self.base}/pay?{page}",
+            qr_png=f"{self.base}/qr?{qr}&fmt=png",
+            qr_svg=f"{self.base}/qr?{qr}&fmt=svg",
+        )
+        self._links[key] = links
+        if len(self._links) > self.link_cache_size:
+            self._links.popitem(last=False)
+        return links
+
+    def render_qr(self, address: str, amount: Nano, tag: str = "", fmt: str = "png") -> StaticAsset:
+        """Кодирует и рисует QR (CPU, десятки мс) — без кэша; RuntimeError — нет segno."""
+        try:
+            import segno  # ~80 мс импорта — не на старте процесса, а при первом QR
+        except Exception:
+            raise RuntimeError("segno is not installed") from None
+        code = segno.make(self.links(address, amount, tag).ton, error="m")
+        buf = io.BytesIO()
+        if fmt == "png":
+            code.save(buf, kind="png", scale=self.qr_scale, border=2)
+        else:
+            code.save(buf, kind="svg", scale=self.qr_scale, border=2, xmldecl=False)
+        QR_RENDERS.labels(fmt).inc()
+        # содержимое однозначно задаётся query-строкой — кэшируем надолго
+        return StaticAsset(buf.getvalue(), QR_FORMATS[fmt], "public, max-age=86400", brotli_quality=5)
+
+    async def qr(self, address: str, amount: Nano, tag: str = "", fmt: str = "png") -> StaticAsset:
+        """
+        QR с ton://-ссылкой из кэша; на промахе рисуем в пуле потоков, один
+        рендер на ключ для всех параллельных запросов. ValueError — неизвестный
+        формат, RuntimeError — нет segno.
+        """
+        if fmt not in QR_FORMATS:
+            raise ValueError(f"unsupported QR format: {fmt}")
+        key = (address, amount, tag, fmt)
+        asset = self._qr.get(key)
+        if asset is not None:
+            QR_HITS.inc()
+            return asset
+        fut = self._rendering.get(key)
+        if fut is None:
+            fut = self._rendering[key] = asyncio.ensure_future(
+                asyncio.to_thread(self.render_qr, address, amount, tag, fmt)
+            )
+            fut.add_done_callback(lambda f: self._rendering.pop(key, None))
+        asset = await asyncio.shield(fut)
+        self._qr.put(key, asset)
+        return asset
+
+
+_service: Optional[PayLinkService] = None
+
+
+def configure(settings) -> PayLinkService:
+    global _service
+    token = settings.bot_token.get_secret_value() if hasattr(settings.bot_token, "get_secret_value") else str(settings.bot_token)
+    _service = PayLinkService(
+        str(settings.base_url),
+        settings.pay_link_cache_size,
+        settings.qr_cache_bytes,
+        secret=hashlib.sha256(b"paylinks:" + token.encode()).digest(),
+    )
+    return _service
+
+
+def get_service(settings=None) -> PayLinkService:
+    if _service is None:
+        if settings is None:
+            from .config import get_settings
+            settings = get_settings()
+        return configure(settings)
+    return _service
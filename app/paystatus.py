@@ -0,0 +1,264 @@
+# app/paystatus.py
+"""
+Статус оплаты по тегу депозита (memo) для long-poll /pay/status.
+
+Вочер публикует события (seen / credited) в StatusBoard процесса; ожидающие
+запросы спят на asyncio.Event своего тега и просыпаются только при событии
+по нему — тысячи открытых страниц оплаты не делают запросов к БД. В БД
+ходим один раз на тег, которого ещё нет в доске (после рестарта), и то
+одним запросом на все параллельные ожидания этого тега.
+
+Несколько инстансов: PAY_STATUS_BACKEND=postgres — вочер дополнительно шлёт
+события через NOTIFY pay_status, каждый инстанс слушает канал (run_listener)
+и кладёт их в свою доску. При PAY_STATUS_BACKEND=memory события видит только
+процесс-лидер с вочером, поэтому записи, взятые из БД, живут
+PAY_STATUS_DB_TTL секунд: пока по тегу кто-то ждёт и статус не финальный,
+доска перечитывает его из БД (один запрос на тег, не на ожидающего).
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+
+try:
+    import structlog
+    log = structlog.get_logger()
+except Exception:
+    import logging
+    log = logging.getLogger("paystatus")
+
+from . import db as _db, events
+from .money import fmt_ton
+from .metrics import Counter, Gauge
+
+CHANNEL = "pay_status"
+# pg_notify ограничивает payload 8000 байтами
+_NOTIFY_LIMIT = 7500
+
+RANK = {"pending": 0, "seen": 1, "confirmed": 2, "credited": 3}
+
+WAITING = Gauge("pay_status_waiting", "Long-poll requests currently parked on /pay/status")
+EVENTS = Counter("pay_status_events_total", "Payment status events applied to the in-process board")
+COLD_LOOKUPS = Counter("pay_status_db_lookups_total", "Status lookups that had to query the database")
+
+_LATEST_SQL = text("""
+SELECT p.status, p.external_id, extract(epoch FROM p.created_at) AS at, p.amount
+FROM deposit_tags t
+JOIN payments p ON p.user_id = t.user_id
+WHERE t.tag = :tag
+ORDER BY p.created_at DESC
+LIMIT 1
+""")
+
+
+class StatusBoard:
+    """
+    tag -> последнее событие {status, at, external_id, amount (TON строкой)} (LRU) +
+    ожидающие по тегу. Событие по другому external_id (новый платёж)
+    заменяет запись; по тому же — только продвигает статус вперёд.
+    """
+
+    def __init__(self, maxsize: int = 100_000, db_ttl: Optional[float] = None):
+        self.maxsize = max(1, maxsize)
+        # None/0 — записи из БД не перечитываются (события приходят во все процессы)
+        self.db_ttl = db_ttl if db_ttl and db_ttl > 0 else None
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._events: Dict[str, asyncio.Event] = {}
+        self._waiting: Dict[str, int] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    def get(self, tag: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(tag)
+        if entry is not None:
+            self._entries.move_to_end(tag)
+        return entry
+
+    def _put(self, tag: str, entry: Dict[str, Any]) -> None:
+        self._entries[tag] = entry
+        self._entries.move_to_end(tag)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def publish(self, tag: str, status: str, external_id: Optional[str] = None, amount: Any = None, at: Optional[float] = None) -> bool:
+        """Применяет событие; True — если запись изменилась (ожидающие разбужены)."""
+        tag = tag.upper()
+        cur = self._entries.get(tag)
+        same_payment = cur is not None and (external_id is None or cur.get("external_id") in (None, external_id))
+        if cur is not None and same_payment and RANK.get(status, 0) <= RANK.get(cur["status"], 0):
+            return False
+        entry = {
+            "status": status,
+            "at": at if at is not None else time.time(),
+            "external_id": external_id if external_id is not None else (cur or {}).get("external_id"),
+            "amount": str(amount) if amount is not None else (cur or {}).get("amount"),
+        }
+        self._put(tag, entry)
+        EVENTS.inc()
+        event = self._events.pop(tag, None)
+        if event is not None:
+            event.set()
+        return True
+
+    async def _load(self, tag: str) -> None:
+        """Один запрос к БД на тег, которого нет в доске; параллельные ждут его же."""
+        fut = self._loading.get(tag)
+        if fut is None:
+            fut = self._loading[tag] = asyncio.ensure_future(self._query(tag))
+            fut.add_done_callback(lambda f: self._loading.pop(tag, None))
+        await asyncio.shield(fut)
+
+    async def _query(self, tag: str) -> None:
+        COLD_LOOKUPS.inc()
+        async with _db.AsyncSessionLocal() as db:
+            row = (await db.execute(_LATEST_SQL, {"tag": tag})).first()
+        cur = self._entries.get(tag)
+        if cur is not None and "loaded" not in cur:
+            return  # пока ходили в БД, пришло событие — оно свежее
+        if row is None:
+            entry = {"status": "pending", "at": 0.0, "external_id": None, "amount": None}
+        else:
+            entry = {"status": row.status, "at": float(row.at), "external_id": row.external_id, "amount": fmt_ton(row.amount)}
+        # loaded — запись из БД (не от события), для PAY_STATUS_DB_TTL
+        entry["loaded"] = time.monotonic()
+        self._put(tag, entry)
+
+    def _stale_in(self, tag: str) -> Optional[float]:
+        """Через сколько секунд запись из БД пора перечитать; None — не нужно."""
+        if self.db_ttl is None:
+            return None
+        entry = self._entries.get(tag)
+        if entry is None:
+            return 0.0
+        if "loaded" not in entry or entry["status"] == "credited":
+            return None
+        return entry["loaded"] + self.db_ttl - time.monotonic()
+
+    async def _refresh(self, tag: str) -> None:
+        try:
+            await self._load(tag)
+        except Exception as e:
+            # БД недоступна — не долбим её в цикле, следующая попытка через db_ttl
+            entry = self._entries.get(tag)
+            if entry is None and self.db_ttl is not None:
+                self._put(tag, {"status": "pending", "at": 0.0, "external_id": None, "amount": None, "loaded": time.monotonic()})
+            elif entry is not None and "loaded" in entry:
+                entry["loaded"] = time.monotonic()
+            try:
+                log.error("pay_status_lookup_error", tag=tag, error=str(e))
+            except Exception:
+                pass
+
+    def _visible(self, tag: str, after: Optional[float]) -> Dict[str, Any]:
+        entry = self.get(tag)
+        if entry is None or (after is not None and entry["at"] < after):
+            return {"status": "pending"}
+        return entry
+
+    async def wait(self, tag: str, since: str = "pending", after: Optional[float] = None, timeout: float = 25.0) -> Dict[str, Any]:
+        """
+        Ждёт статуса «дальше» since (для платежей не раньше after, unix time)
+        не дольше timeout; возвращает текущий статус (pending по таймауту).
+        """
+        tag = tag.upper()
+        if tag not in self._entries:
+            # без истории из БД просто ждём событий вочера
+            await self._refresh(tag)
+        deadline = time.monotonic() + max(0.0, timeout)
+        since_rank = RANK.get(since, 0)
+        while True:
+            entry = self._visible(tag, after)
+            left = deadline - time.monotonic()
+            if RANK.get(entry["status"], 0) > since_rank or left <= 0:
+                return entry
+            stale_in = self._stale_in(tag)
+            if stale_in is not None:
+                if stale_in <= 0:
+                    await self._refresh(tag)
+                    continue
+                left = min(left, stale_in)
+            event = self._events.get(tag)
+            if event is None:
+                event = self._events[tag] = asyncio.Event()
+            self._waiting[tag] = self._waiting.get(tag, 0) + 1
+            WAITING.set(sum(self._waiting.values()))
+            try:
+                await asyncio.wait_for(event.wait(), left)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                n = self._waiting.pop(tag) - 1
+                if n:
+                    self._waiting[tag] = n
+                elif self._events.get(tag) is event:
+                    del self._events[tag]
+                WAITING.set(sum(self._waiting.values()))
+
+
+board = StatusBoard()
+_backend = "memory"
+
+
+def configure(settings) -> None:
+    global board, _backend
+    _backend = settings.pay_status_backend.lower()
+    board = StatusBoard(
+        settings.pay_status_cache_size,
+        db_ttl=settings.pay_status_db_ttl if _backend == "memory" else None,
+    )
+
+
+def _chunks(events: List[Dict[str, Any]]) -> List[str]:
+    out: List[str] = []
+    batch: List[Dict[str, Any]] = []
+    size = 2
+    for ev in events:
+        item = json.dumps(ev, separators=(",", ":"), default=str)
+        if batch and size + len(item) + 1 > _NOTIFY_LIMIT:
+            out.append(json.dumps(batch, separators=(",", ":"), default=str))
+            batch, size = [], 2
+        batch.append(ev)
+        size += len(item) + 1
+    if batch:
+        out.append(json.dumps(batch, separators=(",", ":"), default=str))
+    return out
+
+
+async def publish_many(events: Iterable[Dict[str, Any]]) -> None:
+    """
+    События вочера [{tag, status, external_id?, amount?}]: в доску процесса
+    и, при PAY_STATUS_BACKEND=postgres, одним NOTIFY-запросом остальным.
+    """
+    events = [dict(ev, at=ev.get("at") or time.time()) for ev in events]
+    if not events:
+        return
+    for ev in events:
+        board.publish(ev["tag"], ev["status"], ev.get("external_id"), ev.get("amount"), ev["at"])
+    if _backend != "postgres" or _db.async_engine is None:
+        return
+    try:
+        async with _db.async_engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(
+                text("SELECT pg_notify(:channel, p) FROM unnest(CAST(:payloads AS text[])) AS p"),
+                {"channel": CHANNEL, "payloads": _chunks(events)},
+            )
+    except Exception as e:
+        try:
+            log.error("pay_status_notify_error", error=str(e))
+        except Exception:
+            pass
+
+
+def _apply(payload: str) -> None:
+    for ev in json.loads(payload):
+        board.publish(ev["tag"], ev["status"], ev.get("external_id"), ev.get("amount"), ev.get("at"))
+
+
+async def run_listener(database_url: str, retry: float = 5.0) -> None:
+    """LISTEN pay_status на отдельном соединении; переподключается при обрыве."""
+    await events.listen(database_url, CHANNEL, _apply, retry)
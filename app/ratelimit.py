@@ -0,0 +1,48 @@
+# app/ratelimit.py
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Клиентский token bucket: rate токенов в секунду, запас до capacity.
+
+    reserve() сразу списывает токен (баланс может уйти в минус) и возвращает,
+    сколько секунд нужно подождать — так очередь ожидающих не нужна, а
+    конкурентные вызовы сами выстраиваются друг за другом.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._ts = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._ts) * self.rate)
+        self._ts = now
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        self._refill()
+        self._tokens -= tokens
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """Сколько ждать до следующего токена, ничего не списывая."""
+        self._refill()
+        if self._tokens >= tokens:
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
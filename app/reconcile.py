@@ -0,0 +1,121 @@
+# app/reconcile.py
+"""
+Сверка balances с журналом ledger_entries.
+
+    python -m app.reconcile [--chunk 5000] [--fix]
+
+Журнал читается серверным курсором порциями по --chunk строк, отсортированным
+по user_id, поэтому в памяти лежит только текущая порция пользователей, а не
+вся таблица. Всё читается в одной REPEATABLE READ транзакции — снимок журнала
+и балансов согласован даже при работающем вочере. Код выхода 1, если есть
+расхождения и не указан --fix. --fix лучше запускать при остановленном
+вочере: параллельное начисление тому же пользователю уронит транзакцию
+с serialization error.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import Dict, Iterator, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Connection
+
+from . import db as _db
+from .config import get_settings
+from .models import Balance, LedgerEntry
+
+
+def _ledger_totals(conn: Connection, chunk: int) -> Iterator[Dict[int, int]]:
+    """Стримит журнал и отдаёт пересчитанные суммы порциями {user_id: total}."""
+    stmt = (
+        select(LedgerEntry.user_id, LedgerEntry.amount)
+        .order_by(LedgerEntry.user_id)
+        .execution_options(stream_results=True, yield_per=chunk)
+    )
+    totals: Dict[int, int] = {}
+    current = None
+    for part in conn.execute(stmt).partitions():
+        for user_id, amount in part:
+            if user_id != current and len(totals) >= chunk:
+                yield totals
+                totals = {}
+            current = user_id
+            totals[user_id] = totals.get(user_id, 0) + (amount or 0)
+    if totals:
+        yield totals
+
+
+def _orphan_balances(conn: Connection, chunk: int) -> Iterator[Tuple[int, int]]:
+    """Ненулевые балансы пользователей, у которых нет ни одной записи в журнале."""
+    has_entries = select(LedgerEntry.id).where(LedgerEntry.user_id == Balance.user_id).exists()
+    stmt = (
+        select(Balance.user_id, Balance.amount)
+        .where(func.coalesce(Balance.amount, 0) != 0, ~has_entries)
+        .execution_options(stream_results=True, yield_per=chunk)
+    )
+    yield from conn.execute(stmt)
+
+
+def _fix(conn: Connection, expected: Dict[int, int]) -> None:
+    upsert = pg_insert(Balance).values([{"user_id": u, "amount": a} for u, a in expected.items()])
+    conn.execute(upsert.on_conflict_do_update(
+        index_elements=[Balance.user_id],
+        set_={"amount": upsert.excluded.amount},
+    ))
+
+
+def reconcile(chunk: int = 5000, fix: bool = False) -> int:
+    """Возвращает количество расхождений (исправленных, если fix=True)."""
+    if _db.engine is None:
+        settings = get_settings()
+        _db.init_db(settings.database_url, settings)
+
+    checked = 0
+    mismatches = 0
+    with _db.engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="REPEATABLE READ")
+        with conn.begin():
+            for totals in _ledger_totals(conn, chunk):
+                rows = conn.execute(
+                    select(Balance.user_id, Balance.amount).where(Balance.user_id.in_(list(totals)))
+                )
+                actual = {user_id: amount or 0 for user_id, amount in rows}
+                bad = {u: t for u, t in totals.items() if actual.get(u, 0) != t}
+                for user_id, total in bad.items():
+                    print(f"mismatch user_id={user_id} balance={actual.get(user_id)} ledger={total}")
+                if bad and fix:
+                    _fix(conn, bad)
+                checked += len(totals)
+                mismatches += len(bad)
+
+            orphans: Dict[int, int] = {}
+            for user_id, amount in _orphan_balances(conn, chunk):
+                print(f"mismatch user_id={user_id} balance={amount} ledger=0")
+                orphans[user_id] = 0
+                if len(orphans) >= chunk:
+                    if fix:
+                        _fix(conn, orphans)
+                    mismatches += len(orphans)
+                    orphans = {}
+            if orphans:
+                if fix:
+                    _fix(conn, orphans)
+                mismatches += len(orphans)
+
+    print(f"checked={checked} mismatches={mismatches} fixed={mismatches if fix else 0}")
+    return mismatches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Сверка balances с ledger_entries")
+    parser.add_argument("--chunk", type=int, default=5000, help="пользователей/строк за порцию")
+    parser.add_argument("--fix", action="store_true", help="переписать расходящиеся балансы суммой по журналу")
+    args = parser.parse_args()
+    bad = reconcile(chunk=args.chunk, fix=args.fix)
+    sys.exit(1 if bad and not args.fix else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# app/schema_check.py
+"""
+Проверка расхождения моделей и миграций.
+
+    alembic upgrade head && python -m app.schema_check
+
+Сравнивает схему базы (после миграций) с app.models тем же механизмом, что
+alembic autogenerate: таблицы, столбцы, типы, nullable, индексы и unique.
+Код выхода 1, если база не на head-ревизии или найдены расхождения —
+значит, модель поменяли без миграции (или наоборот). Запускать на
+отдельной базе, накатанной с нуля, например в CI перед деплоем.
+"""
+from __future__ import annotations
+
+import os
+import sys
+from typing import List
+
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+
+from . import db as _db
+from . import models  # noqa: F401  (регистрирует таблицы в Base.metadata)
+from .config import get_settings
+
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def check() -> List[str]:
+    """Список расхождений в читаемом виде; пустой — схема совпадает."""
+    if _db.engine is None:
+        settings = get_settings()
+        _db.init_db(settings.database_url, settings)
+
+    script = ScriptDirectory.from_config(Config(os.path.join(_ROOT, "alembic.ini")))
+    problems: List[str] = []
+    with _db.engine.connect() as conn:
+        ctx = MigrationContext.configure(conn, opts={"compare_type": True})
+        current, heads = set(ctx.get_current_heads()), set(script.get_heads())
+        if current != heads:
+            problems.append(f"database at {sorted(current) or 'base'}, migrations head is {sorted(heads)}")
+        for diff in compare_metadata(ctx, _db.Base.metadata):
+            problems.append(repr(diff))
+    return problems
+
+
+def main() -> None:
+    problems = check()
+    for p in problems:
+        print(f"drift {p}")
+    print(f"drift={len(problems)}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,115 @@
 import secrets, string
-from sqlalchemy.orm import Session
-from .models import DepositTag, Balance
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import Balance, LedgerEntry, Payment
 
 ALPH = string.ascii_uppercase + string.digits
 
 def gen_tag(prefix: str = "P4V", length: int = 6) -> str:
     return f"{prefix}-{''.join(secrets.choice(ALPH) for _ in range(length))}"
 
-def get_or_create_tag(db: Session, user_id: int, prefix: str = "P4V") -> str:
-    tag = db.query(DepositTag).filter_by(user_id=user_id, is_active=True).first()
-    if tag:
-        return tag.tag
-    t = gen_tag(prefix=prefix)
-    while db.query(DepositTag).filter_by(tag=t).first():
-        t = gen_tag(prefix=prefix)
-    db.add(DepositTag(user_id=user_id, tag=t))
-    db.commit()
-    return t
-
-def credit_balance(db: Session, user_id: int, amount):
-    row = db.query(Balance).filter_by(user_id=user_id).first()
-    if row:
-        row.amount = (row.amount or 0) + amount
-    else:
-        db.add(Balance(user_id=user_id, amount=amount))
+async def apply_ledger(db: AsyncSession, entries: List[Dict[str, Any]]) -> int:
+    """
+    Применяет пачку движений (user_id, amount в нанотонах, kind, ref_id) одним запросом:
+    INSERT в ledger_entries с ON CONFLICT (kind, ref_id) DO NOTHING и в том же
+    statement агрегированный upsert в balances по реально вставленным строкам.
+    amount > 0 — кредит, < 0 — дебет. Без read-modify-write, поэтому вочер и
+    хендлеры могут начислять одному пользователю одновременно.
+    Commit делает вызывающий. Возвращает число затронутых балансов.
+    """
+    if not entries:
+        return 0
+    ins = (
+        pg_insert(LedgerEntry)
+        .values([
+            {"user_id": e["user_id"], "amount": e["amount"], "kind": e["kind"], "ref_id": e.get("ref_id")}
+            for e in entries
+        ])
+        .on_conflict_do_nothing(index_elements=[LedgerEntry.kind, LedgerEntry.ref_id])
+        .returning(LedgerEntry.user_id, LedgerEntry.amount)
+        .cte("ins")
+    )
+    # балансы блокируются в порядке user_id — как в withdrawals.claim_batch, без дедлоков
+    totals = select(ins.c.user_id, func.sum(ins.c.amount)).group_by(ins.c.user_id).order_by(ins.c.user_id)
+    upsert = pg_insert(Balance).from_select(["user_id", "amount"], totals)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[Balance.user_id],
+        set_={"amount": func.coalesce(Balance.amount, 0) + upsert.excluded.amount},
+    ).returning(Balance.user_id)
+    return len((await db.execute(upsert)).all())
+
+async def credit_balance(db: AsyncSession, user_id: int, amount: int, kind: str = "adjust", ref_id: Optional[int] = None) -> None:
+    """Одиночное начисление/списание через журнал; commit делает вызывающий."""
+    await apply_ledger(db, [{"user_id": user_id, "amount": amount, "kind": kind, "ref_id": ref_id}])
+
+async def record_deposits(db: AsyncSession, deposits: List[Dict[str, Any]], provider: str = "ton", currency: str = "TON") -> int:
+    """
+    Пачка депозитов (user_id, amount в нанотонах, external_id) одним multi-row INSERT в
+    payments со статусом seen и ON CONFLICT (external_id) DO NOTHING —
+    повторная обработка той же страницы ничего не задублирует. Начисление
+    происходит позже, в confirm_payments, после нужной глубины.
+    Commit делает вызывающий. Возвращает число новых платежей.
+    """
+    if not deposits:
+        return 0
+    rows = [
+        {
+            "user_id": d["user_id"],
+            "amount": d["amount"],
+            "external_id": d["external_id"],
+            "provider": provider,
+            "currency": currency,
+            "status": "seen",
+        }
+        for d in deposits
+    ]
+    ins = (
+        pg_insert(Payment)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=[Payment.external_id])
+        .returning(Payment.id)
+    )
+    return len((await db.execute(ins)).all())
+
+async def confirm_payments(db: AsyncSession, mc_seqno: int, depth: int, limit: int = 1000) -> List[Tuple[int, int, int]]:
+    """
+    Продвигает платежи seen → confirmed → credited пачкой, без запросов на
+    каждый платёж. mc_seqno — текущий seqno мастерчейна (один запрос на поллинг).
+
+    Платёж без mc_seqno получает текущий seqno: транзакции читаются раньше,
+    чем мы спрашиваем мастерчейн, так что оценка глубины консервативная.
+    Подтверждён — когда над ним не меньше depth блоков мастерчейна.
+    Подтверждённые сразу начисляются через журнал. Все выборки идут по
+    индексу (status, created_at) и ограничены limit строками.
+    Commit делает вызывающий. Возвращает начисленные (id, user_id, amount).
+    """
+    def _batch(status: str):
+        return (
+            select(Payment.id)
+            .where(Payment.status == status)
+            .order_by(Payment.created_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+
+    seen = _batch("seen").where(Payment.mc_seqno.is_(None))
+    await db.execute(update(Payment).where(Payment.id.in_(seen.scalar_subquery())).values(mc_seqno=mc_seqno))
+
+    ready = _batch("seen").where(Payment.mc_seqno <= mc_seqno - depth)
+    await db.execute(update(Payment).where(Payment.id.in_(ready.scalar_subquery())).values(status="confirmed"))
+
+    confirmed = _batch("confirmed")
+    credited = (await db.execute(
+        update(Payment)
+        .where(Payment.id.in_(confirmed.scalar_subquery()))
+        .values(status="credited")
+        .returning(Payment.id, Payment.user_id, Payment.amount)
+    )).all()
+    await apply_ledger(db, [
+        {"user_id": user_id, "amount": amount, "kind": "payment", "ref_id": payment_id}
+        for payment_id, user_id, amount in credited
+    ])
+    return [tuple(r) for r in credited]
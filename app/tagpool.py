@@ -0,0 +1,188 @@
+# app/tagpool.py
+"""
+Пул заранее сгенерированных тегов депозита.
+
+Фоновая задача (run_tag_pool, крутит лидер) держит в deposit_tags запас
+свободных тегов (user_id IS NULL) пачками multi-row INSERT. Выдача тега —
+один statement в autocommit по user_id, который уже разрешил реестр
+пользователей (app.users, пре-хендлер группы -1): вернуть активный тег или
+забрать свободный из пула через FOR UPDATE SKIP LOCKED. Перед этим — LRU-кэш
+user_id -> tag. Параллельные первые /start одного пользователя разводит
+частичный уникальный индекс ux_deposit_tags_user_id_active: проигравший
+statement падает с IntegrityError и повтор видит тег победителя.
+
+Итого на /start: 0 запросов к БД для закэшированных, 1 — для остальных.
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+try:
+    import structlog
+    log = structlog.get_logger()
+except Exception:
+    import logging
+    log = logging.getLogger("tagpool")
+
+from . import db as _db, events
+from .metrics import Counter, Gauge
+from .models import DepositTag
+from .services import gen_tag
+
+POOL_FREE = Gauge("deposit_tag_pool_free", "Unassigned deposit tags left in the pool")
+CACHE_HITS = Counter("deposit_tag_cache_hits_total", "Deposit tag lookups served from the in-process cache")
+POOL_EMPTY = Counter("deposit_tag_pool_empty_total", "Allocations that found the pool empty and generated a tag inline")
+
+# в ux_deposit_tags_user_id_active выдача упирается только при гонке /start
+CLAIM_ATTEMPTS = 3
+
+_CLAIM_SQL = text("""
+WITH existing AS (
+    SELECT tag FROM deposit_tags
+    WHERE user_id = :user_id AND is_active
+    ORDER BY id
+    LIMIT 1
+), claimed AS (
+    UPDATE deposit_tags
+    SET user_id = :user_id, is_active = true, assigned_at = now()
+    WHERE id = (
+        SELECT id FROM deposit_tags
+        WHERE user_id IS NULL AND NOT EXISTS (SELECT 1 FROM existing)
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING tag
+)
+SELECT COALESCE((SELECT tag FROM existing), (SELECT tag FROM claimed)) AS tag
+""")
+
+
+class TagCache:
+    """Ограниченный LRU user_id -> tag."""
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = max(1, maxsize)
+        self._items: "OrderedDict[int, str]" = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[str]:
+        item = self._items.get(user_id)
+        if item is not None:
+            self._items.move_to_end(user_id)
+        return item
+
+    def put(self, user_id: int, tag: str) -> None:
+        self._items[user_id] = tag
+        self._items.move_to_end(user_id)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def discard(self, user_id: int) -> None:
+        self._items.pop(user_id, None)
+
+
+_cache = TagCache()
+
+
+def configure(settings) -> None:
+    global _cache
+    _cache = TagCache(settings.tag_cache_size)
+
+
+async def _claim(user_id: int) -> Optional[str]:
+    # один statement, без BEGIN/COMMIT — ровно один round-trip
+    async with _db.async_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        return (await conn.execute(_CLAIM_SQL, {"user_id": user_id})).scalar()
+
+
+async def _insert_tag(user_id: int, prefix: str) -> str:
+    """Пул пуст — генерируем тег прямо на месте (медленный путь)."""
+    async with _db.AsyncSessionLocal() as db:
+        while True:
+            tag = (await db.execute(
+                pg_insert(DepositTag)
+                .values(user_id=user_id, tag=gen_tag(prefix=prefix), is_active=True, assigned_at=func.now())
+                .on_conflict_do_nothing(index_elements=[DepositTag.tag])
+                .returning(DepositTag.tag)
+            )).scalar()
+            if tag:
+                await db.commit()
+                return tag
+
+
+async def get_deposit_tag(user_id: int, prefix: str = "P4V") -> str:
+    """Тег депозита пользователя (users.id); при первом обращении выдаёт тег из пула."""
+    # пользователь собирается платить — вочер переходит в быстрый режим
+    events.wake_watcher()
+
+    cached = _cache.get(user_id)
+    if cached is not None:
+        CACHE_HITS.inc()
+        return cached
+
+    for attempt in range(CLAIM_ATTEMPTS):
+        try:
+            tag = await _claim(user_id)
+            if tag is None:
+                POOL_EMPTY.inc()
+                try:
+                    log.warning("deposit_tag_pool_empty", user_id=user_id)
+                except Exception:
+                    pass
+                tag = await _insert_tag(user_id, prefix)
+            break
+        except IntegrityError:
+            # параллельный /start того же пользователя уже получил тег — повтор его увидит
+            if attempt == CLAIM_ATTEMPTS - 1:
+                raise
+
+    _cache.put(user_id, tag)
+    return tag
+
+
+async def refill_tag_pool(prefix: str, target: int, batch: int) -> int:
+    """Доливает пул до target свободных тегов пачками по batch; возвращает число добавленных."""
+    added = 0
+    async with _db.AsyncSessionLocal() as db:
+        free = await db.scalar(select(func.count()).select_from(DepositTag).where(DepositTag.user_id.is_(None)))
+        while free + added < target:
+            n = min(batch, target - free - added)
+            rows = [{"tag": gen_tag(prefix=prefix), "user_id": None, "is_active": False} for _ in range(n)]
+            res = await db.execute(
+                pg_insert(DepositTag)
+                .values(rows)
+                .on_conflict_do_nothing(index_elements=[DepositTag.tag])
+                .returning(DepositTag.id)
+            )
+            added += len(res.all())
+            await db.commit()
+    POOL_FREE.set(free + added)
+    return added
+
+
+async def run_tag_pool(settings) -> None:
+    while True:
+        try:
+            added = await refill_tag_pool(
+                settings.deposit_tag_prefix, settings.tag_pool_target, settings.tag_pool_batch
+            )
+            if added:
+                try:
+                    log.info("deposit_tag_pool_refilled", added=added)
+                except Exception:
+                    pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            try:
+                log.error("deposit_tag_pool_error", error=str(e))
+            except Exception:
+                pass
+        await asyncio.sleep(settings.tag_pool_refill_interval)
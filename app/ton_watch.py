@@ -1,7 +1,9 @@
 import asyncio
-from typing import Any, Dict, List, Optional
-
-import httpx
+import base64
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
 try:
     import structlog
@@ -11,138 +13,524 @@ except Exception:
     logging.basicConfig(level=logging.INFO)
     log = logging.getLogger("ton_watcher")
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .config import load_settings
-from .models import State
+from . import audit, db as _db, events, paystatus, toncenter
+from .money import fmt_ton
+from .config import get_settings
+from .dispatcher import PRIORITY_PAYMENT, get_dispatcher
+from .metrics import Counter, Gauge, Histogram
+from .models import DepositTag, State, User
+from .services import confirm_payments, record_deposits
 
-settings = load_settings()
+settings = get_settings()
 
+# (lt, hash) — однозначный идентификатор транзакции аккаунта
+TxId = Tuple[int, str]
+Fetch = Callable[..., Awaitable[List[Dict[str, Any]]]]
+Seqno = Callable[[], Awaitable[int]]
 
-# --- DB session helper -------------------------------------------------------
-def _make_session_factory():
-    try:
-        from .db import SessionLocal  # если уже есть фабрика в проекте
-        return SessionLocal
-    except Exception:
-        engine = create_engine(str(settings.database_url), pool_pre_ping=True, future=True)
-        return sessionmaker(bind=engine, expire_on_commit=False, autoflush=False)
+CURSOR_KEY = "ton_cursor"
+LEGACY_CURSOR_KEY = "ton_to_lt"
+
+
+POLL_INTERVAL = Gauge("ton_watcher_poll_interval_seconds", "Current delay between watcher polls")
+LAG = Gauge("ton_watcher_lag_seconds", "Age of the oldest transaction ingested by the last poll (max over addresses)")
+LAST_POLL = Gauge("ton_watcher_last_poll_timestamp_seconds", "Unix time of the last successful poll")
+TXS = Counter("ton_watcher_transactions_total", "Transactions ingested")
+CREDITED = Counter("ton_watcher_payments_credited_total", "Payments credited after reaching TON_REQUIRE_DEPTH")
+LAG_LT = Gauge("ton_watcher_lag_lt", "Logical time between the stored cursor and the newest transaction at poll start", ("address",))
+POLL_DURATION = Histogram("ton_watcher_poll_duration_seconds", "Full watcher pass over all addresses incl. confirmations")
+DB_TIME = Histogram("ton_watcher_db_seconds", "Watcher time spent in the database by stage", ("stage",))
+_lag: Dict[str, float] = {}  # address -> лаг последнего прохода
 
 
-SessionLocal = _make_session_factory()
+# --- DB session helper -------------------------------------------------------
+def _session() -> AsyncSession:
+    if _db.AsyncSessionLocal is None:
+        _db.init_async_db(settings.database_url, settings)
+    return _db.AsyncSessionLocal()
 
 
 # --- Toncenter API -----------------------------------------------------------
 async def _get_transactions(
     address: str,
     limit: int = 16,
+    lt: Optional[str] = None,
+    hash_: Optional[str] = None,
     to_lt: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
+    """getTransactions через общий клиент (пул соединений, ретраи, rate limit, failover)."""
+    client = toncenter.get_client(settings)
+    return await client.get_transactions(address, limit=limit, lt=lt, hash_=hash_, to_lt=to_lt)
+
+
+async def _get_masterchain_seqno() -> int:
+    return await toncenter.get_client(settings).get_masterchain_seqno()
+
+
+# --- Transaction helpers -----------------------------------------------------
+def _tx_id(tx: Dict[str, Any]) -> Optional[TxId]:
+    tid = tx.get("transaction_id") or {}
+    lt = None
+    tx_hash = None
+    if isinstance(tid, dict):
+        lt = tid.get("lt") or tid.get("logical_time")
+        tx_hash = tid.get("hash")
+    if lt is None:
+        lt = tx.get("lt")
+    if tx_hash is None:
+        tx_hash = tx.get("hash")
+    if lt is None or not tx_hash:
+        return None
+    try:
+        return int(str(lt)), str(tx_hash)
+    except Exception:
+        return None
+
+
+def _decode_comment(in_msg: Dict[str, Any]) -> str:
+    """Текстовый комментарий входящего сообщения (message или msg.dataText)."""
+    text = in_msg.get("message") or ""
+    if not text:
+        md = in_msg.get("msg_data") or {}
+        if isinstance(md, dict) and md.get("@type") == "msg.dataText" and md.get("text"):
+            try:
+                text = base64.b64decode(md["text"]).decode("utf-8", errors="ignore")
+            except Exception:
+                text = ""
+    return text.replace("\x00", "").strip()
+
+
+# --- Deposit tags index ------------------------------------------------------
+class TagIndex:
     """
-    Вызов Toncenter getTransactions:
-      - X-API-Key в заголовке,
-      - api_key в query (на всякий случай),
-      - archival=true,
-      - короткий retry на 5xx.
-    Возвращает список транзакций из data['result'].
+    tag -> user_id в памяти, чтобы не ходить в БД на каждую транзакцию.
+    refresh() догружает только строки с id больше уже виденного; раз в
+    full_every секунд индекс перечитывается целиком (ловим деактивацию тегов).
+    Теги из пула получают владельца позже, чем появляются (id уже «виден»),
+    поэтому неизвестные комментарии с префиксом тега догружаются одним
+    запросом на пачку — resolve(): по уникальному индексу deposit_tags.tag
+    (теги генерируются в верхнем регистре), промахи помнятся miss_ttl секунд,
+    чтобы спам-комментарий не ходил в БД на каждом опросе.
     """
-    base = str(settings.ton_api_base).rstrip("/")  # <-- ключевая правка: str(...)
-    # допускаем как https://toncenter.com/api так и /api/v2
-    if base.endswith("/v2"):
-        url = f"{base}/getTransactions"
-    else:
-        url = f"{base}/v2/getTransactions"
-
-    params: Dict[str, Any] = {
-        "address": address,
-        "limit": limit,
-        "archival": "true",
-    }
-    if to_lt:
-        params["to_lt"] = to_lt
-
-    headers: Dict[str, str] = {}
-    if getattr(settings, "ton_api_key", None):
-        headers["X-API-Key"] = settings.ton_api_key
-        params["api_key"] = settings.ton_api_key  # дублируем — Toncenter это принимает
-
-    async with httpx.AsyncClient(timeout=20) as client:
-        r = await client.get(url, params=params, headers=headers)
-        if 500 <= r.status_code < 600:
-            await asyncio.sleep(1.5)
-            r = await client.get(url, params=params, headers=headers)
-        r.raise_for_status()
-        data = r.json()
-
-    if isinstance(data, dict):
-        return data.get("result", []) or []
-    return []
 
+    def __init__(self, full_every: float = 300.0, miss_ttl: float = 60.0, miss_maxsize: int = 10_000):
+        self.full_every = full_every
+        self.miss_ttl = miss_ttl
+        self.miss_maxsize = max(1, miss_maxsize)
+        self._tags: Dict[str, int] = {}
+        self._misses: "OrderedDict[str, float]" = OrderedDict()
+        self._last_id = 0
+        self._loaded_at = 0.0
 
-# --- State helpers -----------------------------------------------------------
-def _get_to_lt(db: Session) -> Optional[str]:
-    st = db.get(State, "ton_to_lt")
-    return (st.value if st else None) or None
+    async def refresh(self, db: AsyncSession) -> None:
+        now = time.monotonic()
+        q = select(DepositTag.id, DepositTag.tag, DepositTag.user_id, DepositTag.is_active)
+        if now - self._loaded_at >= self.full_every:
+            self._tags = {}
+            self._last_id = 0
+            self._loaded_at = now
+        else:
+            q = q.where(DepositTag.id > self._last_id)
+        for tag_id, tag, user_id, is_active in await db.execute(q.order_by(DepositTag.id)):
+            if is_active and user_id is not None:
+                self._tags[tag.upper()] = user_id
+                self._misses.pop(tag.upper(), None)
+            else:
+                self._tags.pop(tag.upper(), None)
+            self._last_id = max(self._last_id, tag_id)
 
+    async def resolve(self, db: AsyncSession, comments: List[str]) -> None:
+        prefix = settings.deposit_tag_prefix.upper() + "-"
+        now = time.monotonic()
+        missing = set()
+        for c in comments:
+            c = c.upper()
+            if not c.startswith(prefix) or c in self._tags:
+                continue
+            expires = self._misses.get(c)
+            if expires is not None and expires > now:
+                continue
+            missing.add(c)
+        if not missing:
+            return
+        rows = await db.execute(
+            select(DepositTag.tag, DepositTag.user_id).where(
+                DepositTag.tag.in_(missing),
+                DepositTag.is_active.is_(True),
+                DepositTag.user_id.is_not(None),
+            )
+        )
+        for tag, user_id in rows:
+            self._tags[tag.upper()] = user_id
+            missing.discard(tag.upper())
+        for c in missing:
+            self._misses[c] = now + self.miss_ttl
+            self._misses.move_to_end(c)
+        while len(self._misses) > self.miss_maxsize:
+            self._misses.popitem(last=False)
 
-def _set_to_lt(db: Session, new_lt: str) -> None:
-    st = db.get(State, "ton_to_lt")
-    if st is None:
-        st = State(key="ton_to_lt", value=new_lt)
-        db.add(st)
-    else:
-        st.value = new_lt
-    db.commit()
+    def get(self, comment: str) -> Optional[int]:
+        return self._tags.get(comment.upper())
+
+    def __len__(self) -> int:
+        return len(self._tags)
+
+
+_tags = TagIndex()
 
 
-def _extract_max_lt(txs: List[Dict[str, Any]]) -> Optional[str]:
-    lts: List[int] = []
+def _match_deposits(txs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Входящие переводы с комментарием-тегом и суммой (нанотоны) не ниже ton_min_deposit."""
+    min_amount = settings.ton_min_deposit_nano
+    out: List[Dict[str, Any]] = []
     for tx in txs:
-        lt = None
-        tid = tx.get("transaction_id") or {}
-        if isinstance(tid, dict):
-            lt = tid.get("lt") or tid.get("logical_time")
-        if lt is None:
-            lt = tx.get("lt")
-        if lt is None:
+        in_msg = tx.get("in_msg") or {}
+        if not in_msg.get("source"):
+            continue  # внешнее сообщение, не перевод
+        comment = _decode_comment(in_msg)
+        if not comment:
+            continue
+        user_id = _tags.get(comment)
+        if user_id is None:
             continue
         try:
-            lts.append(int(str(lt)))
+            amount = int(in_msg.get("value") or 0)
         except Exception:
             continue
-    if not lts:
-        return None
-    return str(max(lts))
+        if amount <= 0 or amount < min_amount:
+            continue
+        lt, tx_hash = _tx_id(tx)
+        out.append({"user_id": user_id, "amount": amount, "external_id": f"{lt}:{tx_hash}", "tag": comment.upper()})
+    return out
 
 
-# --- Poll loop ---------------------------------------------------------------
-async def poll_once() -> None:
-    with SessionLocal() as db:
-        to_lt = _get_to_lt(db)
-        txs = await _get_transactions(settings.ton_address, limit=16, to_lt=to_lt)
-        if not txs:
-            return
+# --- State helpers -----------------------------------------------------------
+def _cursor_key(address: str) -> str:
+    key = f"{CURSOR_KEY}:{address}"
+    if len(key) > 64:
+        # raw-адрес (0:<hex>) не влезает в state.key — берём хэш
+        key = f"{CURSOR_KEY}:{hashlib.sha1(address.encode()).hexdigest()}"
+    return key
 
-        max_lt = _extract_max_lt(txs)
-        if max_lt:
-            _set_to_lt(db, max_lt)
 
+async def _get_cursor(db: AsyncSession, address: str) -> Optional[TxId]:
+    """Последняя обработанная транзакция адреса (lt, hash) или None при первом запуске."""
+    keys = [_cursor_key(address)]
+    if address == settings.ton_address:
+        # курсор основного адреса раньше хранился без суффикса
+        keys.append(CURSOR_KEY)
+    for key in keys:
+        st = await db.get(State, key)
+        if st and st.value:
+            lt, _, tx_hash = st.value.partition(":")
+            return int(lt), tx_hash
+    if address == settings.ton_address:
+        # старый курсор хранил только lt — используем его как нижнюю границу
+        legacy = await db.get(State, LEGACY_CURSOR_KEY)
+        if legacy and legacy.value:
+            return int(legacy.value), ""
+    return None
+
+
+async def _set_cursor(db: AsyncSession, address: str, cursor: TxId) -> None:
+    """Двигает курсор адреса в текущей транзакции; commit делает вызывающий."""
+    key = _cursor_key(address)
+    value = f"{cursor[0]}:{cursor[1]}"
+    st = await db.get(State, key)
+    if st is None:
+        db.add(State(key=key, value=value))
+    else:
+        st.value = value
+
+
+# --- Ingestion ---------------------------------------------------------------
+async def fetch_new_transactions(
+    address: str,
+    cursor: Optional[TxId],
+    fetch: Fetch = _get_transactions,
+) -> List[Dict[str, Any]]:
+    """
+    Идёт по getTransactions от самой новой транзакции назад страницами
+    (lt/hash последней транзакции страницы + to_lt курсора), пока не дойдёт
+    до уже обработанной. Возвращает новые транзакции от старых к новым.
+
+    Без курсора (первый запуск) берём только первую страницу — не тащим
+    всю архивную историю кошелька.
+    """
+    limit = settings.ton_page_limit
+    to_lt = str(cursor[0]) if cursor else None
+
+    collected: List[Dict[str, Any]] = []
+    seen: set = set()
+    lt: Optional[str] = None
+    tx_hash: Optional[str] = None
+    while True:
+        page = await fetch(address, limit=limit, lt=lt, hash_=tx_hash, to_lt=to_lt)
+        fresh: List[Dict[str, Any]] = []
+        reached = False
+        for tx in page:
+            tid = _tx_id(tx)
+            if tid is None or tid in seen:
+                # первая транзакция страницы — та, с которой мы начали
+                continue
+            if cursor and tid[0] <= cursor[0]:
+                reached = True
+                break
+            seen.add(tid)
+            fresh.append(tx)
+        collected.extend(fresh)
+
+        if reached or cursor is None or not fresh or len(page) < limit:
+            break
+        last = _tx_id(fresh[-1])
+        lt, tx_hash = str(last[0]), last[1]
+
+    collected.reverse()
+    return collected
+
+
+async def poll_address(address: str, fetch: Fetch = _get_transactions) -> int:
+    """
+    Проход по одному адресу: собираем все новые транзакции, обрабатываем их
+    от старых к новым пачками по ton_page_limit (депозиты по тегам пишутся
+    как seen) и в той же DB-транзакции двигаем курсор адреса. Падение
+    посреди прохода не теряет и не дублирует депозиты — следующий проход
+    продолжит с последней закоммиченной пачки.
+    Возвращает количество обработанных транзакций.
+    """
+    with DB_TIME.labels("cursor").time():
+        async with _session() as db:
+            cursor = await _get_cursor(db, address)
+
+    txs = await fetch_new_transactions(address, cursor, fetch)
+    now = time.time()
+    if not txs:
+        _lag[address] = 0.0
+        LAG_LT.labels(address).set(0)
+        return 0
+    utime = txs[0].get("utime")
+    _lag[address] = max(0.0, now - int(utime)) if utime else 0.0
+    LAG_LT.labels(address).set(_tx_id(txs[-1])[0] - cursor[0] if cursor else 0)
+    TXS.inc(len(txs))
+
+    size = max(1, settings.ton_page_limit)
+    write_time = DB_TIME.labels("write")
+    async with _session() as db:
+        for i in range(0, len(txs), size):
+            chunk = txs[i:i + size]
+            t0 = time.perf_counter()
+            await _tags.resolve(db, [_decode_comment(tx.get("in_msg") or {}) for tx in chunk])
+            deposits = _match_deposits(chunk)
+            recorded = await record_deposits(db, deposits) if deposits else 0
+            new_cursor = _tx_id(chunk[-1])
+            await _set_cursor(db, address, new_cursor)
+            await db.commit()
+            write_time.observe(time.perf_counter() - t0)
+            if deposits:
+                await paystatus.publish_many(
+                    {"tag": d["tag"], "status": "seen", "external_id": d["external_id"], "amount": fmt_ton(d["amount"])}
+                    for d in deposits
+                )
+
+            try:
+                log.info(
+                    "ton_watcher_tx_batch",
+                    address=address,
+                    count=len(chunk),
+                    matched=len(deposits),
+                    recorded=recorded,
+                    cursor=f"{new_cursor[0]}:{new_cursor[1]}",
+                )
+            except Exception:
+                pass
+    return len(txs)
+
+
+async def confirm_once(seqno: Seqno = _get_masterchain_seqno) -> int:
+    """Один запрос seqno мастерчейна на все ожидающие платежи; возвращает число начисленных."""
+    mc_seqno = await seqno()
+    with DB_TIME.labels("confirm").time():
+        async with _session() as db:
+            credited = await confirm_payments(db, mc_seqno, settings.ton_require_depth)
+            await db.commit()
+    if credited:
+        CREDITED.inc(len(credited))
         try:
-            log.info("ton_watcher_tx_batch", count=len(txs), new_to_lt=max_lt)
+            log.info("ton_watcher_payments_credited", count=len(credited), mc_seqno=mc_seqno)
         except Exception:
             pass
+        for payment_id, user_id, amount in credited:
+            audit.audit("payment_credited", user_id, payment_id=payment_id, amount_nano=amount, mc_seqno=mc_seqno)
+        await _publish_credited(credited)
+        await _notify_credited(credited)
+    return len(credited)
+
+
+async def _publish_credited(credited: List[Tuple[int, int, Any]]) -> None:
+    """Статус credited для /pay/status — по активным тегам пользователей (один запрос на пачку)."""
+    async with _session() as db:
+        rows = (await db.execute(
+            select(DepositTag.user_id, DepositTag.tag).where(
+                DepositTag.user_id.in_({user_id for _, user_id, _ in credited}),
+                DepositTag.is_active.is_(True),
+            )
+        )).all()
+    tags: Dict[int, List[str]] = {}
+    for user_id, tag in rows:
+        tags.setdefault(user_id, []).append(tag)
+    await paystatus.publish_many(
+        {"tag": tag, "status": "credited", "amount": fmt_ton(amount)}
+        for _, user_id, amount in credited
+        for tag in tags.get(user_id, ())
+    )
+
+
+async def _notify_credited(credited: List[Tuple[int, int, Any]]) -> None:
+    """
+    Уведомления о зачислении — через диспетчер, вне DB-транзакции начисления.
+    Без ожидания места в очереди (резерв для платежей): опрос не встаёт из-за
+    рассылки; при переполнении резерва уведомление только логируется.
+    """
+    dispatcher = get_dispatcher()
+    if dispatcher is None:
+        return
+    async with _session() as db:
+        rows = await db.execute(
+            select(User.id, User.tg_id).where(User.id.in_({user_id for _, user_id, _ in credited}))
+        )
+        tg_ids = dict(rows.all())
+    for _, user_id, amount in credited:
+        tg_id = tg_ids.get(user_id)
+        if tg_id and not dispatcher.send_nowait(tg_id, f"✅ Зачислено {fmt_ton(amount)} TON", priority=PRIORITY_PAYMENT):
+            try:
+                log.warning("payment_notify_dropped", user_id=user_id, amount=amount)
+            except Exception:
+                pass
+
+
+async def poll_once(
+    fetch: Fetch = _get_transactions,
+    seqno: Seqno = _get_masterchain_seqno,
+) -> Dict[str, int]:
+    """
+    Один проход вочера по всем адресам (settings.ton_addresses).
+    Индекс тегов обновляется один раз на проход, адреса опрашиваются
+    параллельно (не больше TON_WATCH_CONCURRENCY одновременно) через общий
+    клиент Toncenter с общим rate limit. Ошибка одного адреса не мешает
+    остальным; если упали все — пробрасываем первую. После адресов —
+    подтверждение платежей по глубине мастерчейна (confirm_once).
+    Возвращает {address: обработано транзакций} по успешным адресам.
+    """
+    t0 = time.perf_counter()
+    with DB_TIME.labels("tags").time():
+        async with _session() as db:
+            await _tags.refresh(db)
+
+    addresses = settings.ton_addresses
+    sem = asyncio.Semaphore(max(1, settings.ton_watch_concurrency))
+
+    async def _one(address: str) -> int:
+        async with sem:
+            return await poll_address(address, fetch)
+
+    results = await asyncio.gather(*(_one(a) for a in addresses), return_exceptions=True)
+    done: Dict[str, int] = {}
+    errors: List[BaseException] = []
+    for address, res in zip(addresses, results):
+        if isinstance(res, BaseException):
+            errors.append(res)
+            try:
+                log.error("ton_watcher_address_error", address=address, error=str(res))
+            except Exception:
+                pass
+        else:
+            done[address] = res
+    if errors and not done:
+        raise errors[0]
+
+    await confirm_once(seqno)
+
+    LAST_POLL.set(time.time())
+    LAG.set(max(_lag.values(), default=0.0))
+    POLL_DURATION.observe(time.perf_counter() - t0)
+    return done
+
+
+# --- Scheduler ---------------------------------------------------------------
+class PollScheduler:
+    """
+    Адаптивный интервал опроса:
+      - полная страница (есть хвост) или недавний запрос тега — min_interval;
+      - были новые транзакции — TON_POLL_INTERVAL;
+      - пусто — интервал растёт в decay раз до max_interval;
+      - ошибка — удваиваем, но не выше max_interval.
+    wake_watcher() (из tagpool.get_deposit_tag) прерывает сон и включает быстрый
+    режим на fast_window секунд.
+    """
+
+    def __init__(
+        self,
+        min_interval: float,
+        base_interval: float,
+        max_interval: float,
+        fast_window: float,
+        decay: float = 1.5,
+    ):
+        self.min_interval = min_interval
+        self.base_interval = max(min_interval, base_interval)
+        self.max_interval = max(self.base_interval, max_interval)
+        self.fast_window = fast_window
+        self.decay = decay
+        self.interval = self.base_interval
+        self._fast_until = 0.0
+        POLL_INTERVAL.set(self.interval)
+
+    def _set(self, value: float) -> None:
+        self.interval = min(self.max_interval, max(self.min_interval, value))
+        POLL_INTERVAL.set(self.interval)
+
+    def kick(self) -> None:
+        self._fast_until = time.monotonic() + self.fast_window
+        self._set(self.min_interval)
+
+    def after_poll(self, processed: int, page_full: bool) -> None:
+        if page_full or time.monotonic() < self._fast_until:
+            self._set(self.min_interval)
+        elif processed:
+            self._set(self.base_interval)
+        else:
+            self._set(self.interval * self.decay)
+
+    def after_error(self) -> None:
+        self._set(max(self.base_interval, self.interval * 2))
+
+    async def sleep(self) -> None:
+        if await events.wait_watcher_wake(self.interval):
+            self.kick()
 
 
 async def run_watcher() -> None:
     await asyncio.sleep(0.5)  # даём подняться приложению
+    scheduler = PollScheduler(
+        min_interval=settings.ton_poll_min_interval,
+        base_interval=settings.ton_poll_interval,
+        max_interval=settings.ton_poll_max_interval,
+        fast_window=settings.ton_poll_fast_window,
+    )
     while True:
         try:
-            await poll_once()
+            counts = await poll_once()
+            scheduler.after_poll(
+                sum(counts.values()),
+                page_full=any(n >= settings.ton_page_limit for n in counts.values()),
+            )
         except Exception as e:
             try:
                 log.error("ton_watcher_error", error=str(e))
             except Exception:
                 print("ton_watcher_error", e)
-            await asyncio.sleep(2.0)
-        await asyncio.sleep(3.0)
+            scheduler.after_error()
+        await scheduler.sleep()
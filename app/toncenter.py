@@ -0,0 +1,268 @@
+# app/toncenter.py
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+try:
+    import structlog
+    log = structlog.get_logger()
+except Exception:
+    import logging
+    log = logging.getLogger("toncenter")
+
+from .metrics import Counter, Histogram
+from .ratelimit import TokenBucket
+
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except Exception:
+    _HTTP2 = False
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# по HTTP-попыткам, не по вызовам call(): ретраи видны отдельно
+REQUEST_LATENCY = Histogram("toncenter_request_duration_seconds", "Toncenter HTTP request latency", ("method",))
+REQUESTS = Counter("toncenter_requests_total", "Toncenter HTTP responses by method and status", ("method", "status"))
+
+
+class ToncenterError(Exception):
+    """Toncenter не ответил успешно после всех попыток (или ok=false)."""
+
+
+def _v2_url(base: str, method: str) -> str:
+    base = base.rstrip("/")
+    # допускаем как https://toncenter.com/api так и /api/v2
+    if base.endswith("/v2"):
+        return f"{base}/{method}"
+    return f"{base}/v2/{method}"
+
+
+def _retry_after(r: httpx.Response) -> Optional[float]:
+    value = r.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class _Endpoint:
+    """Базовый URL + circuit breaker: после threshold ошибок подряд выключаем на cooldown секунд."""
+
+    def __init__(self, base: str):
+        self.base = base
+        self.failures = 0
+        self.open_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return self.open_until <= now
+
+    def ok(self) -> None:
+        self.failures = 0
+        self.open_until = 0.0
+
+    def fail(self, threshold: int, cooldown: float) -> None:
+        self.failures += 1
+        if self.failures >= threshold:
+            self.open_until = time.monotonic() + cooldown
+            try:
+                log.warning("toncenter_breaker_open", base=self.base, cooldown=cooldown)
+            except Exception:
+                pass
+
+
+class ToncenterClient:
+    """
+    Долгоживущий клиент Toncenter v2:
+      - один httpx.AsyncClient (HTTP/2 если есть h2, keep-alive, ограниченный пул),
+      - token bucket под тариф API-ключа (TON_API_RPS),
+      - экспоненциальный backoff с jitter на 429/5xx/сетевые ошибки с учётом
+        Retry-After (не дольше retry_after_cap),
+      - перебор нескольких TON_API_BASE с circuit breaker на каждый: каждый
+        ретрай — на следующий доступный endpoint.
+    transport можно подменить (тесты/бенчмарки против локального фейкового Toncenter).
+    """
+
+    def __init__(
+        self,
+        bases: List[str],
+        api_key: Optional[str] = None,
+        rps: float = 10.0,
+        timeout: float = 20.0,
+        max_connections: int = 10,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 15.0,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 30.0,
+        retry_after_cap: float = 60.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        if not bases:
+            raise ValueError("at least one Toncenter base URL is required")
+        self.endpoints = [_Endpoint(b) for b in bases]
+        self.api_key = api_key
+        self.limiter = TokenBucket(rps)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        # кривой/огромный Retry-After не должен усыплять вочер надолго
+        self.retry_after_cap = retry_after_cap
+
+        headers = {"X-API-Key": api_key} if api_key else {}
+        self._http = httpx.AsyncClient(
+            timeout=timeout,
+            headers=headers,
+            http2=_HTTP2 and transport is None,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=60,
+            ),
+            transport=transport,
+        )
+
+    def _pick(self, after: Optional[_Endpoint] = None) -> _Endpoint:
+        """
+        Первый доступный endpoint; after — тот, что только что не ответил:
+        ретрай идёт на следующий за ним по кругу (сам after — последним).
+        """
+        now = time.monotonic()
+        order = self.endpoints
+        if after is not None:
+            i = self.endpoints.index(after) + 1
+            order = self.endpoints[i:] + self.endpoints[:i]
+        for ep in order:
+            if ep.available(now):
+                return ep
+        # все выключены — берём тот, что откроется раньше всех
+        return min(self.endpoints, key=lambda e: e.open_until)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    async def call(self, method: str, params: Dict[str, Any]) -> Any:
+        """GET-метод v2; возвращает data['result']."""
+        params = dict(params)
+        if self.api_key:
+            params["api_key"] = self.api_key  # дублируем — Toncenter это принимает
+
+        last_error: Optional[Exception] = None
+        ep = self._pick()
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            delay: Optional[float] = None
+            t0 = time.perf_counter()
+            try:
+                r = await self._http.get(_v2_url(ep.base, method), params=params)
+            except httpx.TransportError as e:
+                REQUEST_LATENCY.labels(method).observe(time.perf_counter() - t0)
+                REQUESTS.labels(method, "error").inc()
+                ep.fail(self.breaker_threshold, self.breaker_cooldown)
+                last_error = e
+            else:
+                REQUEST_LATENCY.labels(method).observe(time.perf_counter() - t0)
+                REQUESTS.labels(method, r.status_code).inc()
+                if r.status_code in RETRY_STATUSES:
+                    if r.status_code != 429:
+                        ep.fail(self.breaker_threshold, self.breaker_cooldown)
+                    delay = _retry_after(r)
+                    last_error = httpx.HTTPStatusError(
+                        f"Toncenter {method} -> {r.status_code}", request=r.request, response=r
+                    )
+                else:
+                    r.raise_for_status()
+                    ep.ok()
+                    data = r.json()
+                    if isinstance(data, dict) and data.get("ok") is False:
+                        raise ToncenterError(f"Toncenter {method}: {data.get('error')}")
+                    return data.get("result") if isinstance(data, dict) else data
+
+            if attempt >= self.max_retries:
+                break
+            failed, ep = ep, self._pick(after=ep)
+            # Retry-After относится к ответившему endpoint'у; на другой идём с обычным backoff
+            if delay is None or ep is not failed:
+                delay = self._backoff(attempt)
+            delay = min(delay, self.retry_after_cap)
+            try:
+                log.warning("toncenter_retry", method=method, base=failed.base, next_base=ep.base, attempt=attempt + 1, delay=round(delay, 2), error=str(last_error))
+            except Exception:
+                pass
+            await asyncio.sleep(delay)
+
+        raise ToncenterError(f"Toncenter {method} failed after {self.max_retries + 1} attempts: {last_error}")
+
+    async def get_transactions(
+        self,
+        address: str,
+        limit: int = 16,
+        lt: Optional[str] = None,
+        hash_: Optional[str] = None,
+        to_lt: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        getTransactions (archival): lt/hash — с какой транзакции начинать
+        (она сама входит в ответ), to_lt — нижняя граница. От новых к старым.
+        """
+        params: Dict[str, Any] = {"address": address, "limit": limit, "archival": "true"}
+        if lt and hash_:
+            params["lt"] = lt
+            params["hash"] = hash_
+        if to_lt:
+            params["to_lt"] = to_lt
+        return await self.call("getTransactions", params) or []
+
+    async def get_masterchain_seqno(self) -> int:
+        """seqno последнего блока мастерчейна (getMasterchainInfo)."""
+        info = await self.call("getMasterchainInfo", {})
+        return int(info["last"]["seqno"])
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+
+# --- Общий клиент на процесс (создаётся в on_startup) ------------------------
+_client: Optional[ToncenterClient] = None
+
+
+def init_client(settings, transport: Optional[httpx.AsyncBaseTransport] = None) -> ToncenterClient:
+    global _client
+    _client = ToncenterClient(
+        settings.ton_api_bases,
+        api_key=settings.ton_api_key or None,
+        rps=settings.ton_api_rps,
+        max_connections=settings.ton_http_max_connections,
+        transport=transport,
+    )
+    return _client
+
+
+def get_client(settings=None) -> ToncenterClient:
+    if _client is None:
+        if settings is None:
+            from .config import get_settings
+            settings = get_settings()
+        return init_client(settings)
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+    _client = None
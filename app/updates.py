@@ -0,0 +1,115 @@
+# app/updates.py
+from __future__ import annotations
+
+import asyncio
+import contextlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+try:
+    import structlog
+    log = structlog.get_logger()
+except Exception:
+    import logging
+    log = logging.getLogger("updates")
+
+from .metrics import Counter, Gauge
+
+QUEUE_DEPTH = Gauge("telegram_update_queue_depth", "Updates waiting in the in-process queue")
+REJECTED = Counter("telegram_updates_rejected_total", "Updates rejected with 503 because the queue was full")
+FAILED = Counter("telegram_updates_failed_total", "Updates whose processing raised")
+
+Process = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def update_key(data: Dict[str, Any]) -> int:
+    """Ключ упорядочивания: id чата (или пользователя), иначе update_id."""
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post", "business_message"):
+        chat = (data.get(field) or {}).get("chat") or {}
+        if "id" in chat:
+            return int(chat["id"])
+    cq = data.get("callback_query") or {}
+    if cq:
+        chat = ((cq.get("message") or {}).get("chat")) or {}
+        if "id" in chat:
+            return int(chat["id"])
+    for field in ("callback_query", "inline_query", "chosen_inline_result", "shipping_query",
+                  "pre_checkout_query", "my_chat_member", "chat_member", "chat_join_request"):
+        obj = data.get(field) or {}
+        sender = obj.get("from") or {}
+        if "id" in sender:
+            return int(sender["id"])
+    return int(data.get("update_id") or 0)
+
+
+class UpdateQueue:
+    """
+    Ограниченная очередь апдейтов за вебхуком.
+
+    workers корутин, у каждой своя очередь на maxsize // workers элементов;
+    апдейт попадает в очередь по update_key(...) % workers, поэтому апдейты
+    одного чата обрабатываются строго по порядку, а разные чаты — параллельно.
+    submit() не ждёт: если очередь полна, возвращает False (вебхук отвечает
+    503, и Telegram повторит доставку позже).
+    """
+
+    def __init__(self, process: Process, workers: int = 8, maxsize: int = 1000):
+        self.process = process
+        self.workers = max(1, workers)
+        per_worker = max(1, maxsize // self.workers)
+        self._queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self._tasks: List[asyncio.Task] = []
+        self._accepting = False
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._accepting = True
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def submit(self, data: Dict[str, Any], key: Optional[int] = None) -> bool:
+        if not self._accepting:
+            return False
+        if key is None:
+            key = update_key(data)
+        try:
+            self._queues[key % self.workers].put_nowait(data)
+        except asyncio.QueueFull:
+            REJECTED.inc()
+            return False
+        QUEUE_DEPTH.set(self.depth())
+        return True
+
+    async def _worker(self, q: asyncio.Queue) -> None:
+        while True:
+            data = await q.get()
+            try:
+                await self.process(data)
+            except Exception as e:
+                FAILED.inc()
+                try:
+                    log.error("telegram_update_error", update_id=data.get("update_id"), error=str(e))
+                except Exception:
+                    pass
+            finally:
+                q.task_done()
+                QUEUE_DEPTH.set(self.depth())
+
+    async def drain(self, timeout: float = 10.0) -> None:
+        """Перестаёт принимать новые апдейты, дорабатывает очередь (не дольше timeout) и гасит воркеров."""
+        self._accepting = False
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout=timeout)
+        except asyncio.TimeoutError:
+            try:
+                log.warning("telegram_update_queue_drain_timeout", left=self.depth())
+            except Exception:
+                pass
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
@@ -0,0 +1,225 @@
+# app/users.py
+"""
+Реестр пользователей: tg_id -> (user_id, language) для каждого апдейта.
+
+Пре-хендлер PTB (handlers.resolve_user, группа -1) спрашивает реестр на
+каждый апдейт от пользователя:
+
+  - попадание в LRU (USER_CACHE_SIZE) — 0 запросов к БД;
+  - промах — один statement в autocommit: INSERT ... ON CONFLICT (tg_id)
+    DO NOTHING RETURNING + SELECT существующей строки; параллельные промахи
+    по одному tg_id ждут один и тот же запрос;
+  - сменившийся language_code не пишется сразу: он копится в буфере и
+    фоновая задача пишет его пачкой одним UPDATE ... FROM unnest раз в
+    USER_FLUSH_INTERVAL секунд (остаток — при остановке, close_registry).
+
+referrer_id записывается только при создании пользователя — из payload
+/start ref<user_id> (реферер должен существовать).
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+try:
+    import structlog
+    log = structlog.get_logger()
+except Exception:
+    import logging
+    log = logging.getLogger("users")
+
+from . import db as _db
+from .metrics import Counter, Gauge
+
+CACHE_HITS = Counter("user_cache_hits_total", "User lookups served from the in-process registry")
+DB_LOOKUPS = Counter("user_db_lookups_total", "User lookups that had to query the database")
+CREATED = Counter("users_created_total", "Users inserted by the registry")
+LANG_WRITES = Counter("user_language_writes_total", "Language changes written by the write-behind flush")
+LANG_PENDING = Gauge("user_language_pending", "Language changes waiting for the write-behind flush")
+
+REF_PREFIX = "ref"
+MAX_USER_ID = 2**31 - 1
+
+_UPSERT_SQL = text("""
+WITH ins AS (
+    INSERT INTO users (tg_id, language, referrer_id)
+    VALUES (:tg_id, :language, (SELECT id FROM users WHERE id = CAST(:referrer_id AS integer)))
+    ON CONFLICT (tg_id) DO NOTHING
+    RETURNING id, language
+)
+SELECT id, language, true AS created FROM ins
+UNION ALL
+SELECT id, language, false AS created FROM users WHERE tg_id = :tg_id
+LIMIT 1
+""")
+
+_LANG_SQL = text("""
+UPDATE users AS u SET language = v.language
+FROM unnest(CAST(:ids AS integer[]), CAST(:languages AS varchar[])) AS v(id, language)
+WHERE u.id = v.id AND u.language IS DISTINCT FROM v.language
+""")
+
+
+def parse_referrer(payload: Optional[str]) -> Optional[int]:
+    """Payload deep link /start ref<user_id> -> user_id реферера."""
+    if not payload or not payload.startswith(REF_PREFIX):
+        return None
+    digits = payload[len(REF_PREFIX):]
+    if not digits.isdigit() or len(digits) > 10:
+        return None
+    referrer_id = int(digits)
+    # users.id — integer: больше не бывает, а CAST в _UPSERT_SQL упал бы
+    return referrer_id if referrer_id <= MAX_USER_ID else None
+
+
+class UserRegistry:
+    def __init__(self, maxsize: int = 100_000, flush_interval: float = 2.0, flush_batch: int = 1000):
+        self.maxsize = max(1, maxsize)
+        self.flush_interval = flush_interval
+        self.flush_batch = max(1, flush_batch)
+        self._items: "OrderedDict[int, Tuple[int, str]]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+        # user_id -> язык, ещё не записанный в БД
+        self._pending: Dict[int, str] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    # --- API ------------------------------------------------------------------
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def resolve(self, tg_id: int, language: Optional[str] = None, referrer_id: Optional[int] = None) -> int:
+        """Внутренний user_id пользователя Telegram; создаёт пользователя при первом обращении."""
+        language = language[:8] if language else None
+        item = self._items.get(tg_id)
+        if item is not None:
+            self._items.move_to_end(tg_id)
+            CACHE_HITS.inc()
+        else:
+            fut = self._loading.get(tg_id)
+            if fut is None:
+                fut = self._loading[tg_id] = asyncio.ensure_future(self._query(tg_id, language or "ru", referrer_id))
+                fut.add_done_callback(lambda f: self._loading.pop(tg_id, None))
+            item = await asyncio.shield(fut)
+        user_id, known = item
+        if language and language != known:
+            self._set_language(tg_id, user_id, language)
+        return user_id
+
+    async def flush(self) -> int:
+        """Пишет накопленные смены языка; возвращает число записанных."""
+        written = 0
+        while self._pending:
+            written += await self._write_batch()
+        return written
+
+    async def close(self, timeout: float = 10.0) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except Exception as e:
+            try:
+                log.error("user_language_lost_on_shutdown", left=len(self._pending), error=str(e))
+            except Exception:
+                pass
+
+    # --- internals ------------------------------------------------------------
+    def _put(self, tg_id: int, item: Tuple[int, str]) -> None:
+        self._items[tg_id] = item
+        self._items.move_to_end(tg_id)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def _set_language(self, tg_id: int, user_id: int, language: str) -> None:
+        self._put(tg_id, (user_id, language))
+        self._pending[user_id] = language
+        LANG_PENDING.set(len(self._pending))
+        if len(self._pending) >= self.flush_batch:
+            self._wake.set()
+
+    async def _query(self, tg_id: int, language: str, referrer_id: Optional[int]) -> Tuple[int, str]:
+        DB_LOOKUPS.inc()
+        params = {"tg_id": tg_id, "language": language, "referrer_id": referrer_id}
+        # один statement, без BEGIN/COMMIT — ровно один round-trip
+        async with _db.async_engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            row = (await conn.execute(_UPSERT_SQL, params)).first()
+            if row is None:
+                # параллельная вставка из другого процесса закоммитилась после
+                # снимка нашего statement — повтор её уже увидит
+                row = (await conn.execute(_UPSERT_SQL, params)).one()
+        if row.created:
+            CREATED.inc()
+        item = (row.id, row.language or "ru")
+        self._put(tg_id, item)
+        return item
+
+    async def _write_batch(self) -> int:
+        batch = dict(list(self._pending.items())[:self.flush_batch])
+        for user_id in batch:
+            del self._pending[user_id]
+        try:
+            async with _db.async_engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await conn.execute(_LANG_SQL, {"ids": list(batch), "languages": list(batch.values())})
+        except Exception:
+            # возвращаем, не затирая то, что пришло за время записи
+            for user_id, language in batch.items():
+                self._pending.setdefault(user_id, language)
+            LANG_PENDING.set(len(self._pending))
+            raise
+        LANG_WRITES.inc(len(batch))
+        LANG_PENDING.set(len(self._pending))
+        return len(batch)
+
+    async def _run(self) -> None:
+        delay = self.flush_interval
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), delay)
+            self._wake.clear()
+            try:
+                await self.flush()
+                delay = self.flush_interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                delay = min(30.0, max(delay, self.flush_interval) * 2)
+                try:
+                    log.error("user_language_flush_error", pending=len(self._pending), error=str(e))
+                except Exception:
+                    pass
+
+
+# --- Общий реестр процесса (создаётся в on_startup) --------------------------
+_registry: Optional[UserRegistry] = None
+
+
+def init_registry(settings) -> UserRegistry:
+    global _registry
+    _registry = UserRegistry(settings.user_cache_size, settings.user_flush_interval, settings.user_flush_batch)
+    _registry.start()
+    return _registry
+
+
+def get_registry() -> UserRegistry:
+    global _registry
+    if _registry is None:
+        _registry = UserRegistry()
+    return _registry
+
+
+async def close_registry(timeout: float = 10.0) -> None:
+    global _registry
+    if _registry is not None:
+        await _registry.close(timeout)
+    _registry = None
@@ -1,24 +1,39 @@
 from __future__ import annotations
 
+from . import boot  # первым: от него считается время старта
+
 import asyncio
-import base64
 import contextlib
-from typing import Optional
-
-import structlog
-from fastapi import FastAPI, Header, HTTPException, Request
-from fastapi.responses import JSONResponse, HTMLResponse, Response, PlainTextResponse
-from telegram import Update
-from telegram.ext import Application
-
-from .config import load_settings
-from .handlers import register as register_handlers
-from .ton_watch import run_watcher
+import hashlib
+from typing import TYPE_CHECKING, FrozenSet, Optional
+
+with boot.phase("import_web"):
+    import structlog
+    from fastapi import FastAPI, Header, HTTPException, Request
+    from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+
+with boot.phase("import_app"):
+    from . import audit, db as _db, events, fastjson, metrics, paylinks, paystatus, tagpool, toncenter, users
+    from .assets import get_pay_assets
+    from .config import get_settings
+    from .dedupe import build_deduper
+    from .instrument import InstrumentMiddleware, build_profiler, instrument_handlers
+    from .metrics import Counter
+    from .money import to_nano
+    from .leader import run_as_leader
+    from .updates import UpdateQueue
+
+if TYPE_CHECKING:
+    from telegram.ext import Application
 
 logger = structlog.get_logger()
 
 app = FastAPI()
-settings = load_settings()
+settings = get_settings()
+
+# латентность по маршрутам + опциональный профиль медленных запросов
+profiler = build_profiler(settings)
+app.add_middleware(InstrumentMiddleware, profiler=profiler)
 
 
 def _secret(val):
@@ -30,9 +45,52 @@ def _secret(val):
 
 
 # ===== Telegram Bot (python-telegram-bot v22) =====
-_bot_token = _secret(settings.bot_token)  # SecretStr -> str
-tg_app: Application = Application.builder().token(_bot_token).build()
-register_handlers(tg_app)
+# Application (и весь telegram/PTB) строится лениво — при старте, а не при
+# импорте модуля
+tg_app: Optional["Application"] = None
+
+# Типы апдейтов, которые есть кому обработать (None — все); остальные
+# подтверждаем сразу, не строя объекты PTB
+_wanted_updates: Optional[FrozenSet[str]] = None
+IGNORED_UPDATES = Counter("telegram_updates_ignored_total", "Updates acknowledged without processing (no handler for the type)")
+
+
+def get_tg_app() -> "Application":
+    global tg_app, _wanted_updates
+    if tg_app is None:
+        from telegram.ext import Application, ContextTypes
+        from .handlers import BotContext, handled_update_types, register as register_handlers
+
+        application = (
+            Application.builder()
+            .token(_secret(settings.bot_token))
+            .context_types(ContextTypes(context=BotContext))
+            .build()
+        )
+        register_handlers(application)
+        instrument_handlers(application)
+        _wanted_updates = handled_update_types(application)
+        tg_app = application
+    return tg_app
+
+
+async def _process_raw_update(data: dict) -> None:
+    from telegram import Update
+
+    update = Update.de_json(data, tg_app.bot)
+    await tg_app.process_update(update)
+
+
+# Вебхук только кладёт апдейт в очередь, обработка — в пуле воркеров
+update_queue = UpdateQueue(
+    _process_raw_update,
+    workers=settings.update_workers,
+    maxsize=settings.update_queue_size,
+)
+
+
+# Повторная доставка того же update_id отсекается до Update.de_json
+deduper = build_deduper(settings)
 
 
 # ======= Webhook endpoint =======
@@ -42,188 +100,298 @@ async def telegram_webhook(
     x_telegram_bot_api_secret_token: Optional[str] = Header(None),
 ):
     # Проверка секрета вебхука
-    expected = _secret(getattr(settings, "webhook_secret", None))
+    expected = _secret(getattr(settings, "telegram_webhook_secret", None))
     if expected and x_telegram_bot_api_secret_token != expected:
         raise HTTPException(status_code=403, detail="invalid webhook secret")
 
-    data = await request.json()
-    update = Update.de_json(data, tg_app.bot)
-    await tg_app.process_update(update)
+    try:
+        data = fastjson.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid json")
+    if not isinstance(data, dict) or "update_id" not in data:
+        raise HTTPException(status_code=400, detail="not a telegram update")
+
+    if _wanted_updates is not None and _wanted_updates.isdisjoint(data):
+        IGNORED_UPDATES.inc()
+        return PlainTextResponse("OK")
+
+    update_id = int(data["update_id"])
+    if not await deduper.first_seen(update_id):
+        return PlainTextResponse("OK")
+
+    # Очередь полна — 503, Telegram доставит апдейт повторно
+    if not update_queue.submit(data):
+        await deduper.forget(update_id)
+        raise HTTPException(status_code=503, detail="busy")
     return PlainTextResponse("OK")
 
 
 # ======= LIFECYCLE =======
 @app.on_event("startup")
 async def on_startup():
-    # ОБЯЗАТЕЛЬНО: инициализируем и запускаем Application
-    await tg_app.initialize()
-    await tg_app.start()
+    if profiler is not None:
+        profiler.start()
+    with boot.phase("clients"):
+        # Async-пул БД: вочер и хендлеры не блокируют event loop
+        _db.init_async_db(settings.database_url, settings)
+        # Один HTTP-клиент Toncenter на процесс (keep-alive, rate limit, failover)
+        toncenter.init_client(settings)
+        tagpool.configure(settings)
+        # tg_id -> user_id для пре-хендлера; смена языка пишется пачками в фоне
+        users.init_registry(settings)
+        paystatus.configure(settings)
+        # аудит пишется пачками в фоне, хендлеры и вочер в БД за ним не ходят
+        audit.init_audit(settings)
+        # страница оплаты/manifest/иконка: рендер и сжатие один раз на процесс
+        get_pay_assets(settings)
+        paylinks.configure(settings)
+
+    with boot.phase("tg_build"):
+        application = get_tg_app()
+        from .dispatcher import init_dispatcher
+
+    # ОБЯЗАТЕЛЬНО: инициализируем и запускаем Application (getMe — сетевой запрос)
+    with boot.phase("tg_initialize"):
+        await application.initialize()
+        await application.start()
+    update_queue.start()
+    # Исходящие уведомления/рассылки — через диспетчер с лимитами Telegram
+    init_dispatcher(application.bot, settings)
+
+    # Вебхук сверяем в фоне: приложению он для старта не нужен
+    app.state._webhook_task = asyncio.create_task(_sync_webhook_safe(application))
+
+    # Стартуем TON watcher в фоне: вебхук обслуживают все процессы,
+    # а вочер крутит только лидер (advisory lock в Postgres)
+    app.state._ton_task = asyncio.create_task(_run_watcher_safe())
+    # Пул свободных тегов депозита тоже доливает только лидер
+    app.state._tag_pool_task = asyncio.create_task(_run_tag_pool_safe())
+    # Чистка старого аудита — тоже только на лидере
+    app.state._audit_retention_task = asyncio.create_task(_run_audit_retention_safe())
+    # Выводы: воркеры на каждом инстансе, заявки разводит FOR UPDATE SKIP LOCKED
+    if settings.withdraw_api_url:
+        app.state._withdraw_task = asyncio.create_task(_run_withdrawals_safe())
+    # События статусов оплаты от вочера другого инстанса — через LISTEN
+    if settings.pay_status_backend.lower() == "postgres":
+        app.state._pay_status_task = asyncio.create_task(paystatus.run_listener(settings.database_url))
+
+    boot.report(settings.startup_budget_seconds)
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # Останавливаем фоновые задачи (вочер, пул тегов)
+    for name in ("_webhook_task", "_ton_task", "_tag_pool_task", "_audit_retention_task", "_withdraw_task", "_pay_status_task"):
+        task: asyncio.Task | None = getattr(app.state, name, None)
+        if task and not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    # Дорабатываем уже принятые апдейты, новые получат 503
+    await update_queue.drain(timeout=settings.update_drain_timeout)
+
+    from .dispatcher import close_dispatcher
+
+    await close_dispatcher()
+    # остаток аудита и смен языка дописываем, пока пул БД ещё жив
+    await audit.close_audit()
+    await users.close_registry()
+
+    # Корректно гасим Application
+    if tg_app is not None:
+        with contextlib.suppress(Exception):
+            await tg_app.stop()
+            await tg_app.shutdown()
+
+    await toncenter.close_client()
+    await _db.dispose_async_db()
+
+    if profiler is not None:
+        profiler.stop()
+
+
+def _webhook_fingerprint(url: str, secret: Optional[str], allowed) -> str:
+    # секрет getWebhookInfo не возвращает — сравниваем отпечаток того, что ставили
+    raw = "|".join([url, secret or "", ",".join(allowed or [])])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def sync_webhook(bot) -> bool:
+    """
+    Ставит вебхук, только если он отличается от нужного: URL сверяется с
+    getWebhookInfo, секрет и allowed_updates — по отпечатку в state.
+    Возвращает True, если setWebhook вызывался. Без лишнего setWebhook
+    (с drop_pending_updates) не теряются апдейты, разбудившие инстанс.
+    """
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+    from .models import State
 
-    # Устанавливаем Telegram Webhook (мы используем свой FastAPI-сервер)
     base = str(settings.base_url).rstrip("/")
     webhook_url = base + getattr(settings, "webhook_path", "/webhook/telegram")
-    await tg_app.bot.set_webhook(
-        url=webhook_url,
-        secret_token=_secret(getattr(settings, "webhook_secret", None)),
-        drop_pending_updates=True,
-    )
+    secret = _secret(getattr(settings, "telegram_webhook_secret", None))
+    # не просим Telegram присылать то, что всё равно отбросим
+    allowed = sorted(_wanted_updates) if _wanted_updates is not None else None
+    fingerprint = _webhook_fingerprint(webhook_url, secret, allowed)
+
+    info = await bot.get_webhook_info()
+    async with _db.AsyncSessionLocal() as db:
+        stored = await db.get(State, "webhook_fingerprint")
+        if info.url == webhook_url and stored is not None and stored.value == fingerprint:
+            logger.info("webhook_unchanged", url=webhook_url)
+            return False
+
+        await bot.set_webhook(
+            url=webhook_url,
+            secret_token=secret,
+            drop_pending_updates=True,
+            allowed_updates=allowed,
+        )
+        ins = pg_insert(State).values(key="webhook_fingerprint", value=fingerprint)
+        await db.execute(ins.on_conflict_do_update(index_elements=[State.key], set_={"value": ins.excluded.value}))
+        await db.commit()
     logger.info("webhook_set", url=webhook_url)
+    return True
 
-    # Стартуем TON watcher в фоне
-    app.state._ton_task = asyncio.create_task(_run_watcher_safe())
 
+async def _sync_webhook_safe(application):
+    try:
+        await sync_webhook(application.bot)
+    except Exception as e:
+        logger.error("webhook_sync_error", error=str(e))
 
-@app.on_event("shutdown")
-async def on_shutdown():
-    # Останавливаем фонового наблюдателя
-    task: asyncio.Task | None = getattr(app.state, "_ton_task", None)
-    if task and not task.done():
-        task.cancel()
-        with contextlib.suppress(asyncio.CancelledError):
-            await task
 
-    # Корректно гасим Application
-    with contextlib.suppress(Exception):
-        await tg_app.stop()
-        await tg_app.shutdown()
+async def _watch_with_wakeups():
+    """Вочер лидера + NOTIFY watcher_wake: тег, запрошенный в другом процессе, тоже будит вочер."""
+    from .ton_watch import run_watcher
+
+    await asyncio.gather(run_watcher(), events.run_wake_listener(settings.database_url))
 
 
 async def _run_watcher_safe():
     try:
-        await run_watcher()
+        await run_as_leader(
+            _watch_with_wakeups,
+            "ton_watcher",
+            lease=settings.leader_lease_seconds,
+            retry=settings.leader_retry_seconds,
+        )
     except Exception as e:
         logger.error("ton_watcher_error", error=str(e))
 
 
+async def _run_tag_pool_safe():
+    try:
+        await run_as_leader(
+            lambda: tagpool.run_tag_pool(settings),
+            "tag_pool",
+            lease=settings.leader_lease_seconds,
+            retry=settings.leader_retry_seconds,
+        )
+    except Exception as e:
+        logger.error("tag_pool_error", error=str(e))
+
+
+async def _run_withdrawals_safe():
+    from .withdrawals import run_withdrawals
+
+    try:
+        await run_withdrawals(settings)
+    except Exception as e:
+        logger.error("withdrawals_error", error=str(e))
+
+
+async def _run_audit_retention_safe():
+    try:
+        await run_as_leader(
+            lambda: audit.run_audit_retention(settings),
+            "audit_retention",
+            lease=settings.leader_lease_seconds,
+            retry=settings.leader_retry_seconds,
+        )
+    except Exception as e:
+        logger.error("audit_retention_error", error=str(e))
+
+
 # ======= Простая главная =======
 @app.get("/", response_class=PlainTextResponse)
 def root():
     return "ok"
 
 
-# ======= TON Connect: manifest + icon + pay page =======
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-# 1x1 PNG (прозрачная), чтобы не возиться со статикой
-_ICON_B64 = (
-    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAAC0lEQVR4nGNgYAAAAAMAASsJTYQAAAAASUVORK5CYII="
-)
+
+# ======= TON Connect: manifest + icon + pay page =======
+# Всё собрано заранее (app.assets): готовые байты, gzip/br, ETag, Cache-Control.
+# Обработчики async — работы нет, незачем гонять их через threadpool.
 
 @app.get("/icon.png")
-def tonconnect_icon():
-    data = base64.b64decode(_ICON_B64)
-    return Response(content=data, media_type="image/png")
+async def tonconnect_icon(request: Request):
+    return get_pay_assets(settings).icon.response(request.headers)
 
 
-@app.get("/tonconnect-manifest.json", response_class=JSONResponse)
-def tonconnect_manifest():
-    base = str(settings.base_url).rstrip("/")
-    return {
-        "url": base,
-        "name": "Bot Payments",
-        "iconUrl": f"{base}/icon.png",
-    }
+@app.get("/tonconnect-manifest.json")
+async def tonconnect_manifest(request: Request):
+    return get_pay_assets(settings).manifest.response(request.headers)
 
 
 @app.get("/pay", response_class=HTMLResponse)
-def pay(amount: float, memo: str = "", to: Optional[str] = None):
+async def pay(request: Request):
     """
-    Страница оплаты через TON Connect.
-    GET-параметры:
-      - amount: сумма в TON (float), напр. 2.5
+    Страница оплаты через TON Connect — одна неизменяемая оболочка, сервер
+    параметры не разбирает. GET-параметры (страница читает их сама из
+    query-строки):
+      - amount: сумма в TON десятичной строкой (до 9 знаков), напр. 2.5
       - memo: произвольный комментарий (не обязателен)
       - to: адрес получателя (если не указан — берём из настроек)
     """
-    to_addr = to or settings.ton_address
-    base = str(settings.base_url).rstrip("/")
+    return get_pay_assets(settings).pay.response(request.headers)
+
 
-    html = f"""<!doctype html>
-<html lang="ru">
-<head>
-  <meta charset="utf-8" />
-  <meta name="viewport" content="width=device-width,initial-scale=1" />
-  <meta name="ton-connect-manifest" content="{base}/tonconnect-manifest.json" />
-  <title>Оплата через TON Connect</title>
-  <style>
-    body {{ font-family: system-ui,-apple-system,Segoe UI,Roboto,Ubuntu,'Helvetica Neue',Arial; padding: 24px; max-width: 680px; margin: 0 auto; }}
-    .card {{ border: 1px solid #e5e7eb; border-radius: 16px; padding: 20px; }}
-    .row {{ margin: 8px 0; }}
-    button {{ padding: 12px 16px; border-radius: 12px; border: none; cursor: pointer; }}
-    #connect {{ background: #111827; color: white; }}
-    #paybtn {{ background: #2563eb; color: white; }}
-    .muted {{ color: #6b7280; font-size: 14px; }}
-    .addr {{ font-family: ui-monospace, Menlo, Monaco, Consolas, "Liberation Mono", monospace; }}
-  </style>
-</head>
-<body>
-  <h1>Оплата через TON Connect</h1>
-  <div class="card">
-    <div class="row">Получатель: <span class="addr">{to_addr}</span></div>
-    <div class="row">Сумма: <b id="amt">{amount}</b> TON</div>
-    <div class="row">Комментарий: <span id="memo">{memo or "—"}</span></div>
-    <div class="row muted">Выберите кошелёк и подтвердите перевод.</div>
-    <div class="row" style="display:flex; gap:10px; margin-top:16px;">
-      <button id="connect">Подключить кошелёк</button>
-      <button id="paybtn">Оплатить</button>
-    </div>
-    <div class="row muted" id="status" style="margin-top:12px;"></div>
-  </div>
-
-  <script type="module">
-    import {{ TonConnectUI }} from "https://unpkg.com/@tonconnect/ui@latest/dist/tonconnect-ui.min.js";
-
-    const manifestUrl = "{base}/tonconnect-manifest.json";
-    const tonConnectUI = new TonConnectUI({{ manifestUrl }});
-
-    const toAddr = "{to_addr}";
-    const amountTON = {amount};
-    const memo = {memo!r};
-
-    const amountNano = BigInt(Math.round(amountTON * 1e9)).toString();
-
-    const statusEl = document.getElementById("status");
-    const setStatus = (t) => statusEl.textContent = t;
-
-    document.getElementById("connect").onclick = async () => {{
-      try {{
-        await tonConnectUI.openModal();
-      }} catch (e) {{
-        setStatus("Не удалось открыть список кошельков: " + e);
-      }}
-    }};
-
-    function buildTx() {{
-      return {{
-        validUntil: Math.floor(Date.now()/1000) + 600,
-        messages: [{{
-          address: toAddr,
-          amount: amountNano
-          // payload: addCommentPayload(memo) // включи, если нужен комментарий в цепочку
-        }}]
-      }};
-    }}
-
-    // Пример добавления комментария (опционально):
-    // import {{ beginCell }} from "https://unpkg.com/@ton/core@latest/dist/index.js";
-    // function addCommentPayload(text) {{
-    //   if (!text) return undefined;
-    //   const cell = beginCell().storeUint(0, 32).storeStringTail(text).endCell();
-    //   return cell.toBoc({{ idx: false }}).toString("base64");
-    // }}
-
-    document.getElementById("paybtn").onclick = async () => {{
-      try {{
-        if (!tonConnectUI.account) {{
-          await tonConnectUI.openModal();
-        }}
-        const tx = buildTx();
-        await tonConnectUI.sendTransaction(tx);
-        setStatus("Запрос на транзакцию отправлен в кошелёк.");
-      }} catch (e) {{
-        setStatus("Ошибка: " + (e?.message || e));
-      }}
-    }};
-  </script>
-</body>
-</html>
-"""
-    return HTMLResponse(html)
+@app.get("/qr")
+async def pay_qr(request: Request, amount: str, tag: str = "", to: Optional[str] = None, fmt: str = "png", sig: str = ""):
+    """
+    QR с ton://-ссылкой оплаты (PNG или SVG) для оплаты с десктопа.
+    Только на наши адреса (TON_ADDRESS / TON_ADDRESSES) и только по ссылке,
+    подписанной ботом (sig); отрисованные QR кэшируются, повтор с
+    If-None-Match получает 304.
+    """
+    address = to or settings.ton_address
+    if address not in settings.ton_addresses or len(tag) > 64 or fmt not in paylinks.QR_FORMATS:
+        raise HTTPException(status_code=400, detail="invalid parameters")
+    try:
+        nano = to_nano(amount)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid amount")
+    if nano <= 0:
+        raise HTTPException(status_code=400, detail="invalid amount")
+    service = paylinks.get_service(settings)
+    if not service.verify(address, nano, tag, sig):
+        raise HTTPException(status_code=403, detail="invalid signature")
+    try:
+        asset = await service.qr(address, nano, tag, fmt)
+    except RuntimeError:
+        raise HTTPException(status_code=503, detail="QR rendering unavailable")
+    return asset.response(request.headers)
+
+
+@app.get("/pay/status")
+async def pay_status(memo: str, since: str = "pending", after: Optional[float] = None, timeout: Optional[float] = None):
+    """
+    Long-poll статуса оплаты по memo (тегу депозита).
+      - since: статус, который клиент уже знает — ответ придёт, когда будет новее;
+      - after: unix time, платежи раньше не учитываются (открытие страницы);
+      - timeout: сколько ждать, не больше PAY_STATUS_MAX_WAIT.
+    Ожидание — на in-process событии от вочера; с PAY_STATUS_BACKEND=memory
+    статус, взятый из БД, перечитывается раз в PAY_STATUS_DB_TTL секунд.
+    """
+    memo = memo.strip()
+    if not memo or len(memo) > 64:
+        raise HTTPException(status_code=400, detail="invalid memo")
+    wait = settings.pay_status_max_wait if timeout is None else max(0.0, min(timeout, settings.pay_status_max_wait))
+    entry = await paystatus.board.wait(memo, since=since, after=after, timeout=wait)
+    body = {"memo": memo.upper(), "status": entry["status"], "amount": entry.get("amount")}
+    return JSONResponse(body, headers={"Cache-Control": "no-store"})
@@ -0,0 +1,340 @@
+# app/withdrawals.py
+"""
+Обработка выводов пачками.
+
+Воркер (run_withdrawals, можно несколько в процессе и на инстансах):
+
+  1. claim_batch — одна транзакция: до WITHDRAW_BATCH_SIZE заявок pending
+     через FOR UPDATE SKIP LOCKED, блокировка балансов их пользователей,
+     списание через журнал (kind=withdrawal, ref_id=id заявки), запись
+     withdrawal_batches (status=new) и перевод заявок в processing. Заявки,
+     на которые не хватило баланса, — rejected в той же транзакции.
+  2. submit_batch — один multi-message перевод с highload-кошелька на всю
+     пачку; query_id = id пачки, поэтому повторная отправка той же пачки
+     (ретрай, падение между claim и send) не задублирует выплату.
+     Пачка -> submitted.
+  3. confirm_batches — один запрос статуса на все submitted пачки;
+     confirmed -> заявки done, failed -> заявки failed и возврат средств
+     через журнал (kind=refund) в одной короткой транзакции.
+
+HTTP-запросы к сервису кошелька никогда не выполняются внутри транзакции с
+блокировками: забрали строки и закоммитили -> запрос -> короткая транзакция
+с результатом.
+
+Подписи кошелька в этом процессе нет: перевод отправляет внешний
+сервис highload-кошелька (WITHDRAW_API_URL) по простому HTTP API:
+
+  POST /send    {"query_id": 17, "messages": [{"address", "amount" (нанотоны, строка), "comment"}]}
+                -> {"hash": "..."}
+  POST /status  {"query_ids": [17, 18]} -> {"statuses": {"17": "pending|confirmed|failed"}}
+
+Локальный стенд с тем же API — bench.fake_wallet.
+"""
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Tuple
+
+import httpx
+from sqlalchemy import func, insert, select, update
+
+try:
+    import structlog
+    log = structlog.get_logger()
+except Exception:
+    import logging
+    log = logging.getLogger("withdrawals")
+
+from . import audit, db as _db
+from .metrics import Counter, Histogram
+from .models import Balance, Withdrawal, WithdrawalBatch
+from .services import apply_ledger
+
+# highload wallet v3: не больше 254 исходящих сообщений в одном переводе
+MAX_MESSAGES = 254
+
+WITHDRAWALS = Counter("withdrawals_total", "Withdrawals by final status", ("status",))
+BATCHES = Counter("withdrawal_batches_total", "Withdrawal batches by status transition", ("status",))
+SEND_LATENCY = Histogram("withdrawal_send_duration_seconds", "Time to submit one multi-message transfer")
+
+Message = Dict[str, Any]
+
+
+class WithdrawalSender(Protocol):
+    async def send(self, query_id: int, messages: Sequence[Message]) -> str: ...
+
+    async def status(self, query_ids: Sequence[int]) -> Dict[int, str]: ...
+
+
+class HttpWithdrawalSender:
+    """Клиент сервиса highload-кошелька (см. docstring модуля)."""
+
+    def __init__(self, base_url: str, api_key: Optional[str] = None, timeout: float = 20.0, transport: Optional[httpx.AsyncBaseTransport] = None):
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._http = httpx.AsyncClient(base_url=base_url.rstrip("/"), timeout=timeout, headers=headers, transport=transport)
+
+    async def send(self, query_id: int, messages: Sequence[Message]) -> str:
+        r = await self._http.post("/send", json={"query_id": query_id, "messages": list(messages)})
+        r.raise_for_status()
+        return r.json()["hash"]
+
+    async def status(self, query_ids: Sequence[int]) -> Dict[int, str]:
+        r = await self._http.post("/status", json={"query_ids": list(query_ids)})
+        r.raise_for_status()
+        return {int(k): v for k, v in r.json()["statuses"].items()}
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+
+def _message(address: str, amount: int, comment: Optional[str]) -> Message:
+    return {"address": address, "amount": str(amount), "comment": comment or ""}
+
+
+async def claim_batch(limit: int) -> Optional[Tuple[int, List[Message]]]:
+    """
+    Забирает пачку заявок и списывает балансы одной транзакцией.
+    Возвращает (batch_id, сообщения) или None, если отправлять нечего.
+    """
+    limit = max(1, min(limit, MAX_MESSAGES))
+    async with _db.AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(Withdrawal.id, Withdrawal.user_id, Withdrawal.amount, Withdrawal.address, Withdrawal.comment)
+            .where(Withdrawal.status == "pending")
+            .order_by(Withdrawal.created_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )).all()
+        if not rows:
+            return None
+
+        # балансы блокируем в порядке user_id — воркеры не дедлочат друг друга
+        balances = dict((await db.execute(
+            select(Balance.user_id, Balance.amount)
+            .where(Balance.user_id.in_({r.user_id for r in rows}))
+            .order_by(Balance.user_id)
+            .with_for_update()
+        )).all())
+        accepted, rejected = [], []
+        for r in rows:
+            left = balances.get(r.user_id) or 0
+            if r.amount > 0 and left >= r.amount:
+                balances[r.user_id] = left - r.amount
+                accepted.append(r)
+            else:
+                rejected.append(r.id)
+
+        if rejected:
+            await db.execute(
+                update(Withdrawal).where(Withdrawal.id.in_(rejected)).values(status="rejected", processed_at=func.now())
+            )
+            WITHDRAWALS.labels("rejected").inc(len(rejected))
+        if not accepted:
+            await db.commit()
+            return None
+
+        batch_id = (await db.execute(
+            insert(WithdrawalBatch)
+            .values(status="new", count=len(accepted), total=sum(r.amount for r in accepted))
+            .returning(WithdrawalBatch.id)
+        )).scalar_one()
+        await db.execute(
+            update(Withdrawal)
+            .where(Withdrawal.id.in_([r.id for r in accepted]))
+            .values(status="processing", batch_id=batch_id)
+        )
+        await apply_ledger(db, [
+            {"user_id": r.user_id, "amount": -r.amount, "kind": "withdrawal", "ref_id": r.id}
+            for r in accepted
+        ])
+        await db.commit()
+    BATCHES.labels("new").inc()
+    return batch_id, [_message(r.address, r.amount, r.comment) for r in accepted]
+
+
+async def submit_batch(sender: WithdrawalSender, batch_id: int, messages: Sequence[Message]) -> bool:
+    """Отправляет пачку; при ошибке она остаётся new и будет переотправлена с тем же query_id."""
+    try:
+        with SEND_LATENCY.time():
+            msg_hash = await sender.send(batch_id, messages)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        async with _db.AsyncSessionLocal() as db:
+            await db.execute(
+                update(WithdrawalBatch).where(WithdrawalBatch.id == batch_id)
+                .values(attempts=WithdrawalBatch.attempts + 1, error=str(e)[:256])
+            )
+            await db.commit()
+        try:
+            log.error("withdrawal_send_error", batch_id=batch_id, error=str(e))
+        except Exception:
+            pass
+        return False
+    async with _db.AsyncSessionLocal() as db:
+        await db.execute(
+            update(WithdrawalBatch)
+            .where(WithdrawalBatch.id == batch_id, WithdrawalBatch.status == "new")
+            .values(status="submitted", msg_hash=msg_hash, submitted_at=func.now(), attempts=WithdrawalBatch.attempts + 1, error=None)
+        )
+        await db.commit()
+    BATCHES.labels("submitted").inc()
+    audit.audit("withdrawal_batch_submitted", None, batch_id=batch_id, count=len(messages), hash=msg_hash)
+    return True
+
+
+async def resubmit_stale(sender: WithdrawalSender, older_than: float, limit: int = 10) -> int:
+    """
+    Переотправляет пачки, застрявшие в new дольше older_than секунд (упал
+    воркер или сервис кошелька). Короткой транзакцией забираем пачки (SKIP
+    LOCKED) и отмечаем попытку в submitted_at — это аренда: другой воркер
+    возьмёт их снова только через older_than. Отправка — вне транзакции,
+    результат пишется второй короткой транзакцией.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=older_than)
+    async with _db.AsyncSessionLocal() as db:
+        stale = (await db.execute(
+            select(WithdrawalBatch.id)
+            .where(
+                WithdrawalBatch.status == "new",
+                func.coalesce(WithdrawalBatch.submitted_at, WithdrawalBatch.created_at) < cutoff,
+            )
+            .order_by(WithdrawalBatch.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )).scalars().all()
+        if not stale:
+            return 0
+        # у пачки в статусе new submitted_at — время последней попытки отправки
+        await db.execute(
+            update(WithdrawalBatch).where(WithdrawalBatch.id.in_(stale)).values(submitted_at=func.now())
+        )
+        rows = (await db.execute(
+            select(Withdrawal.batch_id, Withdrawal.address, Withdrawal.amount, Withdrawal.comment)
+            .where(Withdrawal.batch_id.in_(stale))
+            .order_by(Withdrawal.id)
+        )).all()
+        await db.commit()
+
+    messages: Dict[int, List[Message]] = {}
+    for r in rows:
+        messages.setdefault(r.batch_id, []).append(_message(r.address, r.amount, r.comment))
+    sent = 0
+    for batch_id in stale:
+        if await submit_batch(sender, batch_id, messages.get(batch_id, [])):
+            sent += 1
+    return sent
+
+
+async def confirm_batches(sender: WithdrawalSender, limit: int = 100) -> Tuple[int, int]:
+    """
+    Один запрос статуса на submitted пачки; возвращает (подтверждённых,
+    неудачных) пачек. Запрос к сервису кошелька — вне транзакции; переходы
+    пишутся условным UPDATE ... WHERE status = 'submitted', поэтому пачку,
+    которую параллельно закрыл другой воркер, второй раз не проведём.
+    """
+    async with _db.AsyncSessionLocal() as db:
+        ids = (await db.execute(
+            select(WithdrawalBatch.id)
+            .where(WithdrawalBatch.status == "submitted")
+            .order_by(WithdrawalBatch.id)
+            .limit(limit)
+        )).scalars().all()
+    if not ids:
+        return 0, 0
+    statuses = await sender.status(ids)
+    confirmed = [i for i in ids if statuses.get(i) == "confirmed"]
+    failed = [i for i in ids if statuses.get(i) == "failed"]
+    if not confirmed and not failed:
+        return 0, 0
+
+    async with _db.AsyncSessionLocal() as db:
+        if confirmed:
+            confirmed = (await db.execute(
+                update(WithdrawalBatch)
+                .where(WithdrawalBatch.id.in_(confirmed), WithdrawalBatch.status == "submitted")
+                .values(status="confirmed", confirmed_at=func.now())
+                .returning(WithdrawalBatch.id)
+            )).scalars().all()
+        if confirmed:
+            done = await db.execute(
+                update(Withdrawal).where(Withdrawal.batch_id.in_(confirmed))
+                .values(status="done", processed_at=func.now())
+            )
+            WITHDRAWALS.labels("done").inc(done.rowcount or 0)
+        if failed:
+            failed = (await db.execute(
+                update(WithdrawalBatch)
+                .where(WithdrawalBatch.id.in_(failed), WithdrawalBatch.status == "submitted")
+                .values(status="failed")
+                .returning(WithdrawalBatch.id)
+            )).scalars().all()
+        if failed:
+            refunds = (await db.execute(
+                update(Withdrawal).where(Withdrawal.batch_id.in_(failed))
+                .values(status="failed", processed_at=func.now())
+                .returning(Withdrawal.id, Withdrawal.user_id, Withdrawal.amount)
+            )).all()
+            # перевод не прошёл — возвращаем списанное (идемпотентно по (kind, ref_id))
+            await apply_ledger(db, [
+                {"user_id": user_id, "amount": amount, "kind": "refund", "ref_id": wid}
+                for wid, user_id, amount in refunds
+            ])
+            WITHDRAWALS.labels("failed").inc(len(refunds))
+        await db.commit()
+
+    if confirmed:
+        BATCHES.labels("confirmed").inc(len(confirmed))
+    if failed:
+        BATCHES.labels("failed").inc(len(failed))
+        for batch_id in failed:
+            audit.audit("withdrawal_batch_failed", None, batch_id=batch_id)
+        try:
+            log.error("withdrawal_batches_failed", batches=failed)
+        except Exception:
+            pass
+    return len(confirmed), len(failed)
+
+
+async def process_once(sender: WithdrawalSender, batch_size: int = MAX_MESSAGES, resend_after: float = 30.0) -> int:
+    """Один проход воркера: claim + send, переотправка застрявших, подтверждения. Возвращает число заявок в новой пачке."""
+    claimed = await claim_batch(batch_size)
+    n = 0
+    if claimed is not None:
+        batch_id, messages = claimed
+        n = len(messages)
+        await submit_batch(sender, batch_id, messages)
+    await resubmit_stale(sender, resend_after)
+    await confirm_batches(sender)
+    return n
+
+
+async def _worker(sender: WithdrawalSender, settings) -> None:
+    batch_size = min(settings.withdraw_batch_size, MAX_MESSAGES)
+    while True:
+        try:
+            n = await process_once(sender, batch_size, settings.withdraw_resend_after)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            n = 0
+            try:
+                log.error("withdrawal_worker_error", error=str(e))
+            except Exception:
+                pass
+        # полная пачка — в очереди есть ещё, берём сразу
+        if n < batch_size:
+            await asyncio.sleep(settings.withdraw_interval)
+
+
+async def run_withdrawals(settings, sender: Optional[WithdrawalSender] = None) -> None:
+    """WITHDRAW_WORKERS воркеров на общем отправителе; SKIP LOCKED разводит их по разным заявкам."""
+    own = sender is None
+    if own:
+        sender = HttpWithdrawalSender(settings.withdraw_api_url, settings.withdraw_api_key or None)
+    try:
+        await asyncio.gather(*(_worker(sender, settings) for _ in range(max(1, settings.withdraw_workers))))
+    finally:
+        if own:
+            await sender.aclose()
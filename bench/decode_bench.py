@@ -0,0 +1,108 @@
+# bench/decode_bench.py
+"""
+Микробенчмарк разбора апдейта: декодирование + диспетчеризация на один апдейт.
+
+    python -m bench.decode_bench --rounds 20000
+
+old — как было: json.loads + Update.de_json для каждого апдейта;
+new — fastjson.loads по сырым байтам + префильтр по типам, которые
+      реально обрабатывают хендлеры (handled_update_types), de_json только
+      для нужных.
+В обоих режимах после de_json выполняется поиск подходящего хендлера
+(check_update по всем группам) — то, что делает process_update до вызова
+колбэка. Корпус — типичная смесь апдейтов бота в группах и личке.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from typing import List
+
+for k, v in {
+    "BOT_TOKEN": "123456:bench",
+    "BASE_URL": "https://bench.local",
+    "TELEGRAM_WEBHOOK_SECRET": "bench",
+    "DATABASE_URL": "postgresql://bench@localhost/bench",
+    "TON_API_BASE": "http://127.0.0.1:9/api/v2",
+    "TON_API_KEY": "bench",
+    "TON_ADDRESS": "EQbench",
+}.items():
+    os.environ.setdefault(k, v)
+
+from telegram import Update, User  # noqa: E402
+
+from app import fastjson  # noqa: E402
+from app import web  # noqa: E402
+
+tg_app = web.get_tg_app()
+_wanted_updates = web._wanted_updates
+
+_USER = {"id": 100500, "is_bot": False, "first_name": "Ivan", "username": "ivan", "language_code": "ru"}
+_CHAT = {"id": 100500, "type": "private", "first_name": "Ivan", "username": "ivan"}
+_GROUP = {"id": -1001234567890, "type": "supergroup", "title": "Chat"}
+
+
+def corpus() -> List[bytes]:
+    now = int(time.time())
+    msg = {"message_id": 1, "date": now, "chat": _CHAT, "from": _USER}
+    updates = [
+        {"update_id": 1, "message": dict(msg, text="/start", entities=[{"type": "bot_command", "offset": 0, "length": 6}])},
+        {"update_id": 2, "message": dict(msg, text="привет, как оплатить?")},
+        {"update_id": 3, "edited_message": dict(msg, text="исправил", edit_date=now)},
+        {"update_id": 4, "callback_query": {"id": "42", "from": _USER, "chat_instance": "1", "data": "pay", "message": dict(msg, text="Оплатить")}},
+        {"update_id": 5, "my_chat_member": {"chat": _CHAT, "from": _USER, "date": now,
+                                           "old_chat_member": {"status": "member", "user": _USER},
+                                           "new_chat_member": {"status": "kicked", "user": _USER, "until_date": 0}}},
+        {"update_id": 6, "chat_member": {"chat": _GROUP, "from": _USER, "date": now,
+                                        "old_chat_member": {"status": "left", "user": _USER},
+                                        "new_chat_member": {"status": "member", "user": _USER}}},
+        {"update_id": 7, "channel_post": {"message_id": 9, "date": now, "chat": {"id": -100777, "type": "channel", "title": "News"}, "text": "пост"}},
+        {"update_id": 8, "message": dict(msg, chat=_GROUP, text="сообщение в группе", reply_to_message=dict(msg, text="ранее"))},
+    ]
+    return [json.dumps(u, ensure_ascii=False).encode() for u in updates]
+
+
+# без сети: CommandHandler спрашивает username бота, который обычно приходит из getMe
+tg_app.bot._bot_user = User(id=1, is_bot=True, first_name="bench", username="bench_bot")
+
+
+def _dispatch(update: Update) -> None:
+    # как process_update: в каждой группе — первый подходящий хендлер
+    for group in tg_app.handlers.values():
+        for handler in group:
+            if handler.check_update(update) not in (None, False):
+                break
+
+
+def run_old(raw: bytes) -> None:
+    _dispatch(Update.de_json(json.loads(raw), tg_app.bot))
+
+
+def run_new(raw: bytes) -> None:
+    data = fastjson.loads(raw)
+    if _wanted_updates is not None and _wanted_updates.isdisjoint(data):
+        return
+    _dispatch(Update.de_json(data, tg_app.bot))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    items = corpus()
+    print(f"json backend: {fastjson.BACKEND}; handled types: {sorted(_wanted_updates or [])}")
+    for name, fn in (("old", run_old), ("new", run_new)):
+        for raw in items:  # прогрев
+            fn(raw)
+        t0 = time.perf_counter()
+        for i in range(args.rounds):
+            fn(items[i % len(items)])
+        per = (time.perf_counter() - t0) / args.rounds * 1e6
+        print(f"{name}: {per:.1f} µs/update ({1e6 / per:.0f} updates/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+# bench/fake_toncenter.py
+"""
+Локальный фейковый Toncenter v2: getTransactions (с той же пагинацией
+lt/hash/to_lt, что у настоящего API), getMasterchainInfo, задержка и
+инъекция ошибок (500 / 429 с Retry-After).
+
+Транзакции берутся из синтетического генератора (FakeChain.deposit /
+generate) или из фикстуры, записанной bench.record_toncenter.
+
+В процессе (бенчмарки) — через ASGI-транспорт, без сети:
+
+    chain = FakeChain()
+    toncenter.init_client(settings, transport=FakeToncenter(chain).transport())
+
+Отдельным сервером (TON_API_BASE=http://127.0.0.1:8081/api/v2):
+
+    python -m bench.fake_toncenter --port 8081 --address EQ... --generate 1000 \\
+        --tags P4V-AAAAAA,P4V-BBBBBB --latency-ms 80 --error-rate 0.02
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import bisect
+import hashlib
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+NANO = 10 ** 9
+
+
+class FakeChain:
+    """
+    Транзакции по адресам (по возрастанию lt) + счётчик мастерчейна.
+    block_time > 0 — seqno растёт со временем; 0 — на 1 с каждым запросом
+    getMasterchainInfo (детерминированно для бенчмарков).
+    """
+
+    def __init__(self, block_time: float = 0.0, start_seqno: int = 1_000_000):
+        self.block_time = block_time
+        self._seqno = start_seqno
+        self._t0 = time.monotonic()
+        self._txs: Dict[str, List[Dict[str, Any]]] = {}
+        self._lts: Dict[str, List[int]] = {}
+        self._next_lt = 1_000_000
+
+    # --- generator ---------------------------------------------------------------
+    def deposit(self, address: str, comment: str, nanotons: int, source: str = "EQfake-sender") -> Dict[str, Any]:
+        """Добавляет входящий перевод с текстовым комментарием; возвращает транзакцию."""
+        self._next_lt += random.randint(1, 8) * 1000
+        lt = self._next_lt
+        tx_hash = base64.b64encode(hashlib.sha256(f"{address}:{lt}".encode()).digest()).decode()
+        body = base64.b64encode(comment.encode()).decode()
+        tx = {
+            "@type": "raw.transaction",
+            "utime": int(time.time()),
+            "data": "",
+            "transaction_id": {"@type": "internal.transactionId", "lt": str(lt), "hash": tx_hash},
+            "fee": "100000",
+            "storage_fee": "0",
+            "other_fee": "100000",
+            "in_msg": {
+                "@type": "raw.message",
+                "source": source,
+                "destination": address,
+                "value": str(nanotons),
+                "fwd_fee": "0",
+                "ihr_fee": "0",
+                "created_lt": str(lt - 1),
+                "body_hash": hashlib.sha256(body.encode()).hexdigest(),
+                "msg_data": {"@type": "msg.dataText", "text": body},
+                "message": comment,
+            },
+            "out_msgs": [],
+        }
+        self._append(address, tx)
+        return tx
+
+    def generate(
+        self,
+        address: str,
+        n: int,
+        tags: Sequence[str],
+        noise: float = 0.1,
+        min_ton: float = 0.1,
+        max_ton: float = 50.0,
+    ) -> List[Dict[str, Any]]:
+        """
+        n синтетических транзакций: депозиты на случайные теги из tags и доля
+        noise «шума» (переводы без тега / с чужим комментарием).
+        """
+        out = []
+        for i in range(n):
+            if not tags or random.random() < noise:
+                comment = random.choice(["", "thanks", f"order-{i}"])
+            else:
+                comment = random.choice(tags)
+            out.append(self.deposit(address, comment, int(random.uniform(min_ton, max_ton) * NANO)))
+        return out
+
+    def load_fixture(self, path: str) -> int:
+        """Подгружает транзакции, записанные bench.record_toncenter; возвращает их число."""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        txs = sorted(data["transactions"], key=lambda t: int(t["transaction_id"]["lt"]))
+        for tx in txs:
+            self._append(data["address"], tx)
+            self._next_lt = max(self._next_lt, int(tx["transaction_id"]["lt"]))
+        if data.get("masterchain_seqno"):
+            self._seqno = max(self._seqno, int(data["masterchain_seqno"]))
+        return len(txs)
+
+    def _append(self, address: str, tx: Dict[str, Any]) -> None:
+        self._txs.setdefault(address, []).append(tx)
+        self._lts.setdefault(address, []).append(int(tx["transaction_id"]["lt"]))
+
+    # --- API semantics ----------------------------------------------------------
+    def get_transactions(
+        self,
+        address: str,
+        limit: int = 10,
+        lt: Optional[int] = None,
+        tx_hash: Optional[str] = None,
+        to_lt: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """От новых к старым: начиная с (lt, hash) включительно, строго новее to_lt."""
+        txs = self._txs.get(address, [])
+        lts = self._lts.get(address, [])
+        end = len(txs) if lt is None else bisect.bisect_right(lts, lt)
+        out: List[Dict[str, Any]] = []
+        for i in range(end - 1, -1, -1):
+            if to_lt is not None and lts[i] <= to_lt:
+                break
+            out.append(txs[i])
+            if len(out) >= limit:
+                break
+        return out
+
+    def masterchain_seqno(self) -> int:
+        if self.block_time > 0:
+            return self._seqno + int((time.monotonic() - self._t0) / self.block_time)
+        self._seqno += 1
+        return self._seqno
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._txs.values())
+
+
+class FakeToncenter:
+    """ASGI-приложение с методами v2 поверх FakeChain."""
+
+    def __init__(
+        self,
+        chain: FakeChain,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        max_limit: int = 256,
+    ):
+        self.chain = chain
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_limit = max_limit
+        self.calls: Dict[str, int] = {}
+        self.app = Starlette(routes=[
+            Route("/api/v2/getTransactions", self._get_transactions),
+            Route("/api/v2/getMasterchainInfo", self._get_masterchain_info),
+        ])
+
+    def transport(self) -> httpx.AsyncBaseTransport:
+        return httpx.ASGITransport(app=self.app)
+
+    async def _before(self, method: str) -> Optional[JSONResponse]:
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if self.error_rate and random.random() < self.error_rate:
+            if random.random() < 0.5:
+                return JSONResponse({"ok": False, "error": "Ratelimit exceed", "code": 429}, status_code=429, headers={"Retry-After": "0"})
+            return JSONResponse({"ok": False, "error": "Internal error", "code": 500}, status_code=500)
+        return None
+
+    async def _get_transactions(self, request: Request) -> JSONResponse:
+        err = await self._before("getTransactions")
+        if err is not None:
+            return err
+        q = request.query_params
+        limit = min(int(q.get("limit", 10)), self.max_limit)
+        lt = int(q["lt"]) if q.get("lt") else None
+        to_lt = int(q["to_lt"]) if q.get("to_lt") else None
+        if to_lt == 0:
+            to_lt = None
+        result = self.chain.get_transactions(q["address"], limit=limit, lt=lt, tx_hash=q.get("hash"), to_lt=to_lt)
+        return JSONResponse({"ok": True, "result": result})
+
+    async def _get_masterchain_info(self, request: Request) -> JSONResponse:
+        err = await self._before("getMasterchainInfo")
+        if err is not None:
+            return err
+        seqno = self.chain.masterchain_seqno()
+        return JSONResponse({"ok": True, "result": {"@type": "blocks.masterchainInfo", "last": {"workchain": -1, "seqno": seqno}}})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--address", default="EQfake-wallet")
+    parser.add_argument("--generate", type=int, default=0, help="сколько синтетических транзакций создать")
+    parser.add_argument("--tags", default="", help="теги депозитов через запятую")
+    parser.add_argument("--fixture", default="", help="JSON от bench.record_toncenter")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--block-time", type=float, default=5.0, help="секунд на блок мастерчейна")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    chain = FakeChain(block_time=args.block_time)
+    if args.fixture:
+        print(f"fixture: {chain.load_fixture(args.fixture)} transactions")
+    if args.generate:
+        tags = [t.strip() for t in args.tags.split(",") if t.strip()]
+        chain.generate(args.address, args.generate, tags)
+    fake = FakeToncenter(chain, args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate)
+    print(f"{len(chain)} transactions; TON_API_BASE=http://{args.host}:{args.port}/api/v2")
+    uvicorn.run(fake.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
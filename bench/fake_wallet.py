@@ -0,0 +1,103 @@
+# bench/fake_wallet.py
+"""
+Локальный стенд сервиса highload-кошелька с API из app.withdrawals:
+POST /send (multi-message перевод по query_id) и POST /status.
+
+Перевод «подтверждается» через --confirm-after секунд; доля --fail-rate
+переводов завершается failed (истёк, не попал в блок). Повторный /send с
+тем же query_id ничего не отправляет и возвращает тот же hash — как
+настоящий highload-кошелёк.
+
+    wallet = FakeWallet(confirm_after=0.5)
+    sender = HttpWithdrawalSender("http://fake-wallet", transport=wallet.transport())
+
+Отдельным сервером (WITHDRAW_API_URL=http://127.0.0.1:8082):
+
+    python -m bench.fake_wallet --port 8082 --confirm-after 5 --latency-ms 50
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from typing import Any, Dict, Tuple
+
+import httpx
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+class FakeWallet:
+    def __init__(self, confirm_after: float = 0.0, fail_rate: float = 0.0, latency: float = 0.0, error_rate: float = 0.0):
+        self.confirm_after = confirm_after
+        self.fail_rate = fail_rate
+        self.latency = latency
+        self.error_rate = error_rate
+        # query_id -> (hash, отправлен, исход, сообщений)
+        self.transfers: Dict[int, Tuple[str, float, str, int]] = {}
+        self.calls: Dict[str, int] = {}
+        self.messages = 0
+        self.app = Starlette(routes=[
+            Route("/send", self._send, methods=["POST"]),
+            Route("/status", self._status, methods=["POST"]),
+        ])
+
+    def transport(self) -> httpx.AsyncBaseTransport:
+        return httpx.ASGITransport(app=self.app)
+
+    async def _before(self, method: str) -> bool:
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return bool(self.error_rate) and random.random() < self.error_rate
+
+    async def _send(self, request: Request) -> JSONResponse:
+        if await self._before("send"):
+            return JSONResponse({"error": "unavailable"}, status_code=503)
+        body: Dict[str, Any] = await request.json()
+        query_id = int(body["query_id"])
+        if query_id not in self.transfers:
+            outcome = "failed" if self.fail_rate and random.random() < self.fail_rate else "confirmed"
+            msg_hash = hashlib.sha256(f"{query_id}:{time.time()}".encode()).hexdigest()
+            self.transfers[query_id] = (msg_hash, time.monotonic(), outcome, len(body["messages"]))
+            self.messages += len(body["messages"])
+        return JSONResponse({"hash": self.transfers[query_id][0]})
+
+    async def _status(self, request: Request) -> JSONResponse:
+        if await self._before("status"):
+            return JSONResponse({"error": "unavailable"}, status_code=503)
+        body: Dict[str, Any] = await request.json()
+        now = time.monotonic()
+        out = {}
+        for query_id in body["query_ids"]:
+            t = self.transfers.get(int(query_id))
+            if t is None:
+                out[str(query_id)] = "failed"
+            else:
+                out[str(query_id)] = t[2] if now - t[1] >= self.confirm_after else "pending"
+        return JSONResponse({"statuses": out})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--confirm-after", type=float, default=5.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    wallet = FakeWallet(args.confirm_after, args.fail_rate, args.latency_ms / 1000, args.error_rate)
+    print(f"WITHDRAW_API_URL=http://{args.host}:{args.port}")
+    uvicorn.run(wallet.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# bench/money_bench.py
+"""
+Numeric(18, 8) против BigInteger-нанотонов.
+
+    python -m bench.money_bench --rows 1000000 --users 10000
+    DATABASE_URL=postgresql://... python -m bench.money_bench --rows 1000000 --credits 100000
+
+Без DATABASE_URL — только арифметика в Python: разбор сумм из цепочки и
+суммирование (Decimal / NANO против int). С DATABASE_URL — ещё и в базе, на
+временных таблицах-копиях журнала и балансов с обоими типами amount:
+
+  aggregate — SUM по всему журналу и GROUP BY user_id (медиана --repeat прогонов);
+  credit    — начисления пачками тем же запросом, что services.apply_ledger
+              (INSERT в журнал + upsert балансов одним statement), начислений/сек.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from decimal import Decimal
+from typing import Callable, List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.money import NANO
+
+_DNANO = Decimal(10) ** 9
+
+_TYPES = {"numeric": "numeric(18, 8)", "nano": "bigint"}
+
+
+def _best(fn: Callable[[], object], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def python_bench(rows: int, repeat: int) -> None:
+    raw = [str(random.randint(1, 50 * NANO)) for _ in range(rows)]
+    dec = [Decimal(v) / _DNANO for v in raw]
+    ints = [int(v) for v in raw]
+    results = {
+        "parse numeric": _best(lambda: [Decimal(v) / _DNANO for v in raw], repeat),
+        "parse nano": _best(lambda: [int(v) for v in raw], repeat),
+        "sum numeric": _best(lambda: sum(dec, Decimal(0)), repeat),
+        "sum nano": _best(lambda: sum(ints), repeat),
+    }
+    for name, t in results.items():
+        print(f"python {name:14s} rows={rows} {t * 1000:8.1f}ms  {rows / t / 1e6:6.1f}M/s")
+
+
+async def _setup(conn, kind: str, rows: int, users: int) -> None:
+    t = _TYPES[kind]
+    await conn.execute(text(f"DROP TABLE IF EXISTS bench_ledger_{kind}, bench_balances_{kind}"))
+    await conn.execute(text(
+        f"CREATE TABLE bench_ledger_{kind} (id bigserial PRIMARY KEY, user_id int NOT NULL, "
+        f"amount {t} NOT NULL, kind varchar(16) NOT NULL, ref_id bigint, UNIQUE (kind, ref_id))"
+    ))
+    await conn.execute(text(f"CREATE TABLE bench_balances_{kind} (user_id int PRIMARY KEY, amount {t} NOT NULL DEFAULT 0)"))
+    # одинаковые суммы в обеих таблицах: целые нанотоны, у numeric — /1e9 (8 знаков)
+    value = "(g % 50000000000 + 1)" if kind == "nano" else "round((g % 50000000000 + 1) / 1e9, 8)"
+    await conn.execute(text(
+        f"INSERT INTO bench_ledger_{kind} (user_id, amount, kind, ref_id) "
+        f"SELECT g % :users + 1, {value}, 'seed', g FROM generate_series(1, :rows) g"
+    ), {"users": users, "rows": rows})
+    await conn.execute(text(
+        f"INSERT INTO bench_balances_{kind} SELECT user_id, sum(amount) FROM bench_ledger_{kind} GROUP BY user_id"
+    ))
+    await conn.execute(text(f"ANALYZE bench_ledger_{kind}"))
+    await conn.execute(text(f"ANALYZE bench_balances_{kind}"))
+
+
+async def _timed(conn, sql: str, repeat: int) -> float:
+    times: List[float] = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        await conn.execute(text(sql))
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def _credit_sql(kind: str) -> str:
+    # тот же запрос, что строит services.apply_ledger
+    return (
+        f"WITH ins AS (INSERT INTO bench_ledger_{kind} (user_id, amount, kind, ref_id) "
+        f"SELECT * FROM unnest(CAST(:users AS int[]), CAST(:amounts AS {_TYPES[kind]}[]), "
+        f"CAST(:kinds AS varchar[]), CAST(:refs AS bigint[])) "
+        f"ON CONFLICT (kind, ref_id) DO NOTHING RETURNING user_id, amount) "
+        f"INSERT INTO bench_balances_{kind} (user_id, amount) "
+        f"SELECT user_id, sum(amount) FROM ins GROUP BY user_id "
+        f"ON CONFLICT (user_id) DO UPDATE SET amount = bench_balances_{kind}.amount + excluded.amount"
+    )
+
+
+async def db_bench(url: str, rows: int, users: int, credits: int, batch: int, repeat: int) -> None:
+    from app.db import _normalize_db_url
+
+    engine = create_async_engine(_normalize_db_url(url))
+    try:
+        for kind in ("numeric", "nano"):
+            async with engine.begin() as conn:
+                await _setup(conn, kind, rows, users)
+            async with engine.connect() as conn:
+                total = await _timed(conn, f"SELECT sum(amount) FROM bench_ledger_{kind}", repeat)
+                grouped = await _timed(conn, f"SELECT user_id, sum(amount) FROM bench_ledger_{kind} GROUP BY user_id", repeat)
+                size = (await conn.execute(text(f"SELECT pg_total_relation_size('bench_ledger_{kind}')"))).scalar_one()
+            print(
+                f"db {kind:8s} rows={rows} sum={total * 1000:.1f}ms group_by={grouped * 1000:.1f}ms "
+                f"ledger_size={size / 2**20:.1f}MiB"
+            )
+
+            ref = rows + 1
+            t0 = time.perf_counter()
+            done = 0
+            while done < credits:
+                n = min(batch, credits - done)
+                nano = [random.randint(1, 50 * NANO) for _ in range(n)]
+                amounts = nano if kind == "nano" else [Decimal(v) / _DNANO for v in nano]
+                async with engine.begin() as conn:
+                    await conn.execute(text(_credit_sql(kind)), {
+                        "users": [random.randint(1, users) for _ in range(n)],
+                        "amounts": amounts,
+                        "kinds": ["payment"] * n,
+                        "refs": list(range(ref, ref + n)),
+                    })
+                ref += n
+                done += n
+            elapsed = time.perf_counter() - t0
+            print(f"db {kind:8s} credits={credits} batch={batch} {elapsed:.2f}s credits/s={credits / elapsed:.0f}")
+    finally:
+        async with engine.begin() as conn:
+            for kind in _TYPES:
+                await conn.execute(text(f"DROP TABLE IF EXISTS bench_ledger_{kind}, bench_balances_{kind}"))
+        await engine.dispose()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000, help="строк журнала")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--credits", type=int, default=100_000, help="начислений в тесте credit")
+    parser.add_argument("--batch", type=int, default=500, help="начислений в одном statement")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    python_bench(min(args.rows, 1_000_000), args.repeat)
+    url = os.getenv("DATABASE_URL")
+    if url:
+        await db_bench(url, args.rows, args.users, args.credits, args.batch, args.repeat)
+    else:
+        print("DATABASE_URL не задан — пропускаю замеры в базе")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
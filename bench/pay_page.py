@@ -0,0 +1,139 @@
+# bench/pay_page.py
+"""
+Запросы/сек на /pay, /tonconnect-manifest.json и /icon.png.
+
+    python -m bench.pay_page --requests 5000 --concurrency 50
+
+old — как было: HTML страницы собирается на каждый запрос, manifest —
+      dict -> JSONResponse, иконка — base64-декодирование, без кэш-заголовков;
+new — маршруты app.web: готовые байты из app.assets (br/gzip по
+      Accept-Encoding, ETag, Cache-Control);
+new-304 — тот же клиент повторно, с If-None-Match (как браузер/кошелёк
+      после первой загрузки).
+Запросы подаются прямо в ASGI-приложение, без сети и HTTP-клиента, так что
+меряется именно стоимость обработчика и фреймворка; размер — байты тела
+на проводе (после сжатия).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import os
+import time
+from typing import Dict, Optional
+
+for k, v in {
+    "BOT_TOKEN": "123456:bench",
+    "BASE_URL": "https://bench.local",
+    "TELEGRAM_WEBHOOK_SECRET": "bench",
+    "DATABASE_URL": "postgresql://bench@localhost/bench",
+    "TON_API_BASE": "http://127.0.0.1:9/api/v2",
+    "TON_API_KEY": "bench",
+    "TON_ADDRESS": "EQbench",
+}.items():
+    os.environ.setdefault(k, v)
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.responses import HTMLResponse, JSONResponse, Response  # noqa: E402
+
+from app import assets, web  # noqa: E402
+
+PATHS = {
+    "pay": "/pay?amount=2.5&memo=P4V-ABC123",
+    "manifest": "/tonconnect-manifest.json",
+    "icon": "/icon.png",
+}
+
+
+def legacy_app() -> FastAPI:
+    """Старые обработчики: рендер на каждый запрос."""
+    old = FastAPI()
+    settings = web.settings
+
+    @old.get("/icon.png")
+    def icon():
+        return Response(content=base64.b64decode(assets.ICON_B64), media_type="image/png")
+
+    @old.get("/tonconnect-manifest.json", response_class=JSONResponse)
+    def manifest():
+        base = str(settings.base_url).rstrip("/")
+        return {"url": base, "name": "Bot Payments", "iconUrl": f"{base}/icon.png"}
+
+    @old.get("/pay", response_class=HTMLResponse)
+    def pay(amount: float, memo: str = "", to: Optional[str] = None):
+        base = str(settings.base_url).rstrip("/")
+        # та же по объёму подстановка в шаблон, что делал f-string
+        html = (
+            assets.PAY_PAGE
+            .replace("__MANIFEST_URL__", f"{base}/tonconnect-manifest.json")
+            .replace("__DEFAULT_TO__", to or settings.ton_address)
+            .replace('id="amt"></b>', f'id="amt">{amount}</b>')
+            .replace('id="memo"></span>', f'id="memo">{memo or "—"}</span>')
+        )
+        return HTMLResponse(html)
+
+    return old
+
+
+async def _call(app, path: str, headers: Dict[str, str]):
+    """Один запрос прямо в ASGI-приложение; (status, headers, длина тела на проводе)."""
+    raw_path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": raw_path, "raw_path": raw_path.encode(), "query_string": query.encode(),
+        "root_path": "", "server": ("bench", 80), "client": ("127.0.0.1", 1),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+    out = {"status": 0, "headers": {}, "size": 0}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            out["status"] = message["status"]
+            out["headers"] = {k.decode(): v.decode() for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            out["size"] += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return out
+
+
+async def measure(app, path: str, requests: int, concurrency: int, revalidate: bool) -> Dict[str, float]:
+    headers = {"host": "bench", "accept-encoding": "br, gzip"}
+    first = await _call(app, path, headers)
+    if revalidate and "etag" in first["headers"]:
+        headers["if-none-match"] = first["headers"]["etag"]
+    sem = asyncio.Semaphore(concurrency)
+    sent = 0
+
+    async def one() -> None:
+        nonlocal sent
+        async with sem:
+            size = (await _call(app, path, headers))["size"]
+            sent += size
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - t0
+    return {"rps": requests / elapsed, "bytes": sent / requests}
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"brotli: {'yes' if assets.brotli is not None else 'no (gzip only)'}")
+    variants = (("old", legacy_app(), False), ("new", web.app, False), ("new-304", web.app, True))
+    for name, path in PATHS.items():
+        for label, app, revalidate in variants:
+            res = await measure(app, path, args.requests, args.concurrency, revalidate)
+            print(f"{name:9s} {label:8s} {res['rps']:8.0f} req/s  {res['bytes']:7.0f} B/resp")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
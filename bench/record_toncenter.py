@@ -0,0 +1,79 @@
+# bench/record_toncenter.py
+"""
+Запись настоящих ответов Toncenter в фикстуру для FakeChain.load_fixture.
+
+    TON_API_KEY=... python -m bench.record_toncenter EQ... --pages 10 --limit 100 \\
+        --out bench/fixtures/wallet.json
+
+Идёт по getTransactions от новых к старым той же пагинацией, что и вочер
+(lt/hash последней транзакции страницы), и сохраняет транзакции как есть
+плюс текущий seqno мастерчейна. Клиент — app.toncenter.ToncenterClient
+(ретраи, rate limit), поэтому записывать можно и с бесплатным ключом.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from app.toncenter import ToncenterClient
+
+
+async def record(client: ToncenterClient, address: str, pages: int, limit: int) -> Dict[str, Any]:
+    txs: List[Dict[str, Any]] = []
+    seen = set()
+    lt: Optional[str] = None
+    tx_hash: Optional[str] = None
+    for _ in range(pages):
+        page = await client.get_transactions(address, limit=limit, lt=lt, hash_=tx_hash)
+        fresh = []
+        for tx in page:
+            tid = tx.get("transaction_id") or {}
+            key = (tid.get("lt"), tid.get("hash"))
+            if key in seen:
+                continue
+            seen.add(key)
+            fresh.append(tx)
+        txs.extend(fresh)
+        if not fresh or len(page) < limit:
+            break
+        last = fresh[-1]["transaction_id"]
+        lt, tx_hash = last["lt"], last["hash"]
+    return {
+        "address": address,
+        "recorded_at": int(time.time()),
+        "masterchain_seqno": await client.get_masterchain_seqno(),
+        "transactions": txs,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("address")
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--base", default=os.getenv("TON_API_BASE", "https://toncenter.com/api/v2"))
+    parser.add_argument("--rps", type=float, default=1.0)
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+
+    client = ToncenterClient(
+        [b.strip() for b in args.base.split(",") if b.strip()],
+        api_key=os.getenv("TON_API_KEY") or None,
+        rps=args.rps,
+    )
+    try:
+        data = await record(client, args.address, args.pages, args.limit)
+    finally:
+        await client.aclose()
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    print(f"{len(data['transactions'])} transactions -> {args.out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,149 @@
+# bench/users_bench.py
+"""
+SQL-запросы на апдейт для реестра пользователей (app.users) на повторе
+реалистичного трафика.
+
+    DATABASE_URL=postgresql://... python -m bench.users_bench --updates 100000 --users 20000
+
+Трафик: апдейты (сообщения, /start, callback_query) от --users
+пользователей с распределением Ципфа (--zipf): немногие активные пишут
+много, длинный хвост — по разу. Доля --new апдейтов — от новых
+пользователей (/start, часть — по реферальной ссылке), доля --lang-change —
+с другим language_code (пользователь сменил язык клиента). Апдейты
+декодируются Update.de_json и проходят через handlers.resolve_user — тот же
+пре-хендлер, что в группе -1 приложения.
+
+  naive    — как без реестра: SELECT по tg_id, INSERT при отсутствии и
+             UPDATE языка при расхождении, на каждый апдейт;
+  registry — LRU + INSERT ... ON CONFLICT DO NOTHING RETURNING на промах,
+             язык — пачками в фоне (flush учитывается в подсчёте).
+
+Печатает апдейтов/сек и statements/update (before_cursor_execute на async
+движке), для registry — ещё холодный (пустой LRU) и тёплый проход. Нужна
+база с применёнными миграциями: бенчмарк пишет в users.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from types import SimpleNamespace
+from typing import List
+
+for k, v in {
+    "BOT_TOKEN": "123456:bench",
+    "BASE_URL": "https://bench.local",
+    "TELEGRAM_WEBHOOK_SECRET": "bench",
+    "TON_API_BASE": "http://127.0.0.1:9/api/v2",
+    "TON_API_KEY": "bench",
+    "TON_ADDRESS": "EQbench",
+}.items():
+    os.environ.setdefault(k, v)
+
+from sqlalchemy import select, update as sa_update  # noqa: E402
+from telegram import Update  # noqa: E402
+
+from app import db as _db, fastjson, handlers, users  # noqa: E402
+from app.config import get_settings  # noqa: E402
+from app.models import User  # noqa: E402
+
+from bench.watcher_bench import StatementCounter  # noqa: E402
+
+LANGS = ["ru", "en", "uk", "kk", "uz", "de"]
+
+
+def traffic(args, base: int) -> List[bytes]:
+    rnd = random.Random(args.seed)
+    weights = [1.0 / (i + 1) ** args.zipf for i in range(args.users)]
+    lang = {i: rnd.choice(LANGS[:2]) for i in range(args.users)}
+    active = rnd.choices(range(args.users), weights=weights, k=args.updates)
+    new = args.users
+    now = int(time.time())
+    out: List[bytes] = []
+    for n, i in enumerate(active):
+        text = "привет"
+        if rnd.random() < args.new:
+            i, new = new, new + 1
+            lang[i] = rnd.choice(LANGS)
+            text = "/start" if rnd.random() < 0.7 else f"/start ref{rnd.randint(1, 1000)}"
+        elif rnd.random() < args.lang_change:
+            lang[i] = rnd.choice(LANGS)
+        tg_user = {"id": base + i, "is_bot": False, "first_name": "U", "language_code": lang[i]}
+        chat = {"id": base + i, "type": "private", "first_name": "U"}
+        msg = {"message_id": n, "date": now, "chat": chat, "from": tg_user, "text": text}
+        if text.startswith("/start"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": 6}]
+        data = (
+            {"update_id": n, "callback_query": {"id": str(n), "from": tg_user, "chat_instance": "1", "data": "pay", "message": msg}}
+            if rnd.random() < 0.2 else {"update_id": n, "message": msg}
+        )
+        out.append(json.dumps(data, ensure_ascii=False).encode())
+    return out
+
+
+async def naive_resolve(update: Update, context) -> None:
+    tg_user = update.effective_user
+    language = (tg_user.language_code or "ru")[:8]
+    async with _db.AsyncSessionLocal() as db:
+        row = (await db.execute(select(User.id, User.language).where(User.tg_id == tg_user.id))).first()
+        if row is None:
+            db.add(User(tg_id=tg_user.id, language=language))
+            await db.flush()
+        elif row.language != language:
+            await db.execute(sa_update(User).where(User.id == row.id).values(language=language))
+        await db.commit()
+
+
+async def replay(name: str, items: List[bytes], resolve, counter: StatementCounter, flush=None) -> None:
+    bot = SimpleNamespace()
+    stmts0 = counter.count
+    t0 = time.perf_counter()
+    for raw in items:
+        await resolve(Update.de_json(fastjson.loads(raw), bot), SimpleNamespace(user_id=None))
+    if flush is not None:
+        await flush()
+    elapsed = time.perf_counter() - t0
+    statements = counter.count - stmts0
+    print(
+        f"{name:15s} updates={len(items)} time={elapsed:.2f}s updates/s={len(items) / elapsed:.0f} "
+        f"statements/update={statements / len(items):.3f}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--new", type=float, default=0.02, help="доля апдейтов от новых пользователей")
+    parser.add_argument("--lang-change", type=float, default=0.001, help="доля апдейтов со сменой языка")
+    parser.add_argument("--cache-size", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    _db.init_async_db(os.environ["DATABASE_URL"], get_settings())
+    counter = StatementCounter(_db.async_engine)
+    try:
+        # свои tg_id на каждый режим: оба начинают с пустой таблицы для своих пользователей
+        base = 8_000_000_000 + int(uuid.uuid4().int % 1_000_000) * 1_000_000
+        await replay("naive", traffic(args, base), naive_resolve, counter)
+
+        items = traffic(args, base + 500_000)
+        registry = users._registry = users.UserRegistry(args.cache_size, flush_batch=get_settings().user_flush_batch)
+        await replay("registry cold", items, handlers.resolve_user, counter, registry.flush)
+        await replay("registry warm", items, handlers.resolve_user, counter, registry.flush)
+        print(
+            f"cache hits={users.CACHE_HITS.value:.0f} db lookups={users.DB_LOOKUPS.value:.0f} "
+            f"created={users.CREATED.value:.0f} language writes={users.LANG_WRITES.value:.0f}"
+        )
+    finally:
+        await users.close_registry()
+        await _db.dispose_async_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,215 @@
+# bench/watcher_bench.py
+"""
+Пропускная способность вочера против фейкового Toncenter (bench.fake_toncenter).
+
+    DATABASE_URL=postgresql://... python -m bench.watcher_bench --sizes 10,1000,100000
+
+На каждый размер — свежий адрес, пользователи с тегами и N синтетических
+транзакций (доля --noise без тега). Режимы:
+
+  poll    — все транзакции уже в цепочке, poll_once() крутится в цикле,
+            пока все депозиты не начислены (каждый вызов getMasterchainInfo
+            у фейка = +1 блок);
+  watcher — настоящий run_watcher() с адаптивным интервалом, транзакции
+            поступают со скоростью --rate в секунду.
+
+Печатает депозиты/сек, задержку «транзакция в цепочке → начислено»
+(p50/p99) и число SQL-запросов на депозит (before_cursor_execute на async
+движке). Нужна отдельная база с применёнными миграциями: бенчмарк пишет
+users / deposit_tags / payments / ledger_entries / balances / state.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import os
+import time
+import uuid
+from typing import Dict, List
+
+for k, v in {
+    "BOT_TOKEN": "123456:bench",
+    "BASE_URL": "https://bench.local",
+    "TELEGRAM_WEBHOOK_SECRET": "bench",
+    "TON_API_BASE": "http://fake-toncenter/api/v2",
+    "TON_API_KEY": "bench",
+    "TON_ADDRESS": "EQbench",
+}.items():
+    os.environ.setdefault(k, v)
+
+from sqlalchemy import event, select  # noqa: E402
+from sqlalchemy.dialects.postgresql import insert as pg_insert  # noqa: E402
+
+from app import db as _db, toncenter  # noqa: E402
+from app import ton_watch as tw  # noqa: E402
+from app.models import DepositTag, Payment, User  # noqa: E402
+
+from bench.fake_toncenter import FakeChain, FakeToncenter  # noqa: E402
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args) -> None:
+        self.count += 1
+
+
+class CreditTracker:
+    """Подменяет ton_watch.confirm_payments и запоминает, когда начислен каждый платёж."""
+
+    def __init__(self):
+        self.credited_at: Dict[int, float] = {}
+        self._orig = tw.confirm_payments
+        tw.confirm_payments = self._confirm
+
+    async def _confirm(self, db, mc_seqno, depth, limit=1000):
+        credited = await self._orig(db, mc_seqno, depth, limit)
+        now = time.perf_counter()
+        for payment_id, _, _ in credited:
+            self.credited_at[payment_id] = now
+        return credited
+
+
+def _pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def _make_tags(run: str, users: int) -> List[str]:
+    tags: List[str] = []
+    base = 9_000_000_000 + int(uuid.uuid4().int % 1_000_000) * 1_000_000
+    async with _db.AsyncSessionLocal() as db:
+        for i in range(0, users, 5000):
+            n = min(5000, users - i)
+            ids = (await db.execute(
+                pg_insert(User).values([{"tg_id": base + i + j, "language": "ru"} for j in range(n)]).returning(User.id)
+            )).scalars().all()
+            chunk = [f"{tw.settings.deposit_tag_prefix}-B{run}{i + j:06d}" for j in range(n)]
+            await db.execute(pg_insert(DepositTag).values([
+                {"user_id": uid, "tag": tag, "is_active": True} for uid, tag in zip(ids, chunk)
+            ]))
+            tags.extend(chunk)
+        await db.commit()
+    return tags
+
+
+async def _external_ids(payment_ids: List[int]) -> Dict[int, str]:
+    out: Dict[int, str] = {}
+    async with _db.AsyncSessionLocal() as db:
+        for i in range(0, len(payment_ids), 10000):
+            rows = await db.execute(select(Payment.id, Payment.external_id).where(Payment.id.in_(payment_ids[i:i + 10000])))
+            out.update(dict(rows.all()))
+    return out
+
+
+def _expected(txs: List[Dict], tags: set, injected_at: float, injected: Dict[str, float]) -> int:
+    n = 0
+    for tx in txs:
+        if tx["in_msg"]["message"] in tags:
+            tid = tx["transaction_id"]
+            injected[f"{tid['lt']}:{tid['hash']}"] = injected_at
+            n += 1
+    return n
+
+
+async def run_size(size: int, args, chain: FakeChain, tracker: CreditTracker, counter: StatementCounter) -> None:
+    run = uuid.uuid4().hex[:6].upper()
+    address = f"EQbench-{run}-{size}"
+    tw.settings.ton_address = address
+    tw.settings.ton_extra_addresses = ""
+    tags = await _make_tags(run, max(1, min(size, args.users)))
+    tag_set = set(tags)
+
+    # курсор с нуля: иначе первый проход возьмёт только одну страницу
+    async with _db.AsyncSessionLocal() as db:
+        await tw._set_cursor(db, address, (0, ""))
+        await db.commit()
+
+    tracker.credited_at.clear()
+    injected: Dict[str, float] = {}
+    expected = 0
+    stmts0 = counter.count
+    t0 = time.perf_counter()
+
+    if args.mode == "poll":
+        expected = _expected(chain.generate(address, size, tags, noise=args.noise), tag_set, t0, injected)
+        polls = 0
+        while len(tracker.credited_at) < expected and polls < args.max_polls:
+            await tw.poll_once()
+            polls += 1
+    else:
+        task = asyncio.create_task(tw.run_watcher())
+        sent = 0
+        step = max(1, int(args.rate / 10))
+        while sent < size:
+            n = min(step, size - sent)
+            expected += _expected(chain.generate(address, n, tags, noise=args.noise), tag_set, time.perf_counter(), injected)
+            sent += n
+            await asyncio.sleep(n / args.rate)
+        deadline = time.perf_counter() + args.timeout
+        while len(tracker.credited_at) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    elapsed = time.perf_counter() - t0
+    statements = counter.count - stmts0
+    ext = await _external_ids(list(tracker.credited_at))
+    latencies = [
+        (tracker.credited_at[pid] - injected[eid]) * 1000
+        for pid, eid in ext.items() if eid in injected
+    ]
+    done = len(latencies)
+    print(
+        f"{args.mode:7s} txs={size:<7d} deposits={done}/{expected} time={elapsed:.2f}s "
+        f"deposits/s={done / elapsed if elapsed else 0:.0f} "
+        f"latency p50={_pct(latencies, 0.5):.0f}ms p99={_pct(latencies, 0.99):.0f}ms "
+        f"statements/deposit={statements / done if done else float('nan'):.2f}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10,1000,100000")
+    parser.add_argument("--mode", choices=["poll", "watcher", "both"], default="poll")
+    parser.add_argument("--users", type=int, default=10000, help="пользователей с тегами (не больше числа транзакций)")
+    parser.add_argument("--noise", type=float, default=0.1, help="доля транзакций без тега")
+    parser.add_argument("--rate", type=float, default=1000.0, help="транзакций/с в режиме watcher")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка ответа фейкового Toncenter")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rps", type=float, default=1000.0, help="TON_API_RPS клиента")
+    parser.add_argument("--max-polls", type=int, default=10000)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    settings = tw.settings
+    settings.ton_api_rps = args.rps
+    settings.ton_require_depth = 1
+    settings.ton_poll_min_interval = 0.1
+    settings.ton_poll_interval = 0.5
+    settings.ton_poll_max_interval = 1.0
+
+    _db.init_async_db(os.environ["DATABASE_URL"], settings)
+    chain = FakeChain()
+    fake = FakeToncenter(chain, latency=args.latency_ms / 1000, error_rate=args.error_rate)
+    toncenter.init_client(settings, transport=fake.transport())
+    counter = StatementCounter(_db.async_engine)
+    tracker = CreditTracker()
+
+    try:
+        for mode in (["poll", "watcher"] if args.mode == "both" else [args.mode]):
+            args.mode = mode
+            for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+                await run_size(size, args, chain, tracker, counter)
+        print(f"toncenter calls: {fake.calls}")
+    finally:
+        await toncenter.close_client()
+        await _db.dispose_async_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
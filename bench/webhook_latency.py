@@ -0,0 +1,121 @@
+# bench/webhook_latency.py
+"""
+Задержка вебхука (p50/p99), пока вочер пишет большую пачку депозитов.
+
+    DATABASE_URL=postgresql://... python -m bench.webhook_latency --deposits 20000
+
+sync  — как было раньше: синхронная Session прямо внутри event loop;
+async — текущий путь: AsyncSession + services.record_deposits.
+
+Вебхук эмулируется пустым FastAPI-эндпоинтом, который дёргается через
+ASGITransport в том же event loop каждые --interval мс — ровно так же он
+ждёт, пока loop занят запросами к БД. Нужна отдельная база с применёнными
+миграциями: бенчмарк пишет в payments / ledger_entries / balances.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from typing import Dict, List
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import db as _db
+from app.models import Payment
+from app.money import to_nano
+from app.services import record_deposits
+
+probe_app = FastAPI()
+
+
+@probe_app.post("/webhook")
+async def _webhook():
+    return {"ok": True}
+
+
+def _deposits(n: int) -> List[Dict]:
+    run = uuid.uuid4().hex[:8]
+    return [
+        {"user_id": i % 1000 + 1, "amount": to_nano("0.5"), "external_id": f"bench-{run}-{i}"}
+        for i in range(n)
+    ]
+
+
+async def _write_sync(deposits: List[Dict], chunk: int) -> None:
+    # старый путь: блокирующие запросы прямо в корутине
+    with _db.SessionLocal() as db:
+        for i in range(0, len(deposits), chunk):
+            rows = [
+                dict(d, provider="ton", currency="TON", status="credited")
+                for d in deposits[i:i + chunk]
+            ]
+            db.execute(pg_insert(Payment).values(rows).on_conflict_do_nothing(index_elements=[Payment.external_id]))
+            db.commit()
+            await asyncio.sleep(0)
+
+
+async def _write_async(deposits: List[Dict], chunk: int) -> None:
+    async with _db.AsyncSessionLocal() as db:
+        for i in range(0, len(deposits), chunk):
+            await record_deposits(db, deposits[i:i + chunk])
+            await db.commit()
+
+
+async def _probe(stop: asyncio.Event, interval: float, out: List[float]) -> None:
+    transport = httpx.ASGITransport(app=probe_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            await client.post("/webhook", json={"update_id": 1})
+            out.append((time.perf_counter() - t0) * 1000)
+            await asyncio.sleep(interval)
+
+
+def _pct(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def _run(mode: str, deposits: int, chunk: int, interval: float) -> None:
+    latencies: List[float] = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_probe(stop, interval, latencies))
+    t0 = time.perf_counter()
+    if mode == "sync":
+        await _write_sync(_deposits(deposits), chunk)
+    else:
+        await _write_async(_deposits(deposits), chunk)
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await probe
+    print(
+        f"{mode:5s} deposits={deposits} write={elapsed:.2f}s webhooks={len(latencies)} "
+        f"p50={_pct(latencies, 0.50):.1f}ms p99={_pct(latencies, 0.99):.1f}ms max={max(latencies, default=0):.1f}ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--deposits", type=int, default=20000)
+    parser.add_argument("--chunk", type=int, default=100)
+    parser.add_argument("--interval", type=float, default=5.0, help="мс между запросами вебхука")
+    parser.add_argument("--mode", choices=["sync", "async", "both"], default="both")
+    args = parser.parse_args()
+
+    url = os.environ["DATABASE_URL"]
+    _db.init_db(url)
+    _db.init_async_db(url)
+    for mode in (["sync", "async"] if args.mode == "both" else [args.mode]):
+        await _run(mode, args.deposits, args.chunk, args.interval / 1000)
+    await _db.dispose_async_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
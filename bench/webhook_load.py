@@ -0,0 +1,105 @@
+# bench/webhook_load.py
+"""
+Нагрузочный тест вебхука: тысячи синтетических апдейтов через настоящий
+эндпоинт app.web (проверка секрета, разбор JSON, очередь, воркеры).
+
+    python -m bench.webhook_load --updates 5000 --chats 200 --handler-ms 20
+
+Обработка апдейта (Update.de_json + PTB) подменяется задержкой --handler-ms,
+чтобы не ходить в Telegram; порядок внутри чата проверяется. Печатает
+принятые апдейты/сек, долю 503, p50/p99 ответа вебхука и время дренажа.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+for k, v in {
+    "BOT_TOKEN": "123456:bench",
+    "BASE_URL": "https://bench.local",
+    "TELEGRAM_WEBHOOK_SECRET": "bench",
+    "DATABASE_URL": "postgresql://bench@localhost/bench",
+    "TON_API_BASE": "http://127.0.0.1:9/api/v2",
+    "TON_API_KEY": "bench",
+    "TON_ADDRESS": "EQbench",
+}.items():
+    os.environ.setdefault(k, v)
+
+import httpx  # noqa: E402
+
+from app import web  # noqa: E402
+
+
+def _update(update_id: int, chat_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "bench"},
+            "text": "/start",
+        },
+    }
+
+
+def _pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=200, help="одновременных запросов от «Telegram»")
+    parser.add_argument("--handler-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    seen: Dict[int, List[int]] = defaultdict(list)
+
+    async def fake_process(data: dict) -> None:
+        await asyncio.sleep(args.handler_ms / 1000)
+        seen[data["message"]["chat"]["id"]].append(data["update_id"])
+
+    web.update_queue.process = fake_process
+    web.update_queue.start()
+
+    latencies: List[float] = []
+    statuses: Dict[int, int] = defaultdict(int)
+    sem = asyncio.Semaphore(args.concurrency)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": web.settings.telegram_webhook_secret}
+    path = web.settings.webhook_path
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=web.app), base_url="http://bench") as client:
+        async def send(i: int) -> None:
+            async with sem:
+                t0 = time.perf_counter()
+                r = await client.post(path, json=_update(i, 1000 + i % args.chats), headers=headers)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                statuses[r.status_code] += 1
+
+        t0 = time.perf_counter()
+        # чаты шлют по порядку: апдейты одного чата уходят в порядке update_id
+        await asyncio.gather(*(send(i) for i in range(args.updates)))
+        accept_time = time.perf_counter() - t0
+
+        t1 = time.perf_counter()
+        await web.update_queue.drain(timeout=600)
+        drain_time = time.perf_counter() - t1
+
+    ok = statuses.get(200, 0)
+    disorder = sum(1 for ids in seen.values() if ids != sorted(ids))
+    print(
+        f"updates={args.updates} ok={ok} 503={statuses.get(503, 0)} other={args.updates - ok - statuses.get(503, 0)} "
+        f"accept={ok / accept_time:.0f}/s p50={_pct(latencies, 0.5):.1f}ms p99={_pct(latencies, 0.99):.1f}ms "
+        f"drain={drain_time:.2f}s processed={sum(len(v) for v in seen.values())} chats_out_of_order={disorder}"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
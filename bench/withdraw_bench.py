@@ -0,0 +1,148 @@
+# bench/withdraw_bench.py
+"""
+Пропускная способность обработки выводов против bench.fake_wallet.
+
+    DATABASE_URL=postgresql://... python -m bench.withdraw_bench --sizes 100,10000 --workers 4
+
+На каждый размер: --users пользователей с балансом (opening через журнал),
+N заявок pending (доля --overdraft — больше баланса, уйдут в rejected),
+затем --workers параллельных воркеров app.withdrawals гоняют process_once,
+пока все заявки не станут done / failed / rejected.
+
+Печатает выводов/сек, число пачек, SQL-запросов на вывод и сверку:
+сумма балансов + выведенное = начальная сумма. Нужна отдельная база с
+применёнными миграциями.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from typing import List
+
+for k, v in {
+    "BOT_TOKEN": "123456:bench",
+    "BASE_URL": "https://bench.local",
+    "TELEGRAM_WEBHOOK_SECRET": "bench",
+    "TON_API_BASE": "http://fake-toncenter/api/v2",
+    "TON_API_KEY": "bench",
+    "TON_ADDRESS": "EQbench",
+}.items():
+    os.environ.setdefault(k, v)
+
+from sqlalchemy import func, select  # noqa: E402
+from sqlalchemy.dialects.postgresql import insert as pg_insert  # noqa: E402
+
+from app import db as _db, withdrawals as wd  # noqa: E402
+from app.config import get_settings  # noqa: E402
+from app.models import Balance, User, Withdrawal  # noqa: E402
+from app.money import to_nano  # noqa: E402
+from app.services import apply_ledger  # noqa: E402
+
+from bench.fake_wallet import FakeWallet  # noqa: E402
+from bench.watcher_bench import StatementCounter  # noqa: E402
+
+OPENING = to_nano("100")
+
+
+async def _prepare(size: int, users: int, overdraft: float) -> List[int]:
+    base = 8_000_000_000 + int(uuid.uuid4().int % 1_000_000) * 1_000_000
+    async with _db.AsyncSessionLocal() as db:
+        ids = (await db.execute(
+            pg_insert(User).values([{"tg_id": base + i, "language": "ru"} for i in range(users)]).returning(User.id)
+        )).scalars().all()
+        await apply_ledger(db, [{"user_id": uid, "amount": OPENING, "kind": "opening", "ref_id": uid} for uid in ids])
+        # обычная заявка — 1 TON; «овердрафт» больше любого баланса
+        rows = [
+            {
+                "user_id": ids[i % users],
+                "amount": OPENING * 2 if int((i + 1) * overdraft) > int(i * overdraft) else to_nano("1"),
+                "address": f"EQdest-{i}",
+                "comment": f"w{i}",
+                "status": "pending",
+            }
+            for i in range(size)
+        ]
+        for i in range(0, size, 5000):
+            await db.execute(pg_insert(Withdrawal).values(rows[i:i + 5000]))
+        await db.commit()
+    return list(ids)
+
+
+async def _open(user_ids: List[int]) -> int:
+    async with _db.AsyncSessionLocal() as db:
+        return (await db.execute(
+            select(func.count()).select_from(Withdrawal)
+            .where(Withdrawal.user_id.in_(user_ids), Withdrawal.status.in_(["pending", "processing"]))
+        )).scalar_one()
+
+
+async def run_size(size: int, args, counter: StatementCounter) -> None:
+    wallet = FakeWallet(confirm_after=args.confirm_after, fail_rate=args.fail_rate, latency=args.latency_ms / 1000)
+    sender = wd.HttpWithdrawalSender("http://fake-wallet", transport=wallet.transport())
+    users = max(1, min(args.users, size))
+    user_ids = await _prepare(size, users, args.overdraft)
+
+    stmts0 = counter.count
+    checks = 0
+    t0 = time.perf_counter()
+
+    async def worker() -> None:
+        nonlocal checks
+        while True:
+            checks += 1
+            if not await _open(user_ids):
+                return
+            n = await wd.process_once(sender, args.batch, resend_after=args.confirm_after * 4 + 1)
+            if n < args.batch:
+                await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(asyncio.gather(*(worker() for _ in range(args.workers))), args.timeout)
+    elapsed = time.perf_counter() - t0
+    await sender.aclose()
+
+    async with _db.AsyncSessionLocal() as db:
+        by_status = dict((await db.execute(
+            select(Withdrawal.status, func.count()).where(Withdrawal.user_id.in_(user_ids)).group_by(Withdrawal.status)
+        )).all())
+        left = (await db.execute(select(func.sum(Balance.amount)).where(Balance.user_id.in_(user_ids)))).scalar_one()
+        paid = (await db.execute(
+            select(func.coalesce(func.sum(Withdrawal.amount), 0)).where(Withdrawal.user_id.in_(user_ids), Withdrawal.status == "done")
+        )).scalar_one()
+    # проверки «всё ли обработано» — не часть обработки
+    statements = counter.count - stmts0 - checks
+    ok = left + paid == OPENING * users
+    print(
+        f"withdrawals={size:<7d} workers={args.workers} time={elapsed:.2f}s "
+        f"withdrawals/s={size / elapsed if elapsed else 0:.0f} batches={len(wallet.transfers)} "
+        f"statements/withdrawal={statements / size:.2f} statuses={by_status} balance_check={'ok' if ok else 'MISMATCH'}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100,10000")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=wd.MAX_MESSAGES)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--overdraft", type=float, default=0.0, help="доля заявок больше баланса")
+    parser.add_argument("--confirm-after", type=float, default=0.0, help="секунд до подтверждения перевода")
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка ответа фейкового кошелька")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    args = parser.parse_args()
+
+    settings = get_settings()
+    _db.init_async_db(os.environ["DATABASE_URL"], settings)
+    counter = StatementCounter(_db.async_engine)
+    try:
+        for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+            await run_size(size, args, counter)
+    finally:
+        await _db.dispose_async_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,27 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_ledger"
+down_revision = "0001_init"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table("ledger_entries",
+        sa.Column("id", sa.BigInteger, primary_key=True),
+        sa.Column("user_id", sa.Integer, index=True, nullable=False),
+        sa.Column("amount", sa.Numeric(18,8), nullable=False),
+        sa.Column("kind", sa.String(16), nullable=False),
+        sa.Column("ref_id", sa.BigInteger, nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.UniqueConstraint("kind", "ref_id", name="uq_ledger_entries_kind_ref"),
+    )
+    # текущие балансы переносим в журнал одной «входящей» записью на пользователя
+    op.execute(
+        "INSERT INTO ledger_entries (user_id, amount, kind, ref_id) "
+        "SELECT user_id, amount, 'opening', user_id FROM balances "
+        "WHERE amount IS NOT NULL AND amount <> 0"
+    )
+
+def downgrade():
+    op.drop_table("ledger_entries")
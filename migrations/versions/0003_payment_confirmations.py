@@ -0,0 +1,21 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003_payment_confirmations"
+down_revision = "0002_ledger"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column("payments", sa.Column("mc_seqno", sa.BigInteger, nullable=True))
+    # CONCURRENTLY нельзя внутри транзакции — строим индекс без блокировки записи
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_payments_status_created_at", "payments", ["status", "created_at"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_payments_status_created_at", table_name="payments", postgresql_concurrently=True, if_exists=True)
+    op.drop_column("payments", "mc_seqno")
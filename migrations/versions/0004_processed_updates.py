@@ -0,0 +1,16 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_processed_updates"
+down_revision = "0003_payment_confirmations"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table("processed_updates",
+        sa.Column("update_id", sa.BigInteger, primary_key=True, autoincrement=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), index=True),
+    )
+
+def downgrade():
+    op.drop_table("processed_updates")
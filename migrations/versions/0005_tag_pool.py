@@ -0,0 +1,25 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005_tag_pool"
+down_revision = "0004_processed_updates"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # свободные теги пула хранятся с user_id = NULL
+    op.alter_column("deposit_tags", "user_id", existing_type=sa.Integer, nullable=True)
+    op.add_column("deposit_tags", sa.Column("assigned_at", sa.DateTime(timezone=True), nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_deposit_tags_unassigned", "deposit_tags", ["id"],
+            postgresql_where=sa.text("user_id IS NULL"),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_deposit_tags_unassigned", table_name="deposit_tags", postgresql_concurrently=True, if_exists=True)
+    op.execute("DELETE FROM deposit_tags WHERE user_id IS NULL")
+    op.drop_column("deposit_tags", "assigned_at")
+    op.alter_column("deposit_tags", "user_id", existing_type=sa.Integer, nullable=False)
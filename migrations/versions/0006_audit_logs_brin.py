@@ -0,0 +1,20 @@
+from alembic import op
+
+revision = "0006_audit_logs_brin"
+down_revision = "0005_tag_pool"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # audit_logs растёт только вставками по времени — BRIN по created_at
+    # на порядки меньше btree и покрывает выборки по периоду и ретенцию
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_audit_logs_created_at_brin", "audit_logs", ["created_at"],
+            postgresql_using="brin",
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_audit_logs_created_at_brin", table_name="audit_logs", postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,36 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007_withdrawal_batches"
+down_revision = "0006_audit_logs_brin"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table("withdrawal_batches",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("status", sa.String(16), nullable=False, server_default="new"),
+        sa.Column("count", sa.Integer, nullable=False),
+        sa.Column("total", sa.Numeric(18,8), nullable=False),
+        sa.Column("msg_hash", sa.String(128), nullable=True),
+        sa.Column("attempts", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("error", sa.String(256), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("submitted_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("confirmed_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index("ix_withdrawal_batches_status_id", "withdrawal_batches", ["status", "id"])
+    # nullable без default — только метаданные, таблица не переписывается
+    op.add_column("withdrawals", sa.Column("batch_id", sa.Integer, nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_withdrawals_batch_id", "withdrawals", ["batch_id"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_withdrawals_batch_id", table_name="withdrawals", postgresql_concurrently=True, if_exists=True)
+    op.drop_column("withdrawals", "batch_id")
+    op.drop_index("ix_withdrawal_batches_status_id", table_name="withdrawal_batches")
+    op.drop_table("withdrawal_batches")
@@ -0,0 +1,84 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008_schema_drift"
+down_revision = "0007_withdrawal_batches"
+branch_labels = None
+depends_on = None
+
+# столбцы, которые в моделях NOT NULL, а в 0001 остались nullable; значение — чем заполнить NULL
+NOT_NULL = [
+    ("users", "language", "'ru'"),
+    ("users", "created_at", "now()"),
+    ("payments", "status", "'pending'"),
+    ("payments", "created_at", "now()"),
+    ("balances", "amount", "0"),
+    ("ledger_entries", "created_at", "now()"),
+    ("withdrawals", "status", "'pending'"),
+    ("withdrawals", "created_at", "now()"),
+    ("withdrawal_batches", "created_at", "now()"),
+    ("audit_logs", "event", "''"),
+    ("audit_logs", "data", "''"),
+    ("audit_logs", "created_at", "now()"),
+    ("deposit_tags", "is_active", "true"),
+    ("deposit_tags", "created_at", "now()"),
+    ("processed_updates", "created_at", "now()"),
+]
+
+# индексы горячих путей; уже существующие (0003, 0006) пропускаются
+INDEXES = [
+    ("ix_deposit_tags_user_id_is_active", "deposit_tags", ["user_id", "is_active"], {}),
+    ("ix_payments_status_created_at", "payments", ["status", "created_at"], {}),
+    ("ix_withdrawals_status_created_at", "withdrawals", ["status", "created_at"], {}),
+    ("ix_audit_logs_created_at_brin", "audit_logs", ["created_at"], {"postgresql_using": "brin"}),
+]
+OWN_INDEXES = ("ix_deposit_tags_user_id_is_active", "ix_withdrawals_status_created_at")
+
+
+def _drop_if_invalid(name: str, table: str) -> None:
+    # прерванный CREATE INDEX CONCURRENTLY оставляет INVALID-индекс, и IF NOT EXISTS его бы пропустил
+    if op.get_context().as_sql:
+        return
+    invalid = op.get_bind().execute(
+        sa.text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ),
+        {"name": name},
+    ).first()
+    if invalid:
+        op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+
+
+def upgrade():
+    # быстрые изменения метаданных — без перезаписи таблиц
+    # (state.value и payments.raw совпадают с 0001 — под них поправлены модели)
+    op.add_column("state", sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False))
+    op.alter_column("audit_logs", "data", type_=sa.Text, existing_type=sa.String(2048))
+
+    # каждая команда — своей транзакцией: ACCESS EXCLUSIVE берётся лишь на
+    # мгновение, а проверка строк (VALIDATE) идёт под SHARE UPDATE EXCLUSIVE
+    # и запись не блокирует; SET NOT NULL затем опирается на валидный CHECK
+    with op.get_context().autocommit_block():
+        for table, column, fill in NOT_NULL:
+            check = f"ck_{table}_{column}_not_null"
+            op.execute(f"UPDATE {table} SET {column} = {fill} WHERE {column} IS NULL")
+            op.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {check}")
+            op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {check} CHECK ({column} IS NOT NULL) NOT VALID")
+            op.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {check}")
+            op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL")
+            op.execute(f"ALTER TABLE {table} DROP CONSTRAINT {check}")
+
+        for name, table, columns, kw in INDEXES:
+            _drop_if_invalid(name, table)
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True, **kw)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name in OWN_INDEXES:
+            table = next(t for n, t, _, _ in INDEXES if n == name)
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+    for table, column, _ in NOT_NULL:
+        op.alter_column(table, column, nullable=True)
+    op.alter_column("audit_logs", "data", type_=sa.String(2048), existing_type=sa.Text)
+    op.drop_column("state", "updated_at")
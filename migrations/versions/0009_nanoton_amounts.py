@@ -0,0 +1,35 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009_nanoton_amounts"
+down_revision = "0008_schema_drift"
+branch_labels = None
+depends_on = None
+
+# суммы -> целые нанотоны (1 TON = 10**9)
+COLUMNS = [
+    ("payments", "amount"),
+    ("balances", "amount"),
+    ("ledger_entries", "amount"),
+    ("withdrawals", "amount"),
+    ("withdrawal_batches", "total"),
+]
+
+def upgrade():
+    # смена типа переписывает таблицу под ACCESS EXCLUSIVE: на большой базе —
+    # в окно обслуживания, с остановленным вочером и воркером выводов
+    for table, column in COLUMNS:
+        op.alter_column(
+            table, column,
+            type_=sa.BigInteger, existing_type=sa.Numeric(18, 8),
+            postgresql_using=f"round({column} * 1000000000)::bigint",
+        )
+
+def downgrade():
+    # Numeric(18, 8) хранит 8 знаков — девятый знак нанотонов округляется
+    for table, column in COLUMNS:
+        op.alter_column(
+            table, column,
+            type_=sa.Numeric(18, 8), existing_type=sa.BigInteger,
+            postgresql_using=f"round({column} / 1000000000.0, 8)",
+        )
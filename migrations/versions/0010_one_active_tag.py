@@ -0,0 +1,43 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010_one_active_tag"
+down_revision = "0009_nanoton_amounts"
+branch_labels = None
+depends_on = None
+
+INDEX = "ux_deposit_tags_user_id_active"
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        # два параллельных первых /start одного пользователя могли выдать ему
+        # два тега из пула; оставляем самый ранний — его /start и отдаёт из БД
+        # (переводы на снятые теги вочер больше не зачисляет — проверьте их
+        # до миграции: SELECT user_id FROM deposit_tags WHERE is_active
+        # GROUP BY user_id HAVING count(*) > 1)
+        op.execute(
+            "UPDATE deposit_tags t SET is_active = false "
+            "WHERE t.is_active AND t.user_id IS NOT NULL AND EXISTS ("
+            "SELECT 1 FROM deposit_tags o "
+            "WHERE o.user_id = t.user_id AND o.is_active AND o.id < t.id)"
+        )
+        if not op.get_context().as_sql:
+            invalid = op.get_bind().execute(
+                sa.text(
+                    "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :name AND NOT i.indisvalid"
+                ),
+                {"name": INDEX},
+            ).first()
+            if invalid:
+                op.drop_index(INDEX, table_name="deposit_tags", postgresql_concurrently=True, if_exists=True)
+        op.create_index(
+            INDEX, "deposit_tags", ["user_id"], unique=True,
+            postgresql_where=sa.text("is_active"),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(INDEX, table_name="deposit_tags", postgresql_concurrently=True, if_exists=True)
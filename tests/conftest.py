@@ -0,0 +1,17 @@
+# tests/conftest.py
+import os
+import sys
+
+# настройки читаются при импорте app.*; сеть и БД тестам не нужны
+for k, v in {
+    "BOT_TOKEN": "123456:test",
+    "BASE_URL": "https://test.local",
+    "TELEGRAM_WEBHOOK_SECRET": "test",
+    "DATABASE_URL": "postgresql://test@localhost/test",
+    "TON_API_BASE": "http://127.0.0.1:9/api/v2",
+    "TON_API_KEY": "test",
+    "TON_ADDRESS": "EQtest",
+}.items():
+    os.environ.setdefault(k, v)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,44 @@
+# tests/test_dedupe.py
+import asyncio
+
+import pytest
+
+from app.dedupe import UpdateDeduper
+
+
+class FlakyShared:
+    """Общий бэкенд, первый claim которого падает (БД недоступна)."""
+
+    def __init__(self):
+        self.claimed = set()
+        self.fail = True
+
+    async def claim(self, update_id: int) -> bool:
+        if self.fail:
+            self.fail = False
+            raise ConnectionError("db down")
+        if update_id in self.claimed:
+            return False
+        self.claimed.add(update_id)
+        return True
+
+    async def release(self, update_id: int) -> None:
+        self.claimed.discard(update_id)
+
+
+def test_failed_shared_claim_does_not_swallow_redelivery():
+    deduper = UpdateDeduper(shared=FlakyShared())
+    with pytest.raises(ConnectionError):
+        asyncio.run(deduper.first_seen(1))
+    # Telegram доставляет апдейт повторно — он должен быть обработан
+    assert asyncio.run(deduper.first_seen(1)) is True
+    assert asyncio.run(deduper.first_seen(1)) is False
+
+
+def test_local_duplicates_skip_shared_store():
+    shared = FlakyShared()
+    shared.fail = False
+    deduper = UpdateDeduper(shared=shared)
+    assert asyncio.run(deduper.first_seen(5)) is True
+    shared.claimed.clear()
+    assert asyncio.run(deduper.first_seen(5)) is False
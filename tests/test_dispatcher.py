@@ -0,0 +1,75 @@
+# tests/test_dispatcher.py
+import asyncio
+
+from telegram.error import NetworkError, RetryAfter
+
+from app import dispatcher
+from app.dispatcher import MAX_ATTEMPTS, OutboundDispatcher
+
+
+class FlakyBot:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, text))
+
+
+async def _deliver(bot) -> OutboundDispatcher:
+    d = OutboundDispatcher(bot, global_rate=1000, per_chat_rate=1000)
+    d.start()
+    await d.send(1, "paid", priority=dispatcher.PRIORITY_PAYMENT)
+    await d.stop(timeout=5.0)
+    return d
+
+
+def test_retry_after_does_not_use_up_attempts():
+    bot = FlakyBot([RetryAfter(0)] * (MAX_ATTEMPTS + 3))
+    asyncio.run(_deliver(bot))
+    assert bot.sent == [(1, "paid")]
+
+
+def test_network_errors_are_capped(monkeypatch):
+    monkeypatch.setattr(dispatcher, "MAX_ATTEMPTS", 2)
+    bot = FlakyBot([NetworkError("boom")] * 5)
+    failed = dispatcher.FAILED.value
+    asyncio.run(_deliver(bot))
+    assert bot.sent == []
+    assert dispatcher.FAILED.value == failed + 1
+
+
+def test_full_broadcast_queue_does_not_block_payments():
+    async def scenario():
+        bot = FlakyBot([])
+        d = OutboundDispatcher(bot, global_rate=1000, per_chat_rate=1000, max_pending=2, reserve=1)
+        # отправка не запущена: рассылка забивает общую очередь
+        await d.send(10, "news", priority=dispatcher.PRIORITY_BROADCAST)
+        await d.send(11, "news", priority=dispatcher.PRIORITY_BROADCAST)
+        await asyncio.wait_for(d.send(1, "paid", priority=dispatcher.PRIORITY_PAYMENT), 1.0)
+        # резерв исчерпан — без ожидания не ставится, и это видно вызывающему
+        assert d.send_nowait(2, "paid too") is False
+        assert d.send_nowait(3, "news", priority=dispatcher.PRIORITY_BROADCAST) is False
+        d.start()
+        await d.stop(timeout=5.0)
+        return bot
+
+    bot = asyncio.run(scenario())
+    assert bot.sent[0] == (1, "paid")
+    assert sorted(bot.sent[1:]) == [(10, "news"), (11, "news")]
+
+
+def test_reserve_is_released_after_delivery():
+    async def scenario():
+        bot = FlakyBot([NetworkError("boom")])
+        d = OutboundDispatcher(bot, global_rate=1000, per_chat_rate=1000, reserve=1)
+        d.start()
+        assert d.send_nowait(1, "paid")
+        await d.stop(timeout=5.0)
+        return d, bot
+
+    d, bot = asyncio.run(scenario())
+    assert bot.sent == [(1, "paid")]
+    assert d._reserved == 0
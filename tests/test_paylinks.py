@@ -0,0 +1,45 @@
+# tests/test_paylinks.py
+import asyncio
+
+import pytest
+
+from app import paylinks
+from app.money import to_nano
+
+ADDRESS = "EQD4FPq-PRDieyQKkizFTRtSDyucUIqrj0v_zXJmqaDp6_0t"
+
+
+def _service(**kw) -> paylinks.PayLinkService:
+    return paylinks.PayLinkService("https://bot.example", secret=b"k" * 32, **kw)
+
+
+def test_qr_link_is_signed_for_its_triple():
+    service = _service()
+    amount = to_nano("2.5")
+    links = service.links(ADDRESS, amount, "P4V-ABC")
+    sig = links.qr_png.split("sig=")[1].split("&")[0]
+    assert service.verify(ADDRESS, amount, "P4V-ABC", sig)
+    assert not service.verify(ADDRESS, amount + 1, "P4V-ABC", sig)
+    assert not service.verify(ADDRESS, amount, "P4V-ABD", sig)
+    assert not _service().verify(ADDRESS, amount, "P4V-ABC", "")
+
+
+def test_qr_renders_once_off_loop_and_caches(monkeypatch):
+    pytest.importorskip("segno")
+    service = _service()
+    renders = []
+    render = service.render_qr
+
+    def counting(*args):
+        renders.append(args)
+        return render(*args)
+
+    monkeypatch.setattr(service, "render_qr", counting)
+
+    async def scenario():
+        return await asyncio.gather(*(service.qr(ADDRESS, to_nano("1"), "P4V-ABC", "svg") for _ in range(5)))
+
+    assets = asyncio.run(scenario())
+    assert len(renders) == 1
+    assert all(a is assets[0] for a in assets)
+    assert asyncio.run(service.qr(ADDRESS, to_nano("1"), "P4V-ABC", "svg")) is assets[0]
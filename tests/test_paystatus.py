@@ -0,0 +1,81 @@
+# tests/test_paystatus.py
+import asyncio
+from types import SimpleNamespace
+
+from app import paystatus
+from app.paystatus import StatusBoard
+
+
+class FakeDB:
+    """AsyncSessionLocal, отдающий строки _LATEST_SQL по очереди (последняя повторяется)."""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.queries = 0
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, stmt, params):
+        self.queries += 1
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        row = SimpleNamespace(status=status, at=1.0, external_id="1:h", amount=2_500_000_000)
+        return SimpleNamespace(first=lambda: row)
+
+
+def test_db_entries_are_refreshed_without_events(monkeypatch):
+    # не-лидер с memory-бэкендом: событий вочера нет, статус перечитывается из БД
+    db = FakeDB(["seen", "seen", "credited"])
+    monkeypatch.setattr(paystatus._db, "AsyncSessionLocal", db)
+    board = StatusBoard(db_ttl=0.05)
+    entry = asyncio.run(board.wait("p4v-abc", since="seen", timeout=2.0))
+    assert entry["status"] == "credited"
+    assert entry["amount"] == "2.5"
+    assert db.queries == 3
+
+
+def test_without_ttl_waits_for_events_only(monkeypatch):
+    db = FakeDB(["seen", "credited"])
+    monkeypatch.setattr(paystatus._db, "AsyncSessionLocal", db)
+    board = StatusBoard(db_ttl=None)
+    entry = asyncio.run(board.wait("P4V-ABC", since="seen", timeout=0.2))
+    assert entry["status"] == "seen"
+    assert db.queries == 1
+
+
+def test_event_wins_over_db(monkeypatch):
+    db = FakeDB(["seen"])
+    monkeypatch.setattr(paystatus._db, "AsyncSessionLocal", db)
+    board = StatusBoard(db_ttl=0.05)
+
+    async def scenario():
+        waiter = asyncio.create_task(board.wait("P4V-ABC", since="seen", timeout=2.0))
+        await asyncio.sleep(0.01)
+        board.publish("P4V-ABC", "credited", "1:h", "2.5")
+        return await waiter
+
+    entry = asyncio.run(scenario())
+    assert entry["status"] == "credited"
+    assert db.queries == 1
+
+
+class BrokenDB(FakeDB):
+    async def execute(self, stmt, params):
+        self.queries += 1
+        raise ConnectionError("db down")
+
+
+def test_db_failure_without_ttl_waits_instead_of_failing(monkeypatch):
+    # PAY_STATUS_BACKEND=postgres / PAY_STATUS_DB_TTL=0: БД недоступна — ждём событий
+    db = BrokenDB(["pending"])
+    monkeypatch.setattr(paystatus._db, "AsyncSessionLocal", db)
+    board = StatusBoard(db_ttl=None)
+    entry = asyncio.run(board.wait("P4V-ABC", timeout=0.1))
+    assert entry["status"] == "pending"
+    assert db.queries == 1
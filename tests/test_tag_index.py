@@ -0,0 +1,45 @@
+# tests/test_tag_index.py
+import asyncio
+
+from sqlalchemy.dialects import postgresql
+
+from app.ton_watch import TagIndex
+
+
+class FakeDB:
+    """execute() возвращает известные теги из переданных в IN (...)."""
+
+    def __init__(self, owners):
+        self.owners = owners
+        self.statements = []
+
+    async def execute(self, stmt):
+        sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+        self.statements.append(sql)
+        return [(tag, user_id) for tag, user_id in self.owners.items() if f"'{tag}'" in sql]
+
+
+def test_resolve_uses_plain_tag_comparison_and_caches_misses():
+    db = FakeDB({"P4V-AAAAAA": 7})
+    index = TagIndex()
+    asyncio.run(index.resolve(db, ["p4v-aaaaaa", "P4V-SPAM01", "hello"]))
+    assert index.get("P4V-AAAAAA") == 7
+    assert index.get("P4V-SPAM01") is None
+    assert len(db.statements) == 1
+    assert "upper(" not in db.statements[0].lower()
+    assert "deposit_tags.tag IN ('P4V-AAAAAA', 'P4V-SPAM01')" in db.statements[0] or \
+        "deposit_tags.tag IN ('P4V-SPAM01', 'P4V-AAAAAA')" in db.statements[0]
+
+    # спам-комментарий на следующем опросе в БД не ходит
+    asyncio.run(index.resolve(db, ["P4V-SPAM01", "P4V-AAAAAA"]))
+    assert len(db.statements) == 1
+
+
+def test_missed_tags_are_retried_after_ttl():
+    db = FakeDB({})
+    index = TagIndex(miss_ttl=0.0)
+    asyncio.run(index.resolve(db, ["P4V-BBBBBB"]))
+    db.owners["P4V-BBBBBB"] = 3
+    asyncio.run(index.resolve(db, ["P4V-BBBBBB"]))
+    assert index.get("p4v-bbbbbb") == 3
+    assert len(db.statements) == 2
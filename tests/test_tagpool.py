@@ -0,0 +1,55 @@
+# tests/test_tagpool.py
+import asyncio
+
+from sqlalchemy.exc import IntegrityError
+
+from app import tagpool
+
+
+class FakeEngine:
+    """async_engine, отдающий результаты _CLAIM_SQL по очереди (исключения — бросает)."""
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.params = []
+
+    def connect(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execution_options(self, **kw):
+        return self
+
+    async def execute(self, stmt, params):
+        self.params.append(params)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return type("R", (), {"scalar": lambda self: result})()
+
+
+def test_claim_by_user_id_is_cached(monkeypatch):
+    engine = FakeEngine(["P4V-AAAAAA"])
+    monkeypatch.setattr(tagpool._db, "async_engine", engine)
+    monkeypatch.setattr(tagpool, "_cache", tagpool.TagCache())
+    monkeypatch.setattr(tagpool.events, "wake_watcher", lambda: None)
+    assert asyncio.run(tagpool.get_deposit_tag(7)) == "P4V-AAAAAA"
+    assert asyncio.run(tagpool.get_deposit_tag(7)) == "P4V-AAAAAA"
+    assert engine.params == [{"user_id": 7}]
+    assert "users" not in str(tagpool._CLAIM_SQL).replace("deposit_tags", "")
+
+
+def test_concurrent_claim_conflict_returns_winners_tag(monkeypatch):
+    # второй /start упёрся в ux_deposit_tags_user_id_active — повтор видит тег первого
+    conflict = IntegrityError("UPDATE deposit_tags", {}, Exception("duplicate key"))
+    engine = FakeEngine([conflict, "P4V-WINNER"])
+    monkeypatch.setattr(tagpool._db, "async_engine", engine)
+    monkeypatch.setattr(tagpool, "_cache", tagpool.TagCache())
+    monkeypatch.setattr(tagpool.events, "wake_watcher", lambda: None)
+    assert asyncio.run(tagpool.get_deposit_tag(7)) == "P4V-WINNER"
+    assert len(engine.params) == 2
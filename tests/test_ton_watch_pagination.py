@@ -0,0 +1,132 @@
+# tests/test_ton_watch_pagination.py
+"""
+fetch_new_transactions на записанной странице Toncenter
+(tests/fixtures/toncenter_transactions.json, формат bench.record_toncenter).
+
+Фейковый fetch повторяет семантику getTransactions: от новых к старым,
+начиная с (lt, hash) включительно, строго новее to_lt.
+"""
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+from app import ton_watch as tw
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "toncenter_transactions.json")
+
+
+def _tid(tx: Dict[str, Any]):
+    t = tx["transaction_id"]
+    return int(t["lt"]), t["hash"]
+
+
+@pytest.fixture(scope="module")
+def recorded() -> Dict[str, Any]:
+    with open(FIXTURE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Replay:
+    """getTransactions поверх записанных транзакций; запоминает вызовы."""
+
+    def __init__(self, txs: List[Dict[str, Any]], honor_to_lt: bool = True):
+        self.txs = sorted(txs, key=_tid, reverse=True)  # от новых к старым
+        self.honor_to_lt = honor_to_lt
+        self.calls: List[Dict[str, Any]] = []
+
+    async def __call__(self, address: str, limit: int = 10, lt: Optional[str] = None,
+                       hash_: Optional[str] = None, to_lt: Optional[str] = None) -> List[Dict[str, Any]]:
+        call = {"lt": lt, "hash": hash_, "to_lt": to_lt}
+        self.calls.append(call)
+        start = 0
+        if lt is not None:
+            # как у настоящего API: пара lt/hash должна указывать на существующую транзакцию
+            start = next(i for i, tx in enumerate(self.txs) if _tid(tx) == (int(lt), hash_))
+        out = []
+        for tx in self.txs[start:]:
+            if self.honor_to_lt and to_lt is not None and _tid(tx)[0] <= int(to_lt):
+                break
+            out.append(tx)
+            if len(out) >= limit:
+                break
+        call["page"] = out
+        return out
+
+
+def _fetch(address: str, cursor, fetch, limit: int, monkeypatch) -> List[Dict[str, Any]]:
+    monkeypatch.setattr(tw.settings, "ton_page_limit", limit)
+    return asyncio.run(tw.fetch_new_transactions(address, cursor, fetch))
+
+
+def test_without_cursor_takes_only_first_page(recorded, monkeypatch):
+    replay = Replay(recorded["transactions"])
+    got = _fetch(recorded["address"], None, replay, 5, monkeypatch)
+    assert len(replay.calls) == 1
+    assert [_tid(t) for t in got] == [_tid(t) for t in reversed(replay.txs[:5])]
+
+
+@pytest.mark.parametrize("limit", [3, 5, 7, 100])
+def test_multi_page_stops_at_cursor(recorded, monkeypatch, limit):
+    replay = Replay(recorded["transactions"])
+    cursor = _tid(replay.txs[17])
+    got = _fetch(recorded["address"], cursor, replay, limit, monkeypatch)
+
+    # все транзакции новее курсора, от старых к новым, без повторов
+    assert [_tid(t) for t in got] == [_tid(t) for t in reversed(replay.txs[:17])]
+    # следующая страница начинается с lt/hash последней транзакции предыдущей
+    assert replay.calls[0]["lt"] is None
+    for call in replay.calls:
+        assert call["to_lt"] == str(cursor[0])
+    for prev, call in zip(replay.calls, replay.calls[1:]):
+        last_lt, last_hash = _tid(prev["page"][-1])
+        assert (call["lt"], call["hash"]) == (str(last_lt), last_hash)
+    assert len(replay.calls) <= 17 // max(1, limit - 1) + 2
+
+
+def test_stops_at_cursor_when_api_ignores_to_lt(recorded, monkeypatch):
+    replay = Replay(recorded["transactions"], honor_to_lt=False)
+    cursor = _tid(replay.txs[6])
+    got = _fetch(recorded["address"], cursor, replay, 4, monkeypatch)
+    assert [_tid(t) for t in got] == [_tid(t) for t in reversed(replay.txs[:6])]
+    # дальше курсора не листаем
+    assert all(call["lt"] is None or int(call["lt"]) > cursor[0] for call in replay.calls)
+
+
+def test_cursor_at_newest_returns_nothing(recorded, monkeypatch):
+    replay = Replay(recorded["transactions"], honor_to_lt=False)
+    got = _fetch(recorded["address"], _tid(replay.txs[0]), replay, 5, monkeypatch)
+    assert got == []
+    assert len(replay.calls) == 1
+
+
+def test_same_lt_as_cursor_is_not_redelivered(recorded, monkeypatch):
+    # курсор с тем же lt, но хэшем, которого в цепочке нет: транзакция с этим lt уже обработана
+    replay = Replay(recorded["transactions"], honor_to_lt=False)
+    lt, _ = _tid(replay.txs[4])
+    got = _fetch(recorded["address"], (lt, "other-hash"), replay, 3, monkeypatch)
+    assert [_tid(t) for t in got] == [_tid(t) for t in reversed(replay.txs[:4])]
+
+
+def test_page_overlap_is_deduplicated(recorded, monkeypatch):
+    # страница целиком из уже виденных транзакций (кроме первой) не зацикливает проход
+    txs = sorted(recorded["transactions"], key=_tid, reverse=True)
+    calls = []
+
+    async def sticky(address, limit=10, lt=None, hash_=None, to_lt=None):
+        calls.append(lt)
+        return txs[:limit]  # API игнорирует lt/hash и отдаёт одну и ту же страницу
+
+    got = _fetch(recorded["address"], _tid(txs[-1]), sticky, 5, monkeypatch)
+    assert [_tid(t) for t in got] == [_tid(t) for t in reversed(txs[:5])]
+    assert len(calls) == 2
+
+
+def test_exact_multiple_of_limit(recorded, monkeypatch):
+    replay = Replay(recorded["transactions"])
+    cursor = _tid(replay.txs[10])
+    got = _fetch(recorded["address"], cursor, replay, 5, monkeypatch)
+    assert len(got) == 10
+    assert len({_tid(t) for t in got}) == 10
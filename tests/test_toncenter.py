@@ -0,0 +1,49 @@
+# tests/test_toncenter.py
+import asyncio
+
+import httpx
+
+from app import toncenter
+from app.toncenter import ToncenterClient
+
+
+def _client(handler, **kw) -> ToncenterClient:
+    kw.setdefault("backoff_base", 0.0)
+    return ToncenterClient(
+        ["http://primary/api/v2", "http://backup/api/v2"],
+        rps=1000, transport=httpx.MockTransport(handler), **kw,
+    )
+
+
+def test_retry_fails_over_to_next_endpoint():
+    hosts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        hosts.append(request.url.host)
+        if request.url.host == "primary":
+            return httpx.Response(502)
+        return httpx.Response(200, json={"ok": True, "result": {"last": {"seqno": 7}}})
+
+    client = _client(handler)
+    assert asyncio.run(client.get_masterchain_seqno()) == 7
+    assert hosts == ["primary", "backup"]
+
+
+def test_retry_after_is_capped(monkeypatch):
+    slept = []
+
+    async def fake_sleep(delay):
+        slept.append(delay)
+
+    monkeypatch.setattr(toncenter.asyncio, "sleep", fake_sleep)
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.host)
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"Retry-After": "86400"})
+        return httpx.Response(200, json={"ok": True, "result": {"last": {"seqno": 1}}})
+
+    client = ToncenterClient(["http://only/api/v2"], rps=1000, retry_after_cap=5.0, transport=httpx.MockTransport(handler))
+    asyncio.run(client.get_masterchain_seqno())
+    assert slept == [5.0]
@@ -0,0 +1,17 @@
+# tests/test_users.py
+from app.users import MAX_USER_ID, parse_referrer
+
+
+def test_parse_referrer():
+    assert parse_referrer("ref42") == 42
+    assert parse_referrer(f"ref{MAX_USER_ID}") == MAX_USER_ID
+    assert parse_referrer("promo") is None
+    assert parse_referrer("ref") is None
+    assert parse_referrer("ref-1") is None
+    assert parse_referrer(None) is None
+
+
+def test_parse_referrer_rejects_ids_beyond_int4():
+    # ref9999999999 переполнил бы CAST(:referrer_id AS integer) и сломал /start
+    assert parse_referrer("ref9999999999") is None
+    assert parse_referrer(f"ref{MAX_USER_ID + 1}") is None
@@ -0,0 +1,126 @@
+# tests/test_withdrawals.py
+"""
+Машина состояний выводов на настоящей БД против bench.fake_wallet.
+
+    TEST_DATABASE_URL=postgresql://... python -m pytest tests/test_withdrawals.py
+
+Нужна отдельная база с применёнными миграциями: тесты очищают таблицы
+пользователей, балансов и выводов. Без TEST_DATABASE_URL — пропускаются.
+"""
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+
+from app import db as _db, services, withdrawals as wd
+from app.models import Balance, LedgerEntry, User, Withdrawal, WithdrawalBatch
+from app.money import to_nano
+from bench.fake_wallet import FakeWallet
+
+DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+needs_db = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL не задан")
+
+
+def test_ledger_upsert_locks_balances_in_user_id_order():
+    captured = []
+
+    class Session:
+        async def execute(self, stmt):
+            captured.append(str(stmt.compile(dialect=postgresql.dialect())))
+            return type("R", (), {"all": lambda self: []})()
+
+    entries = [{"user_id": u, "amount": 1, "kind": "deposit", "ref_id": u} for u in (3, 1, 2)]
+    asyncio.run(services.apply_ledger(Session(), entries))
+    assert "ORDER BY ins.user_id" in captured[0]
+
+
+async def _setup(balances, requests):
+    """Пользователи с балансами (через журнал) и заявки на вывод; возвращает user_id по порядку."""
+    _db.init_async_db(DATABASE_URL)
+    async with _db.AsyncSessionLocal() as db:
+        await db.execute(text(
+            "TRUNCATE withdrawals, withdrawal_batches, ledger_entries, balances, users RESTART IDENTITY CASCADE"
+        ))
+        ids = []
+        for i, amount in enumerate(balances):
+            user_id = (await db.execute(
+                postgresql.insert(User).values(tg_id=1000 + i, language="ru").returning(User.id)
+            )).scalar_one()
+            await services.credit_balance(db, user_id, amount, kind="opening", ref_id=user_id)
+            ids.append(user_id)
+        for n, (i, amount) in enumerate(requests):
+            db.add(Withdrawal(user_id=ids[i], amount=amount, address=f"EQdest-{n}", comment=f"w{n}", status="pending"))
+        await db.commit()
+    return ids
+
+
+async def _state():
+    async with _db.AsyncSessionLocal() as db:
+        balances = dict((await db.execute(select(Balance.user_id, Balance.amount))).all())
+        statuses = sorted((await db.execute(select(Withdrawal.status))).scalars().all())
+        batches = (await db.execute(select(WithdrawalBatch.status))).scalars().all()
+        refunds = (await db.execute(select(LedgerEntry.id).where(LedgerEntry.kind == "refund"))).scalars().all()
+    return balances, statuses, batches, len(refunds)
+
+
+def _run(scenario):
+    async def wrapped():
+        try:
+            return await scenario()
+        finally:
+            await _db.dispose_async_db()
+    return asyncio.run(wrapped())
+
+
+@needs_db
+def test_claim_rejects_overdraft_and_confirms():
+    async def scenario():
+        a, b = await _setup([to_nano("5"), to_nano("1")], [(0, to_nano("2")), (0, to_nano("2")), (1, to_nano("3"))])
+        wallet = FakeWallet()
+        sender = wd.HttpWithdrawalSender("http://fake-wallet", transport=wallet.transport())
+        batch_id, messages = await wd.claim_batch(10)
+        assert len(messages) == 2
+        balances, statuses, _, _ = await _state()
+        # у второго пользователя не хватило баланса — заявка rejected, баланс не тронут
+        assert balances == {a: to_nano("1"), b: to_nano("1")}
+        assert statuses == ["processing", "processing", "rejected"]
+
+        assert await wd.submit_batch(sender, batch_id, messages)
+        assert await wd.confirm_batches(sender) == (1, 0)
+        await sender.aclose()
+        return wallet
+
+    wallet = _run(scenario)
+    # query_id = id пачки: один перевод на обе заявки
+    assert list(wallet.transfers) == [1]
+
+
+@needs_db
+def test_failed_batch_is_refunded_once():
+    async def scenario():
+        (a,) = await _setup([to_nano("5")], [(0, to_nano("2")), (0, to_nano("1"))])
+        sender = wd.HttpWithdrawalSender("http://fake-wallet", transport=FakeWallet(fail_rate=1.0).transport())
+        batch_id, messages = await wd.claim_batch(10)
+        assert await wd.submit_batch(sender, batch_id, messages)
+        assert await wd.confirm_batches(sender) == (0, 1)
+        # повторный проход (второй воркер, ретрай) второй раз не возвращает
+        assert await wd.confirm_batches(sender) == (0, 0)
+        async with _db.AsyncSessionLocal() as db:
+            refunds = (await db.execute(
+                select(Withdrawal.id, Withdrawal.user_id, Withdrawal.amount).where(Withdrawal.batch_id == batch_id)
+            )).all()
+            # и повтор самого возврата по тем же заявкам — no-op по (kind, ref_id)
+            await services.apply_ledger(db, [
+                {"user_id": user_id, "amount": amount, "kind": "refund", "ref_id": wid} for wid, user_id, amount in refunds
+            ])
+            await db.commit()
+        await sender.aclose()
+        return a, await _state()
+
+    a, (balances, statuses, batches, refunds) = _run(scenario)
+    assert balances == {a: to_nano("5")}
+    assert statuses == ["failed", "failed"]
+    assert batches == ["failed"]
+    assert refunds == 2